@@ -26,23 +26,67 @@ import tkinter as tk
 import random
 import math
 import time
-from queue import PriorityQueue
+import heapq
 import threading
 import json
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import gc
-import sys
+import os
+import argparse
+from array import array
+from collections import deque, OrderedDict
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 # ----------- Global configurations and variables ------------- #
 
-# Increasing recursion limit to handle deeper call stacks
-sys.setrecursionlimit(3000)  # Default is 1000, increasing to 3000
-
 # Global dictionary to track active experiments
 active_experiments = {}
 
+# Per-tick status messages from the bots and brains - off by default so headless trials aren't slowed down by printing
+verbose_logging = False
+
+# Simulated length of one tick in milliseconds - also the canvas.after delay when the simulation is rendered
+tick_duration_ms = 50
+
+# Occupancy grid flags - one bit per occupied_cells layer
+DEPOT_FLAG = 1
+CHARGER_FLAG = 2
+DELIVERY_FLAG = 4
+OBSTACLE_FLAG = 8
+AGENT_FLAG = 16
+LAYER_FLAGS = (DEPOT_FLAG, CHARGER_FLAG, DELIVERY_FLAG, OBSTACLE_FLAG, AGENT_FLAG)  # indexed like occupied_cells
+STATIC_FLAGS = DEPOT_FLAG | CHARGER_FLAG | DELIVERY_FLAG | OBSTACLE_FLAG  # cells no bot can path through
+
+# Directions a bot can face - grid step (up, right, down, left) to the angle it is drawn at
+HEADINGS = {(0, -1): math.radians(0), (1, 0): math.radians(90), (0, 1): math.radians(180), (-1, 0): math.radians(270)}
+
+# Map types a sweep runs every trial on
+sweep_grid_types = ("urban", "suburban", "rural")
+
+# shortest_path uses Jump Point Search instead of A* on maps where at most this share of cells is taken
+jps_max_density = 0.3
+
+# Maps at least this wide plan with HierarchicalPlanner instead of the DistanceTables, whose fields would take
+# len(goals) x cells of memory
+hierarchical_min_size = 200
+
+# Lifelong trials run this many ticks, and leave the first lifelong_warmup share of them out of the steady-state
+# throughput and latency
+lifelong_ticks = 50_000
+lifelong_warmup = 0.2
+
+# Battery a bot keeps in hand on top of what a leg and the flight on to the charger take, as a share of that energy -
+# for waits, replans around other bots and paths longer than the shortest one
+leg_energy_margin = 0.25
+
+# Level the threshold charging policy charges to, and the level the cccv charging curve switches from constant current
+# to constant voltage at, as shares of the whole battery (see ChargingPolicy)
+charge_threshold = 0.8
+cc_limit = 0.8
+
 
 # ------------------ Code for visualising results ----------- #
 def analyse_results(json_file_path="results.json"):
@@ -52,12 +96,22 @@ def analyse_results(json_file_path="results.json"):
     with open(json_file_path, 'r') as f:
         result_data = json.load(f)
 
+    # Errored trials have no results to analyse - they're left out and counted
+    errored = 0
+    for counts in result_data.values():
+        for bot_count, trials in counts.items():
+            completed = [trial for trial in trials if "error" not in trial]
+            errored += len(trials) - len(completed)
+            counts[bot_count] = completed
+    if errored:
+        print(f"Leaving out {errored} errored trial(s)")
+
     # ------- Time vs Agent Graph ------ #
     data = []
 
     for env in ["urban", "suburban", "rural"]:
         for count in [1, 3, 5, 8]:
-            if env in result_data and str(count) in result_data[env]:
+            if result_data.get(env, {}).get(str(count)):
                 trials = result_data[env][str(count)]
                 avg_time = np.mean([trial["completion_time"] for trial in trials])
                 std_dev = np.std([trial["completion_time"] for trial in trials])
@@ -69,6 +123,10 @@ def analyse_results(json_file_path="results.json"):
                     "Standard Deviation": std_dev
                 })
 
+    if not data:
+        print("No completed trials to analyse")
+        return
+
     # Create DataFrame
     df = pd.DataFrame(data)
 
@@ -83,7 +141,7 @@ def analyse_results(json_file_path="results.json"):
     # Customizing the chart
 
     plt.xlabel('Number of Agents', fontsize=14)
-    plt.ylabel('Completion Time (seconds)', fontsize=14)
+    plt.ylabel('Completion Time (simulated seconds)', fontsize=14)
     plt.title('Average Delivery Completion Time \nby Environment and Agent Count', fontsize=16)
     plt.grid(True, linestyle='--', alpha=0.7)
     plt.legend(title="Environment")
@@ -109,7 +167,7 @@ def analyse_results(json_file_path="results.json"):
 
     for env in ["urban", "suburban", "rural"]:
         for count in [1, 3, 5, 8]:
-            if env in result_data and str(count) in result_data[env]:
+            if result_data.get(env, {}).get(str(count)):
                 trials = result_data[env][str(count)]
                 avg_bot_failures = np.mean([trial["bots_failed"] for trial in trials])  # avg of bots that died
                 perc_bot_failures = (avg_bot_failures / count) * 100  # percentage
@@ -147,23 +205,60 @@ def analyse_results(json_file_path="results.json"):
 
 
 class Brain:
-    def __init__(self, botp, occupied_cells, delivery_list, delivery_manager, cell_manager):
+    __slots__ = ("bot", "all_occupied_cells", "depot", "chargers", "delivery_points", "target_changed", "delivery_list",
+                 "current_path", "field_target", "prefetched_step", "current_delivery", "waiting_threshold_counter",
+                 "delivery_manager", "cell_manager", "path_cache", "distance_tables", "coordinator", "incremental",
+                 "dstar", "bot_cells", "searches", "hierarchy", "waypoints", "repairs", "path_target",
+                 "blocked_targets", "rng", "route", "slots", "blocked_replans")
+
+    def __init__(self, botp, occupied_cells, delivery_list, delivery_manager, cell_manager, path_cache=None,
+                 distance_tables=None, coordinator=None, incremental=False, hierarchy=None, rng=None, slots=None):
         self.bot = botp
         self.all_occupied_cells = occupied_cells
         self.depot = occupied_cells[0]
-        self.charger = occupied_cells[1]
+        self.chargers = occupied_cells[1]
         self.delivery_points = occupied_cells[2]
         self.target_changed = True
         self.delivery_list = delivery_list
-        self.current_path = []
+        self.current_path = deque()  # cells still to visit - the first is the one the bot is in
+        self.field_target = None  # target whose distance field is being followed instead of a stored path
+        self.prefetched_step = None  # (current cell, target, next cell) looked up in the fleet's batch this tick
         self.current_delivery = None
         self.waiting_threshold_counter = 0
+        self.blocked_replans = 0  # joint plans in a row that left the bot waiting for a held cell
         self.delivery_manager = delivery_manager
         self.cell_manager = cell_manager
+        self.path_cache = path_cache
+        self.distance_tables = distance_tables
+        self.coordinator = coordinator  # multi-agent planner - None plans each bot independently
+        self.incremental = incremental  # plan with D* Lite around neighbouring bots (see follow_incremental_path)
+        self.dstar = None  # D* Lite search towards path_target
+        self.bot_cells = set()  # cells the D* Lite search treats as held by other bots (see sense_bots)
+        self.searches = 0  # new D* Lite searches
+        self.hierarchy = hierarchy  # HPA* planner on city-scale maps
+        self.waypoints = deque()  # abstract waypoints of the current path that aren't refined into cells yet
+        self.repairs = 0  # replans that repaired the current search instead
+        self.path_target = None  # target of current_path
         self.blocked_targets = []
-
-    def get_delivery_target(self):
-        return self.delivery_manager.get_delivery_target()
+        self.rng = rng or random.Random(botp.bot_name)  # target choices - seeded per bot so a trial can be replayed
+        self.route = deque()  # delivery points of the packages on board, the one being delivered first
+        self.slots = slots or SlotScheduler(occupied_cells, distance_tables)  # charger and depot bays
+
+    def get_delivery_target(self, current_x, current_y):
+        """
+        Next drop-off of the packages on board - loading them from the delivery manager if there are none. A drop-off
+        stays on the route until it's made, so a bot that breaks off to charge goes back to the same one
+        """
+        if not self.route:
+            self.route.extend(self.delivery_manager.get_delivery_targets(self, (current_x, current_y)))
+        return self.route[0] if self.route else (None, None)
+
+    def drop_off(self, delivered=True):
+        """Takes the current drop-off off the route (made, or given up as walled in). True if packages are left"""
+        if self.route:
+            self.route.popleft()
+            self.delivery_manager.dropped_off(self, delivered)
+        return bool(self.route)
 
     def release_cell(self, xycoord):
         return self.cell_manager.release_cell(xycoord)
@@ -171,74 +266,162 @@ class Brain:
     def reserve_cell(self, xyxoord):
         return self.cell_manager.reserve_cell(xyxoord)
 
-    # Calls A* algorithm and returns best path to target
+    # Reads the path from the precomputed distance tables if the target has one, otherwise calls A* algorithm (or
+    # Jump Point Search on open maps, through the shared path cache if there is one) and returns best path to target
     def find_path(self, current_x, current_y, target_x, target_y, occupied_cells, noOfRowsCols):
-        return a_star(current_x, current_y, target_x, target_y, occupied_cells, noOfRowsCols)
+        self.waypoints.clear()
+        if self.coordinator is not None:
+            return self.coordinator.plan(self, current_x, current_y, target_x, target_y)
+        if self.incremental:
+            return self.incremental_path(current_x, current_y, target_x, target_y)
+        if self.distance_tables is not None and self.distance_tables.has_field(target_x, target_y):
+            return self.distance_tables.path(current_x, current_y, target_x, target_y)
+        if self.hierarchy is not None:
+            return self.hierarchical_path(current_x, current_y, target_x, target_y)
+        if self.path_cache is not None:
+            return self.path_cache.find_path(current_x, current_y, target_x, target_y)
+        return shortest_path(current_x, current_y, target_x, target_y, occupied_cells, noOfRowsCols)
+
+    def hierarchical_path(self, current_x, current_y, target_x, target_y):
+        """First legs of an HPA* path - the rest stay waypoints until the bot gets near them (see refine_waypoints)"""
+        waypoints = self.hierarchy.abstract_path(current_x, current_y, target_x, target_y)
+        if waypoints is None:
+            return None
+        self.waypoints = deque(waypoints[1:])
+        return self.refine_waypoints([waypoints[0]])
+
+    def refine_waypoints(self, path):
+        """Refines the next legs onto the end of path until it is at least a cluster wide"""
+        while self.waypoints and len(path) <= self.hierarchy.cluster_size:
+            leg = self.hierarchy.refine(path[-1], self.waypoints.popleft())
+            if leg is None:  # the map changed under the waypoints - plan again when this path runs out
+                self.waypoints.clear()
+                break
+            path.extend(leg[1:])
+        return path
+
+    def incremental_path(self, current_x, current_y, target_x, target_y):
+        """D* Lite path to the target - the search is kept while the target stays the same, so replans only repair it"""
+        if self.dstar is None or self.dstar.target != (target_x, target_y):
+            self.dstar = DStarLite(self.all_occupied_cells, target_x, target_y)
+            self.bot_cells = set()
+            self.searches += 1
+        return self.dstar.plan(current_x, current_y, self.sense_bots(current_x, current_y))
+
+    def sense_bots(self, current_x, current_y):
+        """
+        Cells the D* Lite search treats as held by other bots. The neighbouring cells are checked every step, and a
+        bot that was seen stays in the way until this bot is next to its cell again and sees it gone - forgetting it
+        as soon as it is out of sight makes two bots step aside and back again forever. Every bot can share the
+        starting point, so it never counts
+        """
+        occupied_cells = self.all_occupied_cells
+        neighbours = set(finding_free_neighbours(current_x, current_y, occupied_cells.noOfRowsCols, occupied_cells))
+        neighbours.discard((occupied_cells.noOfRowsCols - 1, 0))
+        held = {(x, y) for x, y in neighbours if occupied_cells.has_flag(x, y, AGENT_FLAG)}
+        self.bot_cells = (self.bot_cells - neighbours) | held
+        return self.bot_cells
+
+    def can_fly_leg(self, battery, current_x, current_y, target, then_charge=True):
+        """
+        Energy check before a leg - True if the bot can fly to target and then on to a charger (unless then_charge
+        is False - the last leg home) with leg_energy_margin to spare, going by the precomputed distance tables (a
+        cell takes steps_per_cell battery). Without distance tables the fixed 1000 threshold is used instead
+        """
+        tables = self.distance_tables
+        if tables is None or not tables.has_field(target[0], target[1]):
+            return battery > 1000
+        if battery >= 7000:  # a full battery is as good as it gets - legs too long for it are flown anyway
+            return True
+        to_target = tables.distance(current_x, current_y, target[0], target[1])
+        to_charger = 0
+        if then_charge:
+            to_charger = min((steps for steps in (tables.poi_distance(target[0], target[1], x, y)
+                                                  for x, y in self.chargers) if steps is not None), default=None)
+        if to_target is None or to_charger is None:
+            return True  # the path planning deals with targets that can't be reached
+        return battery >= (to_target + to_charger) * self.bot.steps_per_cell * (1 + leg_energy_margin)
+
+    def can_serve_any_delivery(self, battery, current_x, current_y, noOfRowsCols):
+        """True if the bot could fly from here to any delivery point and on to a charger (see can_fly_leg)"""
+        return all(self.can_fly_leg(battery, current_x, current_y, neighbour)
+                   for point in self.delivery_points
+                   for neighbour in finding_free_neighbours(point[0], point[1], noOfRowsCols, self.all_occupied_cells))
+
+    def go_to_charger(self, battery, current_x, current_y):
+        log(f"Low battery - {self.bot.bot_name} is going to charge")
+        # Booking a charger bay - bots queue for a busy one instead of crowding round it
+        bay = self.slots.book(self.bot, "charger", (current_x, current_y), battery)
+        if bay is None:
+            log(f"No spots free to charge - {self.bot.bot_name} is waiting")
+            return None, None
+        self.bot.isCharging = True
+        self.bot.charge_target = self.slots.charge_target(self.bot)
+        return bay
 
     def determine_target(self, battery, hasPackage, current_x, current_y, noOfRowsCols):
-        """Decides where the drone should go next based on current state"""
-
-        # Battery check
-        if battery <= 1000:
-            print(f"Low battery - {self.bot.bot_name} is going to charge")
-            # Finding free neighbours of the charger
-            neighbours = finding_free_neighbours(self.charger[0], self.charger[1], noOfRowsCols,
-                                                 self.all_occupied_cells)
-            if len(neighbours) == 0:
-                print(f"No spots free to charge - {self.bot.bot_name} is going to charge")
-                return None, None
-            else:
-                # Randomisation by bot name to further help multiple bots picking the same cell
-                random.seed(hash(self.bot.bot_name) + time.time())
-                choice = random.choice(neighbours)
-                self.bot.isCharging = True
-                return choice
+        """
+        Decides where the drone should go next based on current state. Each leg - to the depot, a delivery or home -
+        is only started if the bot could still reach the charger after it (can_fly_leg), otherwise the bot charges
+        first and keeps any packages on board for after
+        """
+
+        # Battery check - a bot that has set off to charge sees it through
+        if self.bot.isCharging or (self.distance_tables is None and battery <= 1000):
+            return self.go_to_charger(battery, current_x, current_y)
 
         # No package - go to depot
         if not hasPackage:
-            # Check free neighbours for both cells that hold depot - separately
-            neighbours1 = finding_free_neighbours(self.depot[0][0], self.depot[0][1], noOfRowsCols,
-                                                  self.all_occupied_cells)
-            neighbours2 = finding_free_neighbours(self.depot[1][0], self.depot[1][1], noOfRowsCols,
-                                                  self.all_occupied_cells)
-            total_neighbours = neighbours1 + neighbours2
-
-            if len(total_neighbours) == 0:
-                print(f"{self.bot.bot_name} is waiting - no depot spaces available")
+            # Booking a depot bay - bots queue for a busy one instead of crowding round it
+            choice = self.slots.book(self.bot, "depot", (current_x, current_y), battery)
+            if choice is None:
+                log(f"{self.bot.bot_name} is waiting - no depot spaces available")
                 return None, None
-            else:
-                # Randomisation by bot name to further help multiple bots picking the same cell
-                random.seed(hash(self.bot.bot_name) + time.time())
-                choice = random.choice(total_neighbours)
-                print(f"{self.bot.bot_name} is going to depot: {choice}")
-                return choice
+            if not self.can_fly_leg(battery, current_x, current_y, choice):
+                return self.go_to_charger(battery, current_x, current_y)  # drops the depot booking
+            log(f"{self.bot.bot_name} is going to depot: {choice}")
+            return choice
 
         # Has package - deliver
         if hasPackage:
-            delivery_target = self.get_delivery_target()
+            delivery_target = self.get_delivery_target(current_x, current_y)
             if delivery_target and delivery_target != (None, None):  # A valid delivery point
                 # Checking if the delivery target has a free neighbour
-                print(f"{self.bot.bot_name} is delivering to: {delivery_target}")
+                log(f"{self.bot.bot_name} is delivering to: {delivery_target}")
                 neighbours = finding_free_neighbours(delivery_target[0], delivery_target[1], noOfRowsCols,
                                                      self.all_occupied_cells)
+                if self.distance_tables is not None:  # cut off by obstacles counts as walled in too
+                    neighbours = [(x, y) for x, y in neighbours if not self.distance_tables.has_field(x, y) or
+                                  self.distance_tables.distance(current_x, current_y, x, y) is not None]
 
                 if neighbours:
-                    # Randomisation by bot name to further help multiple bots picking the same cell
-                    random.seed(hash(self.bot.bot_name) + time.time())
-                    choice = random.choice(neighbours)
+                    # Each bot draws from its own generator so bots picking from the same cells spread out
+                    choice = self.rng.choice(neighbours)
+                    if not self.can_fly_leg(battery, current_x, current_y, choice):
+                        return self.go_to_charger(battery, current_x, current_y)
                     self.current_delivery = choice
                     return choice
                 else:
                     self.blocked_targets.append(delivery_target)
-                    return None, 1  # must be blocked by 4 static obstacles
+                    self.drop_off(delivered=False)
+                    return None, 1  # must be blocked by static obstacles
+
+            elif self.delivery_manager.lifelong:
+                # Waiting hovers, which drains the battery - an idle bot tops up while it can't serve every point
+                if not self.can_serve_any_delivery(battery, current_x, current_y, noOfRowsCols):
+                    return self.go_to_charger(battery, current_x, current_y)
+                log(f"{self.bot.bot_name} is waiting for delivery requests")
+                return None, None
 
             else:
                 # No valid delivery target
-                print(f"{self.bot.bot_name} is going to starting point - no more packages to deliver")
+                log(f"{self.bot.bot_name} is going to starting point - no more packages to deliver")
 
                 # The bot's starting position
                 start_x = noOfRowsCols - 1
                 start_y = 0
+                if not self.can_fly_leg(battery, current_x, current_y, (start_x, start_y), then_charge=False):
+                    return self.go_to_charger(battery, current_x, current_y)
 
                 # Make sure the colour is set back to pink
                 self.bot.bot_colour = "pink"
@@ -249,9 +432,97 @@ class Brain:
 
         return current_x, current_y  # Default fallback
 
+    def next_field_step(self, current_x, current_y):
+        """Next step down the distance field of field_target - from this tick's batch lookup if there was one"""
+        prefetched, self.prefetched_step = self.prefetched_step, None
+        if prefetched is not None and prefetched[0] == (current_x, current_y) and prefetched[1] == self.field_target:
+            return prefetched[2]
+        return self.distance_tables.next_step(current_x, current_y, self.field_target[0], self.field_target[1])
+
+    def follow_coordinated_path(self, current_x, current_y):
+        """
+        Steps along a space-time path from the multi-agent planner. A repeated cell means wait there for one step,
+        which is returned as (None, None). Bots don't reach cell centres in lockstep, so the bot also waits if
+        another bot still holds its next cell, and asks for a new joint plan if that goes on too long. If more than 3
+        new plans in a row leave it waiting - a jam the planner can't untangle, like a queue for a dead-end cell with a
+        bot in it that has to come out past them - it flies on over the other bot like an independent planner would.
+        Windowed paths end short of the target, so the bot plans its next window when it reaches the end of one
+        """
+        if len(self.current_path) == 1 and (current_x, current_y) != self.path_target:
+            # End of a planning window - plan the next one
+            path = self.coordinator.plan(self, current_x, current_y, self.path_target[0], self.path_target[1])
+            if path is None or len(path) == 1:
+                self.bot.wait_for_step()
+                return None, None
+            self.current_path = deque(path)
+
+        if len(self.current_path) == 1:  # At the target - stay here this step, like the last cell of a path
+            self.current_path.clear()
+            return current_x, current_y
+
+        next_step = self.current_path[1]
+        if next_step == (current_x, current_y):  # planned wait
+            self.current_path.popleft()
+            self.bot.wait_for_step()
+            return None, None
+
+        if self.coordinator.is_held_by_other_bot(next_step[0], next_step[1]):
+            self.waiting_threshold_counter += 1
+            if self.waiting_threshold_counter > 3:
+                self.waiting_threshold_counter = 0
+                self.blocked_replans += 1
+                if self.blocked_replans > 3:
+                    log(f"{self.bot.bot_name} is still stuck behind {next_step}, flying on over the other bot")
+                    self.blocked_replans = 0
+                    self.current_path.popleft()
+                    return next_step[0], next_step[1]
+                log(f"{self.bot.bot_name} waited too long for {next_step}, replanning")
+                path = self.coordinator.plan(self, current_x, current_y, self.path_target[0], self.path_target[1])
+                if path is not None:
+                    self.current_path = deque(path)
+            self.bot.wait_for_step()
+            return None, None
+
+        self.waiting_threshold_counter = 0
+        self.blocked_replans = 0
+        self.current_path.popleft()  # Remove the cell bot is leaving
+        return next_step[0], next_step[1]
+
+    def follow_incremental_path(self, current_x, current_y):
+        """
+        Steps along the D* Lite path. Neighbouring cells held by other bots count as blocked, so when a bot moves in
+        the way, or the map changes, the search repairs the path around it instead of starting again. With no way
+        round the bot waits, and after waiting more than 3 steps it forgets the other bots and flies on over them
+        like an independent planner would
+        """
+        sensed_cells = self.sense_bots(current_x, current_y)
+        if self.waiting_threshold_counter > 3:
+            log(f"{self.bot.bot_name} waited too long, flying on over the other bots")
+            self.waiting_threshold_counter = 0
+            sensed_cells = self.bot_cells = set()
+
+        if self.waiting_threshold_counter or self.dstar.needs_repair(sensed_cells):
+            self.repairs += 1
+            path = self.dstar.plan(current_x, current_y, sensed_cells)
+            if path is None:
+                if not sensed_cells:  # the map itself cut the target off - pick a new one
+                    self.target_changed = True
+                self.waiting_threshold_counter += 1
+                self.bot.wait_for_step()
+                return None, None
+            self.current_path = deque(path)
+
+        if len(self.current_path) > 1:
+            self.current_path.popleft()  # Remove the cell bot is leaving
+            next_step = self.current_path[0]
+        else:
+            next_step = self.current_path[0]  # At the target - stay here this step
+            self.current_path.clear()
+        return next_step[0], next_step[1]
+
     def get_next_move(self, current_x, current_y, battery, hasPackage, noOfRowsCols):
         """Handles Path Execution"""
-        if not self.current_path or self.target_changed:
+        if (not self.current_path and self.field_target is None) or self.target_changed:
             # Deciding the target
             target_x, target_y = self.determine_target(battery, hasPackage, current_x, current_y, noOfRowsCols)
 
@@ -262,18 +533,35 @@ class Brain:
                 if self.waiting_threshold_counter > 3:
                     self.target_changed = True
                     self.waiting_threshold_counter = 0
-                    print(f"{self.bot.bot_name} waited too long, recalculating path")
+                    log(f"{self.bot.bot_name} waited too long, recalculating path")
             elif (target_x, target_y) == (None, 1):  # blocked by static obstacles
                 self.delivery_list = [item for item in self.delivery_list if item not in self.blocked_targets]
                 return current_x, current_y
 
+            # Targets with a precomputed distance field are followed one step at a time - no path to store
+            if target_x is not None and target_y is not None and self.distance_tables is not None and \
+                    self.coordinator is None and not self.incremental and \
+                    self.distance_tables.has_field(target_x, target_y):
+                self.current_path = deque()
+                self.field_target = None
+                if self.distance_tables.distance(current_x, current_y, target_x, target_y) is None:
+                    log(f"{self.bot.bot_name} couldn't find path, staying still")
+                    self.bot.waiting = True
+                    self.waiting_threshold_counter += 1
+                    return current_x, current_y
+                self.field_target = (target_x, target_y)
+                self.target_changed = False
+                self.bot.waiting = False
+
             # Calculate the path
-            if target_x is not None and target_y is not None:  # Make sure x and y have been set
-                self.current_path = self.find_path(current_x, current_y, target_x, target_y, self.all_occupied_cells,
-                                                   noOfRowsCols)
+            elif target_x is not None and target_y is not None:  # Make sure x and y have been set
+                self.field_target = None
+                self.path_target = (target_x, target_y)
+                path = self.find_path(current_x, current_y, target_x, target_y, self.all_occupied_cells, noOfRowsCols)
+                self.current_path = None if path is None else deque(path)
                 # If no path is found
                 if self.current_path is None:
-                    print(f"{self.bot.bot_name} couldn't find path, staying still")
+                    log(f"{self.bot.bot_name} couldn't find path, staying still")
                     self.bot.waiting = True
                     self.waiting_threshold_counter += 1
                     return current_x, current_y
@@ -285,10 +573,30 @@ class Brain:
         if self.bot.waiting:
             return current_x, current_y
 
+        # Following a distance field
+        if self.field_target is not None:
+            next_step = self.next_field_step(current_x, current_y)
+            if next_step is None:  # At the target - stay here this step, like the last cell of a path
+                self.field_target = None
+                return current_x, current_y
+            return next_step[0], next_step[1]
+
+        # Following a collision-free path from the multi-agent planner
+        if self.coordinator is not None and self.current_path:
+            return self.follow_coordinated_path(current_x, current_y)
+
+        # Following a D* Lite path, repaired around bots that get in the way
+        if self.incremental and self.current_path:
+            return self.follow_incremental_path(current_x, current_y)
+
+        # Refining the next legs of a hierarchical path as the bot gets near them
+        if self.waypoints and self.current_path:
+            self.refine_waypoints(self.current_path)
+
         # Following the path
         if self.current_path and len(self.current_path) > 0:
             if len(self.current_path) > 1:  # Make sure there's at least 2 elements
-                self.current_path.pop(0)  # Remove the cell bot is leaving
+                self.current_path.popleft()  # Remove the cell bot is leaving
                 next_step = self.current_path[0]
 
                 # --------- Commented code below was part of my attempt at collision avoidance for the bots --------- #
@@ -314,7 +622,7 @@ class Brain:
                 return next_step[0], next_step[1]
             else:
                 next_step = self.current_path[0]  # Use the last element without popping
-                self.current_path = []  # Clear the path
+                self.current_path.clear()  # Clear the path
                 return next_step[0], next_step[1]
 
         if self.current_path is None:
@@ -325,6 +633,13 @@ class Brain:
 
 
 class Bot:
+    __slots__ = ("launch_delay", "launch_countdown", "has_launched", "bot_name", "bot_colour", "grid_choice",
+                 "cell_size", "grid_x", "grid_y", "heading", "progress", "target_grid_x", "target_grid_y",
+                 "speed", "steps_per_cell", "steps_to_target", "ticks_per_step", "stopMoving", "target_reached", "current_reserve", "next_reserve",
+                 "waiting", "wait_counter", "battery", "isCharging", "bot_previous_target", "batteryRunOut",
+                 "hasPackage", "finishedPackages", "cells_travelled", "energy_used", "idle_ticks", "charging_ticks",
+                 "charge_target", "brain")
+
     def __init__(self, bot_name, grid_choice, cell_size, noOfRowsCols, bot_number):
         # launch initializations
         self.launch_delay = bot_number * 20  # 20 cycles delay per bot number
@@ -336,18 +651,26 @@ class Bot:
 
         self.grid_choice = grid_choice
         self.cell_size = cell_size
-        self.pixel_x = (noOfRowsCols - 1) * cell_size + (cell_size / 2)  # starting x-coordinate pixel of bot
-        self.pixel_y = 0 * cell_size + (cell_size / 2)  # starting y-coordinate pixel of bot
+        # Position - the grid cell the bot was last at the centre of, the direction it's facing and the number of
+        # speed-pixel steps it has made from that centre towards the next cell. All integers, so moving and arriving
+        # need no trig or float comparisons, and pixels are only worked out for drawing (see pixel_x)
+        self.grid_x = noOfRowsCols - 1
+        self.grid_y = 0
+        self.heading = (0, 1)  # starting heading - down
+        self.progress = 0
 
         # target positions
         self.target_grid_x = 0
         self.target_grid_y = 0
-        self.target_pixel_x = 0
-        self.target_pixel_y = 0
         self.speed = 2  # bot speed
 
-        # starting angle
-        self.theta = math.radians(180)
+        # Steps from one cell centre until within speed + 2 pixels of the next, where the bot goes to the exact
+        # centre - worked out once, so the same number of ticks is taken whatever the cell size
+        self.steps_per_cell = cell_size_steps(cell_size, self.speed)
+        self.steps_to_target = self.steps_per_cell
+
+        # Ticks to go from one cell centre to the next - one planning tick, then the moves (see move)
+        self.ticks_per_step = self.steps_per_cell + 1
 
         # stops the robots movement
         self.stopMoving = False
@@ -355,9 +678,9 @@ class Bot:
         # checks if the bot has made it to the next grid
         self.target_reached = True
 
-        # used for reserved cells monitoring
-        self.current_reserve = []
-        self.next_reserve = []
+        # used for reserved cells monitoring - (x, y) or None
+        self.current_reserve = None
+        self.next_reserve = None
 
         # used for when the bot has no neighbours and has to wait
         self.waiting = False
@@ -365,6 +688,7 @@ class Bot:
 
         # battery of the bot
         self.battery = 7000
+        self.charge_target = 7000  # level the bot charges to at its next charger (see ChargingPolicy)
         self.isCharging = False
         self.bot_previous_target = ""
         self.batteryRunOut = False
@@ -373,17 +697,108 @@ class Bot:
         self.hasPackage = False  # checks if the bot has a package
         self.finishedPackages = False  # checks if the packages are finished
 
+        # Simulated performance metrics (counted in ticks and grid cells, not wall-clock time)
+        self.cells_travelled = 0
+        self.energy_used = 0
+        self.idle_ticks = 0
+        self.charging_ticks = 0
+
     def thinkAndAct(self, noOfRowsCols):
-        print(f"\n--- {self.bot_name} STATUS ---")
-        current_grid_x, current_grid_y = pixel_to_grid(self.pixel_x, self.pixel_y, self.cell_size)
-        target_grid_x, target_grid_y = self.brain.get_next_move(current_grid_x, current_grid_y, self.battery,
+        log(f"\n--- {self.bot_name} STATUS ---")
+        target_grid_x, target_grid_y = self.brain.get_next_move(self.grid_x, self.grid_y, self.battery,
                                                                 self.hasPackage, noOfRowsCols)
         return target_grid_x, target_grid_y
 
+    # stays in the current cell for as long as a move to the next cell would take
+    def wait_for_step(self):
+        self.wait_counter = self.ticks_per_step - 2
+
     # connects the bot to the brain
     def setBrain(self, brainp):
         self.brain = brainp
 
+    @property
+    def pixel_x(self):
+        """Pixel position of the bot - for drawing and for working out which cell it is over mid-flight"""
+        return self.grid_x * self.cell_size + self.cell_size / 2 + self.progress * self.speed * self.heading[0]
+
+    @property
+    def pixel_y(self):
+        return self.grid_y * self.cell_size + self.cell_size / 2 + self.progress * self.speed * self.heading[1]
+
+    @property
+    def theta(self):
+        """Angle the bot is drawn at"""
+        return HEADINGS[self.heading]
+
+    def at_centre_of(self, cells):
+        """True if the bot is at the exact centre of one of the cells"""
+        return self.progress == 0 and (self.grid_x, self.grid_y) in cells
+
+    def cell_over(self, steps=0):
+        """Grid cell the bot is over after steps more moves towards the next cell centre"""
+        offset = (self.progress + steps) * self.speed
+        return pixel_to_grid(self.grid_x * self.cell_size + self.cell_size / 2 + offset * self.heading[0],
+                             self.grid_y * self.cell_size + self.cell_size / 2 + offset * self.heading[1],
+                             self.cell_size)
+
+    def quiet_ticks(self, noOfRowsCols, occupied_cells):
+        """
+        Number of coming ticks in which update() would only count down the launch delay or a wait, charge, or take
+        a step towards the next cell centre that doesn't get there - nothing the brains or the other bots act on, so
+        pass_quiet_ticks can do them all at once (see Simulation.advance). None if every coming tick is quiet
+        (powered down, or home with nothing left to deliver), 0 if the next tick needs update()
+        """
+        if not self.has_launched:
+            return self.launch_countdown
+
+        cell = (self.grid_x, self.grid_y)
+        charging_cells, depot_cells = occupied_cells.arrival_cells()
+        if self.progress == 0:
+            if not self.hasPackage and not self.isCharging and cell in depot_cells:
+                return 0  # picking up a package
+            if self.hasPackage and self.brain.current_delivery and tuple(self.brain.current_delivery) == cell:
+                return 0  # delivering it
+        charging = self.isCharging and self.at_centre_of(charging_cells)
+
+        if self.batteryRunOut:
+            return None if self.battery <= 0 and not charging else 0
+        if self.battery <= 0:
+            return 0  # powering down
+        if self.finishedPackages and self.at_centre_of(((noOfRowsCols - 1, 0),)):
+            return None if self.stopMoving and not charging else 0
+        if charging:
+            if not self.stopMoving or self.waiting:
+                return 0  # starting to charge, or queueing for the bay
+            # every tick until the one that charges the battery to its target
+            return max(0, self.brain.slots.charging.ticks_to_charge(self.battery, self.charge_target) - 1)
+        if self.stopMoving:
+            return 0
+        if self.waiting:
+            return self.wait_counter
+        if self.target_reached:
+            return 0  # picking the next cell
+        # Moves that don't reach the next cell centre and leave some battery
+        return max(0, min(self.steps_to_target - self.progress - 1, self.battery - 1))
+
+    def pass_quiet_ticks(self, ticks):
+        """Does what the given number of quiet ticks of update() would do (see quiet_ticks)"""
+        if not self.has_launched:
+            self.launch_countdown -= ticks
+        elif self.batteryRunOut or (self.stopMoving and not self.isCharging):  # powered down or home
+            self.waiting = self.wait_counter >= ticks
+            self.wait_counter = max(0, self.wait_counter - ticks)
+        elif self.stopMoving:  # charging
+            self.battery = self.brain.slots.charging.charge(self.battery, self.charge_target, ticks)
+            self.charging_ticks += ticks
+        elif self.waiting:
+            self.idle_ticks += ticks
+            self.wait_counter -= ticks
+        else:  # moving
+            self.progress += ticks
+            self.battery -= ticks
+            self.energy_used += ticks
+
     # draws the agent at its current position
     def draw(self, canvas, noOfRowsCols):
         bot_x_center = self.pixel_x
@@ -456,7 +871,7 @@ class Bot:
                            tags=self.bot_name)
 
     # what happens at each timestep
-    def update(self, canvas, noOfRowsCols, occupied_cells):
+    def update(self, noOfRowsCols, occupied_cells):
 
         # Handling launch delay - so all bots don't leave starting point at the same time
         if not self.has_launched:  # Waiting to be launched
@@ -465,17 +880,14 @@ class Bot:
                 return
             else:  # Bot is being launched
                 self.has_launched = True
-                print(f"{self.bot_name} has started moving")
+                log(f"{self.bot_name} has started moving")
 
         # Starting positions of the bots
         start_x = noOfRowsCols - 1
         start_y = 0
 
-        # Pixels of the starting point
-        starting_pixel_x1, starting_pixel_y1 = grid_to_pixel(start_x, start_y, self.cell_size)
-
         # If the bot is back to the starting point - stop
-        if [self.pixel_x, self.pixel_y] == [starting_pixel_x1, starting_pixel_y1] and self.finishedPackages:
+        if self.finishedPackages and self.at_centre_of(((start_x, start_y),)):
             self.stopMoving = True
             self.waiting = True
 
@@ -486,29 +898,34 @@ class Bot:
             self.waiting = True
             self.batteryRunOut = True
             self.bot_colour = "grey"
-            print(f"{self.bot_name} has powered down due to battery depletion at position "
+            log(f"{self.bot_name} has powered down due to battery depletion at position "
                   f"({int(self.pixel_x / self.cell_size)},{int(self.pixel_y / self.cell_size)})")
 
             # Stop at the center of the current grid cell
-            current_grid_x, current_grid_y = pixel_to_grid(self.pixel_x, self.pixel_y, self.cell_size)
-            target_pixel_x, target_pixel_y = grid_to_pixel(current_grid_x, current_grid_y, self.cell_size)
-            self.pixel_x = target_pixel_x
-            self.pixel_y = target_pixel_y
+            self.grid_x, self.grid_y = pixel_to_grid(self.pixel_x, self.pixel_y, self.cell_size)
+            self.progress = 0
+
+            # A powered down drone lands, so it gives up its reserved cells and other bots can fly over it
+            for reserved_cell in reserved_cells(self.current_reserve, self.next_reserve):
+                self.brain.release_cell(reserved_cell)
+            self.current_reserve = None
+            self.next_reserve = None
+            self.target_reached = True
+            self.brain.slots.release(self)
 
-        # Pixels of the charger's neighbours
-        charging_pixel_x1, charging_pixel_y1 = grid_to_pixel(occupied_cells[1][0], occupied_cells[1][1] + 1,
-                                                             self.cell_size)
-        charging_pixel_x2, charging_pixel_y2 = grid_to_pixel(occupied_cells[1][0] + 1, occupied_cells[1][1],
-                                                             self.cell_size)
+        # Bays next to the chargers and the depots where bots charge and pick up packages
+        charging_cells, depot_cells = occupied_cells.arrival_cells()
 
         # Charging
-        if ([self.pixel_x, self.pixel_y] == [charging_pixel_x1, charging_pixel_y1] or \
-            [self.pixel_x, self.pixel_y] == [charging_pixel_x2, charging_pixel_y2]) and self.isCharging:
+        if self.isCharging and self.at_centre_of(charging_cells) and self.use_bay("charger"):
 
             self.stopMoving = True
             self.bot_colour = "Purple"
-            self.battery = min(7000, self.battery + 5)  # Increase battery when at charger
-            if self.battery >= 7000:
+            # Increase battery when at charger
+            self.battery = self.brain.slots.charging.charge(self.battery, self.charge_target)
+            self.charging_ticks += 1
+            if self.battery >= self.charge_target:
+                self.brain.slots.release(self)
                 self.brain.target_changed = True
                 self.brain.current_delivery = None
                 self.isCharging = False
@@ -518,23 +935,8 @@ class Bot:
                 elif self.bot_previous_target == "delivery":
                     self.bot_colour = "pink"
 
-        # Pixels of depot's neighbours
-        depot_pixel_x1, depot_pixel_y1 = grid_to_pixel(self.brain.depot[0][0], self.brain.depot[0][1] + 1,
-                                                       self.cell_size)
-        depot_pixel_x2, depot_pixel_y2 = grid_to_pixel(self.brain.depot[1][0], self.brain.depot[1][1] + 1,
-                                                       self.cell_size)
-        depot_pixel_x3, depot_pixel_y3 = grid_to_pixel(self.brain.depot[0][0] - 1, self.brain.depot[1][1],
-                                                       self.cell_size)
-        depot_pixel_x4, depot_pixel_y4 = grid_to_pixel(self.brain.depot[1][0] + 1, self.brain.depot[1][1],
-                                                       self.cell_size)
-
         # Depot
-
-        if ([self.pixel_x, self.pixel_y] == [depot_pixel_x1, depot_pixel_y1] or \
-            [self.pixel_x, self.pixel_y] == [depot_pixel_x2, depot_pixel_y2] or \
-            [self.pixel_x, self.pixel_y] == [depot_pixel_x3, depot_pixel_y3] or \
-            [self.pixel_x, self.pixel_y] == [depot_pixel_x4, depot_pixel_y4]) \
-                and not self.hasPackage and not self.isCharging:
+        if not self.hasPackage and not self.isCharging and self.at_centre_of(depot_cells) and self.use_bay("depot"):
             self.bot_colour = "blue"
             self.hasPackage = True
             self.brain.target_changed = True
@@ -543,37 +945,50 @@ class Bot:
 
         # Delivery
         if self.hasPackage and self.brain.current_delivery:
-            # Pixel of depot's delivery point
-            delivery_pixel_x, delivery_pixel_y = grid_to_pixel(self.brain.current_delivery[0],
-                                                               self.brain.current_delivery[1], self.cell_size)
-            if [self.pixel_x, self.pixel_y] == [delivery_pixel_x, delivery_pixel_y]:
+            if self.at_centre_of((tuple(self.brain.current_delivery),)):
                 self.bot_colour = "pink"
-                self.hasPackage = False
+                self.hasPackage = self.brain.drop_off()  # more packages on board with batched allocation
                 self.brain.target_changed = True
                 self.brain.current_delivery = None
                 self.bot_previous_target = "delivery"
 
         if not self.waiting and not self.stopMoving:
-            actually_moved = self.move(canvas, noOfRowsCols, occupied_cells)
+            actually_moved = self.move(noOfRowsCols, occupied_cells)
             # Only decrease battery if movement actually happened
             if actually_moved:
                 self.battery -= 1
+                self.energy_used += 1
+            elif self.waiting:  # no target this tick
+                self.idle_ticks += 1
 
         elif self.waiting:
+            if not self.stopMoving:  # finished and dead bots aren't idling
+                self.idle_ticks += 1
             if self.wait_counter > 0:
                 self.wait_counter -= 1
             else:
                 self.waiting = False
 
-        # Redraw the bot
-        canvas.delete(self.bot_name)
-        self.draw(canvas, noOfRowsCols)
+    def use_bay(self, kind):
+        """
+        True if the bot can use the charger or depot bay it's at the centre of (see SlotScheduler.use_bay). If
+        another bot is using it and it's the bay this bot booked, this bot waits there until that bot is expected to
+        be done - it looks again every tick
+        """
+        slots = self.brain.slots
+        cell = (self.grid_x, self.grid_y)
+        if slots.use_bay(self, cell, kind):
+            return True
+        if not self.waiting and slots.booked_bay(self) == cell:
+            self.waiting = True
+            self.wait_counter = slots.wait_ticks(cell)
+        return False
 
     def move(self, noOfRowsCols, occupied_cells):
 
         if self.target_reached:
             self.target_grid_x, self.target_grid_y = self.thinkAndAct(noOfRowsCols)
-            current_grid_x, current_grid_y = pixel_to_grid(self.pixel_x, self.pixel_y, self.cell_size)
+            current_grid_x, current_grid_y = self.grid_x, self.grid_y
 
             # If no valid target is returned - wait
             if self.target_grid_x is None or self.target_grid_y is None:
@@ -581,90 +996,1435 @@ class Bot:
                 return False
 
             # Translating the heading of the bot
-            theta_direction = (self.target_grid_x - current_grid_x, self.target_grid_y - current_grid_y)
-
-            if theta_direction != (0, 0):  # Only update heading if actually moving
-                if theta_direction == (0, -1):  # Up
-                    self.theta = math.radians(0)
-                elif theta_direction == (1, 0):  # Right
-                    self.theta = math.radians(90)
-                elif theta_direction == (0, 1):  # Down
-                    self.theta = math.radians(180)
-                elif theta_direction == (-1, 0):  # Left
-                    self.theta = math.radians(270)
-
-            self.next_reserve = [self.target_grid_x, self.target_grid_y]
-            self.brain.reserve_cell(self.next_reserve)
+            direction = (self.target_grid_x - current_grid_x, self.target_grid_y - current_grid_y)
+
+            if direction != (0, 0):  # Only update heading if actually moving
+                if direction in HEADINGS:
+                    self.heading = direction
+                self.steps_to_target = self.steps_per_cell
+            else:  # Staying put - one step off the centre in the old heading, then straight back
+                self.steps_to_target = 1
+
+            self.next_reserve = (self.target_grid_x, self.target_grid_y)
+            if self.next_reserve != self.current_reserve:  # staying put keeps the reservation it has
+                self.brain.reserve_cell(self.next_reserve)
             self.target_reached = False
             return False  # No movement occurred - planning to move
 
         else:
 
             # Making incremental movement
-            self.pixel_x += self.speed * math.sin(self.theta)
-            self.pixel_y -= self.speed * math.cos(self.theta)
-
-            # Calculate distance to target
-            self.target_pixel_x, self.target_pixel_y = grid_to_pixel(self.target_grid_x, self.target_grid_y,
-                                                                     self.cell_size)
-            distance = math.sqrt((self.pixel_x - self.target_pixel_x) ** 2 + (self.pixel_y - self.target_pixel_y) ** 2)
-
-            # If distance is close enough, bot will go to exact center and stop
-            if distance < self.speed + 2:  # Threshold based on movement speed
-                self.pixel_x = self.target_pixel_x
-                self.pixel_y = self.target_pixel_y
-                if self.current_reserve in occupied_cells[4]:
+            self.progress += 1
+
+            # If close enough, bot will go to exact center and stop
+            if self.progress >= self.steps_to_target:
+                self.progress = 0
+                self.grid_x = self.target_grid_x
+                self.grid_y = self.target_grid_y
+                if self.current_reserve and self.current_reserve != self.next_reserve:
                     self.brain.release_cell(self.current_reserve)
+                if self.next_reserve != self.current_reserve:
+                    self.cells_travelled += 1
                 self.current_reserve = self.next_reserve
                 self.target_reached = True
             return True  # Movement has occurred
 
 
+def fleet_array(name, nullable=False):
+    """Bot attribute kept in the fleet's array of the same name - nullable ones store None as -1"""
+    def get(bot):
+        value = getattr(bot.fleet, name)[bot.index].item()
+        return None if nullable and value < 0 else value
+
+    def set(bot, value):
+        getattr(bot.fleet, name)[bot.index] = -1 if value is None else value
+
+    return property(get, set)
+
+
+def fleet_cell(name):
+    """current_reserve / next_reserve - (x, y) or None - kept in the fleet's name_x and name_y arrays"""
+    def get(bot):
+        x = getattr(bot.fleet, name + "_x")[bot.index]
+        return None if x < 0 else (int(x), int(getattr(bot.fleet, name + "_y")[bot.index]))
+
+    def set(bot, cell):
+        getattr(bot.fleet, name + "_x")[bot.index] = cell[0] if cell else -1
+        getattr(bot.fleet, name + "_y")[bot.index] = cell[1] if cell else -1
+
+    return property(get, set)
+
+
+class FleetBot(Bot):
+    """
+    A Bot whose per-tick state lives in a Fleet's arrays - brains, the planners and the renderer use it like any
+    other Bot, while Fleet.update moves the whole fleet at once
+    """
+
+    __slots__ = ("fleet", "index")
+
+    grid_x = fleet_array("grid_x")
+    grid_y = fleet_array("grid_y")
+    progress = fleet_array("progress")
+    steps_to_target = fleet_array("steps_to_target")
+    target_grid_x = fleet_array("target_grid_x", nullable=True)  # None while the brain has no next cell
+    target_grid_y = fleet_array("target_grid_y", nullable=True)
+    battery = fleet_array("battery")
+    launch_countdown = fleet_array("launch_countdown")
+    has_launched = fleet_array("has_launched")
+    stopMoving = fleet_array("stopMoving")
+    target_reached = fleet_array("target_reached")
+    waiting = fleet_array("waiting")
+    wait_counter = fleet_array("wait_counter")
+    isCharging = fleet_array("isCharging")
+    batteryRunOut = fleet_array("batteryRunOut")
+    hasPackage = fleet_array("hasPackage")
+    finishedPackages = fleet_array("finishedPackages")
+    cells_travelled = fleet_array("cells_travelled")
+    energy_used = fleet_array("energy_used")
+    idle_ticks = fleet_array("idle_ticks")
+    charging_ticks = fleet_array("charging_ticks")
+    charge_target = fleet_array("charge_target")
+    current_reserve = fleet_cell("current")
+    next_reserve = fleet_cell("next")
+
+    def __init__(self, fleet, bot_name, grid_choice, cell_size, noOfRowsCols, bot_number):
+        self.fleet = fleet
+        self.index = bot_number
+        super().__init__(bot_name, grid_choice, cell_size, noOfRowsCols, bot_number)
+
+    @property
+    def heading(self):
+        return self.fleet.heading_x[self.index].item(), self.fleet.heading_y[self.index].item()
+
+    @heading.setter
+    def heading(self, heading):
+        self.fleet.heading_x[self.index], self.fleet.heading_y[self.index] = heading
+
+
+class Fleet:
+    """
+    Struct-of-arrays fleet for large agent counts - cells, headings, progress between cells, battery, package state
+    and mode flags of every bot are NumPy arrays, and update() does what Bot.update does for each bot (launching, powering down,
+    charging, depot and delivery arrivals, waiting, moving and arriving at cell centres) as array operations. Only
+    the bots that reach a cell centre and have to pick their next cell call into their Brain one by one. Bots act
+    in agent order within each phase of the tick rather than one whole bot after another, so a run can differ a
+    little from the same trial with Bot objects.
+    """
+
+    def __init__(self, count, grid_choice, cell_size, noOfRowsCols):
+        self.count = count
+        self.cell_size = cell_size
+        self.noOfRowsCols = noOfRowsCols
+        self.grid_x = np.zeros(count, dtype=np.int64)  # cell each bot was last at the centre of
+        self.grid_y = np.zeros(count, dtype=np.int64)
+        self.heading_x = np.zeros(count, dtype=np.int64)  # see HEADINGS
+        self.heading_y = np.zeros(count, dtype=np.int64)
+        self.target_grid_x = np.zeros(count, dtype=np.int64)
+        self.target_grid_y = np.zeros(count, dtype=np.int64)
+        self.current_x = np.full(count, -1, dtype=np.int64)  # reserved cells, -1 for none
+        self.current_y = np.full(count, -1, dtype=np.int64)
+        self.next_x = np.full(count, -1, dtype=np.int64)
+        self.next_y = np.full(count, -1, dtype=np.int64)
+        self.delivery_x = np.full(count, -1, dtype=np.int64)  # each brain's current_delivery, -1 for none
+        self.delivery_y = np.full(count, -1, dtype=np.int64)
+        for name in ("progress", "steps_to_target", "battery", "launch_countdown", "wait_counter", "cells_travelled",
+                     "energy_used", "idle_ticks", "charging_ticks", "charge_target"):
+            setattr(self, name, np.zeros(count, dtype=np.int64))
+        for name in ("has_launched", "stopMoving", "target_reached", "waiting", "isCharging", "batteryRunOut",
+                     "hasPackage", "finishedPackages"):
+            setattr(self, name, np.zeros(count, dtype=bool))
+        self.blocked_targets = []  # delivery points brains found walled in, like Brain.blocked_targets
+        self.bots = [FleetBot(self, "Agent" + str(i), grid_choice, cell_size, noOfRowsCols, i) for i in range(count)]
+        self.speed = self.bots[0].speed if self.bots else 2
+
+    def grid_cells(self):
+        """Grid x and y of the cell every bot is over, mid-flight too - pixel_to_grid of Bot.pixel_x and pixel_y"""
+        offset = self.progress * self.speed
+        pixel_x = self.grid_x * self.cell_size + self.cell_size / 2 + offset * self.heading_x
+        pixel_y = self.grid_y * self.cell_size + self.cell_size / 2 + offset * self.heading_y
+        return (pixel_x / self.cell_size).astype(np.int64), (pixel_y / self.cell_size).astype(np.int64)
+
+    def centre_cells(self):
+        """Index (y * noOfRowsCols + x) of the cell each bot is at the exact centre of, or -1 mid-flight"""
+        return np.where(self.progress == 0, self.grid_y * self.noOfRowsCols + self.grid_x, -1)
+
+    def at_centre_of(self, centre_cells, cells):
+        """Bots at the exact centre of one of the cells, like Bot.at_centre_of - there are only ever a few cells"""
+        at_centre = np.zeros(self.count, dtype=bool)
+        for x, y in cells:
+            at_centre |= centre_cells == y * self.noOfRowsCols + x
+        return at_centre
+
+    def sync_delivery(self, i):
+        delivery = self.bots[i].brain.current_delivery
+        self.delivery_x[i], self.delivery_y[i] = delivery if delivery else (-1, -1)
+
+    def arrived_at_target(self, indices, colour, previous_target=None):
+        """Hands the bots' brains a new target after charging, a depot pickup or a delivery"""
+        for i in indices.tolist():
+            bot = self.bots[i]
+            bot.brain.target_changed = True
+            bot.brain.current_delivery = None
+            self.delivery_x[i] = self.delivery_y[i] = -1
+            if previous_target is not None:
+                bot.bot_previous_target = previous_target
+            bot.bot_colour = colour if colour is not None else \
+                {"depot": "blue", "delivery": "pink"}.get(bot.bot_previous_target, bot.bot_colour)
+
+    def deciding_bots(self):
+        """Bots that will pick their next cell this tick unless something stops them first"""
+        deciding = self.target_reached & self.has_launched & ~self.waiting & ~self.stopMoving
+        return [self.bots[i] for i in np.flatnonzero(deciding).tolist()]
+
+    def update(self, noOfRowsCols, occupied_cells):
+        """One tick of Bot.update for the whole fleet"""
+        bots = self.bots
+
+        # Launch delays - a bot that is launched this tick acts straight away
+        counting = ~self.has_launched & (self.launch_countdown > 0)
+        self.launch_countdown[counting] -= 1
+        for i in np.flatnonzero(~self.has_launched & ~counting).tolist():
+            log(f"{bots[i].bot_name} has started moving")
+        self.has_launched |= ~counting
+        active = ~counting
+
+        # Back at the starting point with nothing left to deliver
+        home = active & self.finishedPackages & (self.centre_cells() == noOfRowsCols - 1)
+        self.stopMoving |= home
+        self.waiting |= home
+
+        # Powering down - a powered down drone lands in the centre of its cell and gives up its reserved cells
+        dead = active & (self.battery <= 0)
+        for i in np.flatnonzero(dead & ~self.batteryRunOut).tolist():
+            log(f"{bots[i].bot_name} has powered down due to battery depletion")
+            bots[i].bot_colour = "grey"
+            bots[i].brain.slots.release(bots[i])
+        for i in np.flatnonzero(dead & ((self.current_x >= 0) | (self.next_x >= 0))).tolist():
+            for reserved_cell in reserved_cells(bots[i].current_reserve, bots[i].next_reserve):
+                bots[i].brain.release_cell(reserved_cell)
+        self.current_x[dead] = self.current_y[dead] = self.next_x[dead] = self.next_y[dead] = -1
+        if dead.any():
+            grid_x, grid_y = self.grid_cells()
+            self.grid_x[dead] = grid_x[dead]
+            self.grid_y[dead] = grid_y[dead]
+            self.progress[dead] = 0
+        self.stopMoving |= dead
+        self.waiting |= dead
+        self.batteryRunOut |= dead
+        self.target_reached |= dead
+
+        # Charging
+        charging_cells, depot_cells = occupied_cells.arrival_cells()
+        centre_cells = self.centre_cells()
+        charging = active & self.isCharging & self.at_centre_of(centre_cells, charging_cells)
+        for i in np.flatnonzero(charging).tolist():
+            policy = bots[i].brain.slots.charging
+            if not bots[i].use_bay("charger"):
+                charging[i] = False
+            elif policy.charge(int(self.battery[i]), int(self.charge_target[i])) >= self.charge_target[i]:
+                bots[i].brain.slots.release(bots[i])  # charged this tick - the next bot can have the bay
+        self.stopMoving |= charging
+        if charging.any():
+            policy = bots[0].brain.slots.charging
+            charged_to = np.minimum(self.battery + policy.rates(self.battery),
+                                    np.maximum(self.charge_target, self.battery))
+            self.battery[charging] = charged_to[charging]
+        self.charging_ticks += charging
+        for i in np.flatnonzero(charging).tolist():
+            bots[i].bot_colour = "Purple"
+        charged = charging & (self.battery >= self.charge_target)
+        self.isCharging &= ~charged
+        self.stopMoving &= ~charged
+        self.arrived_at_target(np.flatnonzero(charged), None)
+
+        # Depot
+        picked_up = active & self.at_centre_of(centre_cells, depot_cells) & ~self.hasPackage & ~self.isCharging
+        for i in np.flatnonzero(picked_up).tolist():
+            picked_up[i] = bots[i].use_bay("depot")
+        self.hasPackage |= picked_up
+        self.arrived_at_target(np.flatnonzero(picked_up), "blue", "depot")
+
+        # Delivery
+        delivered = active & self.hasPackage & (self.delivery_x >= 0) & \
+            (centre_cells == self.delivery_y * noOfRowsCols + self.delivery_x)
+        self.hasPackage &= ~delivered
+        for i in np.flatnonzero(delivered).tolist():
+            self.hasPackage[i] = bots[i].brain.drop_off()  # more packages on board with batched allocation
+        self.arrived_at_target(np.flatnonzero(delivered), "pink", "delivery")
+
+        # Waiting bots count down their wait
+        acting = active & ~self.waiting & ~self.stopMoving
+        waiting = active & self.waiting
+        self.idle_ticks += waiting & ~self.stopMoving
+        done_waiting = waiting & (self.wait_counter <= 0)
+        self.wait_counter -= waiting & ~done_waiting
+        self.waiting &= ~done_waiting
+
+        # Moving towards the next cell centre
+        moving = acting & ~self.target_reached
+        self.progress += moving
+        arrived = moving & (self.progress >= self.steps_to_target)
+        self.progress[arrived] = 0
+        self.grid_x[arrived] = self.target_grid_x[arrived]
+        self.grid_y[arrived] = self.target_grid_y[arrived]
+        changed_cell = arrived & ((self.current_x != self.next_x) | (self.current_y != self.next_y))
+        for i in np.flatnonzero(changed_cell & (self.current_x >= 0)).tolist():
+            bots[i].brain.release_cell(bots[i].current_reserve)
+        self.cells_travelled += changed_cell
+        self.current_x[arrived] = self.next_x[arrived]
+        self.current_y[arrived] = self.next_y[arrived]
+        self.target_reached |= arrived
+        self.battery -= moving
+        self.energy_used += moving
+
+        # Bots at a cell centre pick their next cell - that's where the brains and reservations are
+        deciding = np.flatnonzero(acting & ~moving)
+        if len(deciding):
+            self.decide(deciding, noOfRowsCols)
+
+    def decide(self, indices, noOfRowsCols):
+        """
+        The planning half of Bot.move for the bots at the given indices. Their brains are asked one by one, in agent
+        order, so each sees the cells reserved before it, and the answers are written back to the arrays together
+        """
+        target_x = []
+        target_y = []
+        steps = []
+        for i, grid_x, grid_y, battery, hasPackage in zip(indices.tolist(), self.grid_x[indices].tolist(),
+                                                           self.grid_y[indices].tolist(),
+                                                           self.battery[indices].tolist(),
+                                                           self.hasPackage[indices].tolist()):
+            bot = self.bots[i]
+            log(f"\n--- {bot.bot_name} STATUS ---")
+            next_x, next_y = bot.brain.get_next_move(grid_x, grid_y, battery, hasPackage, noOfRowsCols)
+            if next_x is None or next_y is None:  # If no valid target is returned - wait
+                next_x = next_y = -1
+            elif (next_x, next_y) != bot.current_reserve:
+                bot.brain.reserve_cell((next_x, next_y))
+            target_x.append(next_x)
+            target_y.append(next_y)
+            steps.append(1 if (next_x, next_y) == (grid_x, grid_y) else bot.steps_per_cell)
+            self.sync_delivery(i)
+            for target in bot.brain.blocked_targets:
+                if target not in self.blocked_targets:
+                    self.blocked_targets.append(target)
+
+        target_x = np.array(target_x)
+        target_y = np.array(target_y)
+        self.target_grid_x[indices] = target_x
+        self.target_grid_y[indices] = target_y
+
+        no_target = target_x < 0
+        self.waiting[indices[no_target]] = True
+        self.idle_ticks[indices[no_target]] += 1
+
+        # Only update heading if actually moving to a neighbouring cell
+        planned = indices[~no_target]
+        direction_x = target_x[~no_target] - self.grid_x[planned]
+        direction_y = target_y[~no_target] - self.grid_y[planned]
+        turning = np.abs(direction_x) + np.abs(direction_y) == 1
+        self.heading_x[planned[turning]] = direction_x[turning]
+        self.heading_y[planned[turning]] = direction_y[turning]
+        self.steps_to_target[planned] = np.array(steps, dtype=np.int64)[~no_target]
+        self.next_x[planned] = target_x[~no_target]
+        self.next_y[planned] = target_y[~no_target]
+        self.target_reached[planned] = False
+
+    def status(self, noOfRowsCols):
+        """
+        Bots still flying, whether one of them has run out of packages, whether they're all home, and whether two
+        flying bots are inside the same cell (bots can share the starting point)
+        """
+        alive = (self.battery > 0) & ~self.batteryRunOut
+        grid_x, grid_y = self.grid_cells()
+        cells = grid_y * noOfRowsCols + grid_x
+        all_home = bool(np.all(cells[alive] == noOfRowsCols - 1))
+        flying_cells = cells[~self.batteryRunOut]
+        flying_cells = flying_cells[flying_cells != noOfRowsCols - 1]
+        collision = len(np.unique(flying_cells)) < len(flying_cells)
+        return int(alive.sum()), bool(np.any(alive & self.finishedPackages)), all_home, collision
+
+
 class DeliveryManager:
-    def __init__(self, delivery_list):
-        self.lock = threading.Lock()
+    """
+    Hands out the delivery list to the bots as they pick up packages at the depot. The allocation strategy decides
+    which delivery point a bot gets:
+      fifo    - the next one in list order, wherever it is
+      nearest - the one the fewest steps from the bot, by the precomputed distance tables
+      auction - the open deliveries are auctioned to the whole fleet, longest round trip first, each going to the
+                bot with the least work already won, so the fleet's loads come out even. A bot with nothing left
+                takes the last delivery of the bot with the most work left (a late or dead bot), and the auction is
+                run again over the open deliveries whenever new ones have arrived
+      batched - a bot loads up to capacity packages per depot visit and drops them off in nearest-next order
+    Every delivery starts from the depot, so the bots' costs for a delivery only differ in how much work they
+    already have - which is what the auction balances. Deliveries are removed from delivery_list as they are handed
+    out, so its length is still the number left to hand out.
+
+    In lifelong mode requests keep arriving during the trial (add_request) instead of all being in the list at the
+    start, and the manager records the tick each one arrived and the ticks it took to be delivered.
+
+    The simulation runs on one thread, so nothing here takes a lock - ThreadSafeDeliveryManager is the one to use
+    when brains plan on worker threads.
+    """
+
+    strategies = ("fifo", "nearest", "auction", "batched")
+
+    def __init__(self, delivery_list, strategy="fifo", distance_tables=None, occupied_cells=None, capacity=3,
+                 lifelong=False):
+        if strategy not in self.strategies:
+            raise ValueError(f"Unknown allocation strategy {strategy!r} - expected one of {self.strategies}")
         self.delivery_list = delivery_list
-        print(f"Initial delivery list contains {len(self.delivery_list)} targets")
+        self.strategy = strategy
+        self.distance_tables = distance_tables  # None on the city-scale maps - distances are Manhattan there
+        self.occupied_cells = occupied_cells
+        self.capacity = capacity  # packages per depot visit with the batched strategy
+        self.agents = []  # set by Simulation once the bots exist - the auction's bidders
+        self.won = None  # bot name -> deliveries won in the auction that haven't been handed out yet
+        self.lifelong = lifelong
+        self.tick = 0  # kept up to date by Simulation - when requests arrive and are delivered
+        self.arrival_ticks = []  # lifelong - tick each delivery in delivery_list arrived, in the same order
+        self.on_board = {}  # lifelong - bot name -> arrival ticks of its packages, in the order of its route
+        self.deliveries = []  # lifelong - (tick delivered, ticks since the request arrived) of each delivery
+        self.requests = 0  # lifelong - requests that have arrived
+        log(f"Initial delivery list contains {len(self.delivery_list)} targets")
+
+    def add_request(self, point, tick):
+        self.delivery_list.append([point[0], point[1]])
+        self.arrival_ticks.append(tick)
+        self.requests += 1
+
+    def dropped_off(self, requester, delivered):
+        if self.lifelong:
+            arrival_tick = self.on_board[requester.bot.bot_name].popleft()
+            if delivered:
+                self.deliveries.append((self.tick, self.tick - arrival_tick))
+
+    def stop_cell(self, point):
+        """Cell a bot waits in to hand over a package at point (or pick one up at the depot)"""
+        neighbours = finding_free_neighbours(point[0], point[1], self.occupied_cells.noOfRowsCols,
+                                             self.occupied_cells)
+        return neighbours[0] if neighbours else tuple(point)
+
+    def distance(self, cell, point):
+        """Steps from cell to the nearest free neighbour of a delivery point, inf if it can't be reached"""
+        if self.distance_tables is None:
+            return h_score(cell[0], cell[1], point[0], point[1])
+        steps = self.distance_tables.poi_distance(cell[0], cell[1], point[0], point[1])
+        return math.inf if steps is None else steps
+
+    def take(self, point, requester):
+        """Removes one delivery to point (the oldest) from the list and returns it as a target"""
+        i = self.delivery_list.index(point)
+        del self.delivery_list[i]
+        if self.lifelong:
+            self.on_board.setdefault(requester.bot.bot_name, deque()).append(self.arrival_ticks.pop(i))
+        log(f"Assigned delivery target: {point}, remaining: {len(self.delivery_list)}")
+        return point[0], point[1]
+
+    def nearest(self, cell):
+        distances = {}
+        for point in self.delivery_list:
+            if tuple(point) not in distances:
+                distances[tuple(point)] = self.distance(cell, point)
+        return min(self.delivery_list, key=lambda point: distances[tuple(point)])
+
+    def run_auction(self):
+        """Sequential single-item auction - each bot bids the steps of the round trips it has won plus this one"""
+        depot_cell = self.stop_cell(self.occupied_cells[0][0])
+        round_trips = sorted(((2 * self.distance(depot_cell, point), point) for point in self.delivery_list),
+                             key=lambda job: -job[0])
+        self.won = {ag.bot_name: deque() for ag in self.agents}
+        loads = {ag.bot_name: 0 for ag in self.agents}
+        for steps, point in round_trips:
+            winner = min(loads, key=loads.get)  # ties go to the first bot, in agent order
+            loads[winner] += steps
+            self.won[winner].append(point)
+
+    def auctioned(self, requester):
+        if self.won is None or sum(len(won) for won in self.won.values()) != len(self.delivery_list):
+            self.run_auction()  # first pickup, or new requests have arrived since the last auction
+        won = self.won.get(requester.bot.bot_name)
+        if not won:
+            won = max(self.won.values(), key=len)
+            return won.pop()
+        return won.popleft()
+
+    def load_route(self, requester, cell):
+        """The nearest delivery and up to capacity - 1 more, each the nearest to the stop before it"""
+        stop = self.nearest(cell)
+        route = [self.take(stop, requester)]
+        while self.delivery_list and len(route) < self.capacity:
+            stop = self.nearest(self.stop_cell(stop))
+            route.append(self.take(stop, requester))
+        return route
+
+    def get_delivery_targets(self, requester, cell):
+        """Delivery points of the packages a bot loads at the depot, in drop-off order - empty if none are left"""
+        if not self.delivery_list:
+            log("No delivery targets left!")
+            return []
+        if self.strategy == "fifo":
+            return [self.take(self.delivery_list[0], requester)]
+        if self.strategy == "nearest":
+            return [self.take(self.nearest(cell), requester)]
+        if self.strategy == "auction":
+            return [self.take(self.auctioned(requester), requester)]
+        return self.load_route(requester, cell)
+
+
+class ThreadSafeDeliveryManager(DeliveryManager):
+    """DeliveryManager for brains planning on worker threads - every call that changes its lists holds a lock"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
 
-    def get_delivery_target(self):
+    def add_request(self, point, tick):
         with self.lock:
-            if self.delivery_list:
-                target = self.delivery_list[0]
-                self.delivery_list.pop(0)
-                print(f"Assigned delivery target: {target}, remaining: {len(self.delivery_list)}")
-                return target[0], target[1]
+            super().add_request(point, tick)
 
-            print("No delivery targets left!")
-            return None, None
+    def dropped_off(self, requester, delivered):
+        with self.lock:
+            super().dropped_off(requester, delivered)
+
+    def get_delivery_targets(self, requester, cell):
+        with self.lock:
+            return super().get_delivery_targets(requester, cell)
 
 
 class CellManager:
     """
-    CellManager class was intended to implement collision avoidance between bots.
-    It tracks which cells are occupied by bots, but the complete collision avoidance
-    algorithm isn't fully implemented in this version. With more time, this would
-    have been used to make bots wait or reroute when their paths would cross.
+    Shared record of where the bots are and where they're going, for collision avoidance. It keeps the cells the bots
+    hold - the agent layer of the occupancy grid, each bot's current cell and the one it's moving into - which the
+    incremental (D* Lite) and whca planners treat as taken, the dynamic obstacles, and the paths of the bots planned
+    cooperatively, which whca builds its space-time reservation tables from (space_time_reservations).
+
+    All changes to the occupancy grid go through here so its flags stay in step with the occupied_cells layers.
+    Reserving and releasing a cell are O(1) - a flag and the dict-backed agent layer (see CellLayer). Reservations
+    are counted: a bot reserves a cell once when it sets off into it and releases it once when it leaves it or
+    powers down, so a cell two bots hold - a charger bay with a bot charging on it and the next bot waiting on it -
+    stays taken until both have left. The simulation runs on one thread, so nothing here takes a lock -
+    ThreadSafeCellManager is the one to use when brains plan on worker threads.
     """
 
     def __init__(self, occupied_cells):
-        self.lock = threading.Lock()
         self.occupied_cells = occupied_cells
+        self.planned_brains = {}  # bot name -> brain whose current_path is in the space-time reservations
+
+    def reserve_cell(self, xycoord):
+        return self.occupied_cells.add_cell(4, xycoord)
+
+    def release_cell(self, xycoord):
+        return self.occupied_cells.remove_cell(4, xycoord)
+
+    def block_cell(self, xycoord):
+        """Adds a dynamic obstacle"""
+        return self.occupied_cells.add_cell(3, xycoord)
+
+    def unblock_cell(self, xycoord):
+        """Removes an obstacle"""
+        return self.occupied_cells.remove_cell(3, xycoord)
+
+    def reserve_path(self, brain):
+        """Adds the brain's current_path to the space-time reservations (cooperative planning)"""
+        self.planned_brains[brain.bot.bot_name] = brain
+
+    def release_path(self, brain):
+        self.planned_brains.pop(brain.bot.bot_name, None)
+
+    def space_time_reservations(self, requester, window, exempt_cells=()):
+        """
+        Reservation table of every other reserved path for the next window steps. Paths are read live - bots pop
+        the cell they leave - so step 0 is always now, and finished, charging or powered down bots are left out.
+        A bot stays on the last cell of a path shorter than the window until it plans again
+        """
+        reservations = ReservationTable(exempt_cells)
+        for brain in self.planned_brains.values():
+            if brain is requester or not brain.current_path or brain.bot.stopMoving:
+                continue
+            path = list(islice(brain.current_path, window))
+            reservations.reserve_path(brain, path + path[-1:] * (window - len(path)))
+        return reservations
+
+
+class ThreadSafeCellManager(CellManager):
+    """
+    CellManager for brains planning on worker threads - every call holds one lock, so a reservation and the
+    occupancy grid flags it sets change together and a reservation table is built from a consistent set of paths
+    """
+
+    def __init__(self, occupied_cells):
+        super().__init__(occupied_cells)
+        self.lock = threading.Lock()
 
     def reserve_cell(self, xycoord):
         with self.lock:
-            xycoord_list = [int(xycoord[0]), int(xycoord[1])]
-            if xycoord_list not in self.occupied_cells[4]:
-                self.occupied_cells[4].append(xycoord_list)
-                return True
-            return False
+            return super().reserve_cell(xycoord)
 
     def release_cell(self, xycoord):
         with self.lock:
-            xycoord_list = [int(xycoord[0]), int(xycoord[1])]
-            if xycoord_list in self.occupied_cells[4]:
-                self.occupied_cells[4].remove(xycoord_list)
-                return True
+            return super().release_cell(xycoord)
+
+    def block_cell(self, xycoord):
+        with self.lock:
+            return super().block_cell(xycoord)
+
+    def unblock_cell(self, xycoord):
+        with self.lock:
+            return super().unblock_cell(xycoord)
+
+    def reserve_path(self, brain):
+        with self.lock:
+            super().reserve_path(brain)
+
+    def release_path(self, brain):
+        with self.lock:
+            super().release_path(brain)
+
+    def space_time_reservations(self, requester, window, exempt_cells=()):
+        with self.lock:
+            return super().space_time_reservations(requester, window, exempt_cells)
+
+
+class SlotScheduler:
+    """
+    Books the bays next to the chargers and depots - the free cells around them (OccupancyGrid.arrival_cells) -
+    instead of each bot picking one at random. Each bay serves one bot at a time and keeps a queue of bookings
+    (bot, start tick, end tick). A bot asking for a charger or a depot is booked on one of the bays with the fewest
+    bookings, in the slot starting soonest: its flight there by the distance tables (Manhattan distance on the
+    city-scale maps), then the wait for the bookings already ahead of it. A bot reaching its bay while another bot is
+    still using it waits there until that bot is expected to be done, and a bot passing over a free bay of the kind
+    it's after uses it.
+
+    A charging bot holds its bay until it releases it, charged to the level its ChargingPolicy sets. Picking up a
+    package is instant, so a depot bay is held for the one step the bot takes to fly off it - depot slots spread the
+    bots over the bays rather than modelling a service time. The scheduler counts the ticks bots spend at their
+    booked bay waiting for it (queue_ticks) and the charging sessions started.
+    """
+
+    kinds = ("charger", "depot")
+
+    def __init__(self, occupied_cells, distance_tables=None, charging=None):
+        self.lock = threading.Lock()
+        self.occupied_cells = occupied_cells
+        self.distance_tables = distance_tables
+        self.charging = charging or ChargingPolicy(occupied_cells=occupied_cells, distance_tables=distance_tables)
+        self.tick = 0  # kept up to date by Simulation
+        self.queues = {}  # bay -> bookings [bot name, start tick, end tick, charge target], in the order they were made
+        self.free_at = {}  # bay -> end tick of its last booking
+        self.booked = {}  # bot name -> bay of its booking - a bot has one at a time
+        self.holders = {}  # bay -> (bot name, tick it's expected to be done, held until released)
+        self.held = {}  # bot name -> bay it's holding until released
+        self.waiting_since = {}  # bot name -> tick it found its booked bay taken
+        self.queue_ticks = {kind: 0 for kind in self.kinds}  # ticks bots waited at their booked bay, by kind
+        self.charges = 0  # charging sessions started
+
+    def bays(self, kind):
+        """Bays of the given kind, in a fixed order so ties go the same way in every process"""
+        charging_cells, depot_cells = self.occupied_cells.arrival_cells()
+        return sorted(charging_cells if kind == "charger" else depot_cells)
+
+    def travel_ticks(self, bot, cell, bay):
+        tables = self.distance_tables
+        steps = None
+        if tables is not None and tables.has_field(bay[0], bay[1]):
+            steps = tables.distance(cell[0], cell[1], bay[0], bay[1])
+        if steps is None:
+            steps = h_score(cell[0], cell[1], bay[0], bay[1])
+        return steps * bot.ticks_per_step
+
+    def service_ticks(self, bot, battery, target=None):
+        """
+        Ticks a bot arriving with the given battery keeps the bay from the next bot - flying onto it and off it
+        again, plus charging to target at a charger bay
+        """
+        flying = 2 * bot.ticks_per_step
+        if target is not None:
+            return flying + self.charging.ticks_to_charge(max(0, battery), target)
+        return flying
+
+    def book(self, bot, kind, cell, battery):
+        """
+        Books the bot, flying from cell with the given battery, on the bay of the given kind ("charger" or "depot")
+        with the fewest bookings - spreading the bots over the bays keeps them out of each other's way on the
+        approach - where it would be served soonest. Slots within one step of the soonest count as the same, and the
+        bot's own generator picks between them. Returns the bay, or None if there are none. A bot that already has
+        a booking of that kind keeps it - booking again would put it behind the bots that booked since
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown bay kind {kind!r} - expected one of {self.kinds}")
+        with self.lock:
+            bays = self.bays(kind)
+            if self.booked.get(bot.bot_name) in bays:
+                return self.booked[bot.bot_name]
+            self.cancel_booking(bot)
+            options = []
+            for bay in bays:
+                travel = self.travel_ticks(bot, cell, bay)
+                options.append((max(self.tick + travel, self.free_at.get(bay, 0)), travel, bay))
+            if not options:
+                return None
+            fewest = min(len(self.queues.get(bay, ())) for _, _, bay in options)
+            options = [option for option in options if len(self.queues.get(option[2], ())) == fewest]
+            soonest = min(options)[0]
+            start, travel, bay = bot.brain.rng.choice([option for option in options
+                                                       if option[0] <= soonest + bot.ticks_per_step])
+            target = self.charging.target_battery(bot.brain, bay) if kind == "charger" else None
+            # Flying costs about a battery unit a tick
+            end = start + self.service_ticks(bot, battery - travel, target)
+            self.queues.setdefault(bay, []).append([bot.bot_name, start, end, target])
+            self.free_at[bay] = max(self.free_at.get(bay, 0), end)
+            self.booked[bot.bot_name] = bay
+            return bay
+
+    def cancel_booking(self, bot):
+        bay = self.booked.pop(bot.bot_name, None)
+        if bay is not None:
+            queue = self.queues[bay]
+            queue[:] = [booking for booking in queue if booking[0] != bot.bot_name]
+            self.free_at[bay] = max((booking[2] for booking in queue), default=self.tick)
+
+    def booked_bay(self, bot):
+        return self.booked.get(bot.bot_name)
+
+    def charge_target(self, bot):
+        """Level the bot's charger booking charges it to"""
+        bay = self.booked.get(bot.bot_name)
+        booking = next((booking for booking in self.queues.get(bay, ()) if booking[0] == bot.bot_name), None)
+        return 7000 if booking is None or booking[3] is None else booking[3]
+
+    def use_bay(self, bot, bay, kind):
+        """
+        True if the bot can start (or go on) charging or picking up at bay - no other bot is using it. A charger
+        bay is then held until the bot releases it, and a depot bay for the step it takes to fly off it, after which
+        the bot's booking is done with
+        """
+        with self.lock:
+            holder = self.holders.get(bay)
+            if holder is not None and holder[0] == bot.bot_name and holder[2]:
+                return True  # charging on
+            if holder is not None and holder[0] != bot.bot_name and (holder[2] or holder[1] > self.tick):
+                if self.booked.get(bot.bot_name) == bay:
+                    self.waiting_since.setdefault(bot.bot_name, self.tick)
+                return False
+            since = self.waiting_since.pop(bot.bot_name, None)
+            if since is not None:
+                self.queue_ticks[kind] += self.tick - since
+            if kind == "charger":
+                self.holders[bay] = (bot.bot_name,
+                                     self.tick + self.charging.ticks_to_charge(bot.battery, bot.charge_target), True)
+                self.held[bot.bot_name] = bay
+                self.charges += 1
+            else:
+                self.holders[bay] = (bot.bot_name, self.tick + bot.ticks_per_step, False)
+                self.cancel_booking(bot)
+            return True
+
+    def wait_ticks(self, bay):
+        """Ticks until the bot using bay is expected to be done with it"""
+        holder = self.holders.get(bay)
+        return max(1, holder[1] - self.tick) if holder is not None else 1
+
+    def release(self, bot):
+        """Frees the bay the bot has been charging at and drops its booking - when it's charged or powered down"""
+        with self.lock:
+            self.cancel_booking(bot)
+            self.waiting_since.pop(bot.bot_name, None)
+            bay = self.held.pop(bot.bot_name, None)
+            if bay is not None and self.holders.get(bay, (None,))[0] == bot.bot_name:
+                del self.holders[bay]
+
+
+class ChargingPolicy:
+    """
+    How far a charging bot charges and how fast its battery fills. The policy sets the level it charges to:
+      full      - 7000, the whole battery
+      threshold - charge_threshold of the whole battery
+      needed    - what its next round of work takes by the distance tables, with leg_energy_margin to spare: the
+                  drop-offs of the packages on board, back to a depot, and the longest delivery from there and on to
+                  a charger (or home, once there's nothing left to deliver). Maps without distance tables charge full
+      threshold charges no less than needed does, and a bot sent back to charge from the bay it has just charged
+      at - its leg took more than the estimate - charges full
+    and the curve how fast it gets there:
+      linear - 5 a tick all the way
+      cccv   - 5 a tick (constant current) up to cc_limit of the whole battery, then (constant voltage) a rate that
+               falls with the charge still missing, down to 1 a tick
+    A bot stopping short of full frees its charger bay sooner, so more bots cycle through it.
+    """
+
+    policies = ("full", "threshold", "needed")
+    curves = ("linear", "cccv")
+
+    def __init__(self, policy="full", curve="linear", occupied_cells=None, distance_tables=None):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown charging policy {policy!r} - expected one of {self.policies}")
+        if curve not in self.curves:
+            raise ValueError(f"Unknown charging curve {curve!r} - expected one of {self.curves}")
+        self.policy = policy
+        self.curve = curve
+        self.occupied_cells = occupied_cells
+        self.distance_tables = distance_tables
+        self.cc_battery = int(7000 * cc_limit)
+        self.rounds = {}  # depot bay -> longest round from it, for needed
+        self.round_version = None
+        self.charge_ticks = {}  # (battery, target) -> ticks_to_charge on the cccv curve
+
+    def rate(self, battery):
+        """Battery gained in a tick of charging"""
+        if self.curve == "linear" or battery < self.cc_battery:
+            return 5
+        return max(1, -(-5 * (7000 - battery) // (7000 - self.cc_battery)))
+
+    def rates(self, battery):
+        """rate() for an array of battery levels"""
+        if self.curve == "linear":
+            return np.full(len(battery), 5, dtype=np.int64)
+        constant_voltage = np.maximum(1, -(-5 * (7000 - battery) // (7000 - self.cc_battery)))
+        return np.where(battery < self.cc_battery, 5, constant_voltage)
+
+    def charge(self, battery, target, ticks=1):
+        """Battery after charging towards target for the given number of ticks"""
+        if battery >= target:
+            return battery
+        if self.curve == "linear" or battery + 5 * ticks <= self.cc_battery:
+            return min(target, battery + 5 * ticks)
+        for _ in range(ticks):
+            battery = min(target, battery + self.rate(battery))
+        return battery
+
+    def ticks_to_charge(self, battery, target):
+        """Ticks of charging until the battery reaches target"""
+        if self.curve == "linear" or target <= self.cc_battery:
+            return max(0, -(-(target - battery) // 5))
+        key = (battery, target)
+        if key not in self.charge_ticks:
+            ticks = 0
+            if battery < self.cc_battery:
+                ticks = -(-(self.cc_battery - battery) // 5)
+                battery += 5 * ticks
+            while battery < target:
+                battery += self.rate(battery)
+                ticks += 1
+            self.charge_ticks[key] = ticks
+        return self.charge_ticks[key]
+
+    def target_battery(self, brain, bay):
+        """Level a bot charging at bay charges to"""
+        if self.policy == "full" or (brain.bot.grid_x, brain.bot.grid_y) == bay:
+            return 7000  # sent back to charge from the bay it has just charged at - the estimate fell short
+        steps = self.work_steps(brain, bay)
+        needed = 7000 if steps is None else math.ceil(steps * brain.bot.steps_per_cell * (1 + leg_energy_margin))
+        if self.policy == "threshold":
+            # Never short of what the energy checks ask for, or the bot would be sent straight back to charge
+            needed = max(int(7000 * charge_threshold), needed)
+        return min(7000, needed)
+
+    def to_charger(self, cell):
+        """Steps from cell to the nearest charger, or None - as Brain.can_fly_leg counts them"""
+        tables = self.distance_tables
+        legs = [steps for steps in (tables.poi_distance(cell[0], cell[1], x, y) for x, y in self.occupied_cells[1])
+                if steps is not None]
+        return min(legs) if legs else None
+
+    def work_steps(self, brain, bay):
+        """
+        Steps of the most the energy checks (Brain.can_fly_leg) can ask of a bot leaving bay: each drop-off of the
+        packages on board and on to a charger, then home, or else any depot bay and the longest round from it.
+        None if it can't be worked out
+        """
+        tables = self.distance_tables
+        if tables is None or not tables.has_field(bay[0], bay[1]):
+            return None
+        cell, steps, most = bay, 0, 0
+        for point in brain.route:
+            # The bot drops off from any free neighbour of the point, so going by the farthest one
+            legs = [(tables.distance(cell[0], cell[1], x, y), self.to_charger((x, y)), (x, y))
+                    for x, y in finding_free_neighbours(point[0], point[1], self.occupied_cells.noOfRowsCols,
+                                                        self.occupied_cells)
+                    if tables.has_field(x, y)]
+            legs = [leg for leg in legs if leg[0] is not None and leg[1] is not None]
+            if not legs:
+                return None
+            most = max(most, steps + max(leg_steps + to_charger for leg_steps, to_charger, _ in legs))
+            leg_steps, _, cell = max(legs)
+            steps += leg_steps
+        if not brain.delivery_manager.delivery_list and not brain.delivery_manager.lifelong:
+            home = tables.distance(cell[0], cell[1], self.occupied_cells.noOfRowsCols - 1, 0)
+            return None if home is None else max(most, steps + home)
+        rounds = self.depot_rounds()
+        to_depots = [(tables.distance(cell[0], cell[1], x, y), round_steps) for (x, y), round_steps in rounds.items()]
+        if not rounds or any(to_depot is None for to_depot, _ in to_depots):
+            return None
+        return max(most, steps + max(to_depot + round_steps for to_depot, round_steps in to_depots))
+
+    def depot_rounds(self):
+        """
+        Depot bay -> steps of the longest round a bot picking up there can be asked to fly: on to a charger, or to
+        any drop-off cell and from there to a charger - worked out again only if the map changes
+        """
+        if self.round_version != self.occupied_cells.static_version:
+            tables = self.distance_tables
+            n = self.occupied_cells.noOfRowsCols
+            drop_offs = [(cell, self.to_charger(cell)) for point in self.occupied_cells[2]
+                         for cell in finding_free_neighbours(point[0], point[1], n, self.occupied_cells)
+                         if tables.has_field(cell[0], cell[1])]
+            drop_offs = [(cell, to_charger) for cell, to_charger in drop_offs if to_charger is not None]
+            self.rounds = {}
+            for bay in self.occupied_cells.arrival_cells()[1]:
+                if not tables.has_field(bay[0], bay[1]):
+                    continue
+                rounds = [self.to_charger(bay)]
+                rounds += [tables.distance(bay[0], bay[1], cell[0], cell[1]) + to_charger
+                           for cell, to_charger in drop_offs
+                           if tables.distance(bay[0], bay[1], cell[0], cell[1]) is not None]
+                rounds = [steps for steps in rounds if steps is not None]
+                if rounds:
+                    self.rounds[bay] = max(rounds)
+            self.round_version = self.occupied_cells.static_version
+        return self.rounds
+
+
+class PathCache:
+    """
+    Bounded LRU cache of A* paths shared by every Brain in a trial, keyed by (start, goal, static map version).
+    The cache empties itself when the occupancy grid's static_version changes, i.e. when a depot, charger,
+    delivery point or obstacle cell is added or removed. Agent reservations don't invalidate it because
+    a_star doesn't plan around other bots.
+    """
+
+    def __init__(self, occupied_cells, max_size=1024):
+        self.lock = threading.Lock()
+        self.occupied_cells = occupied_cells
+        self.max_size = max_size
+        self.paths = OrderedDict()
+        self.version = occupied_cells.static_version
+        self.hits = 0
+        self.misses = 0
+
+    def find_path(self, start_x, start_y, target_x, target_y):
+        occupied_cells = self.occupied_cells
+        with self.lock:
+            if occupied_cells.static_version != self.version:
+                self.paths.clear()
+                self.version = occupied_cells.static_version
+
+            key = (start_x, start_y, target_x, target_y, self.version)
+            if key in self.paths:
+                self.hits += 1
+                self.paths.move_to_end(key)
+                path = self.paths[key]
+                # Brains consume their paths step by step, so each caller gets its own copy
+                return list(path) if path is not None else None
+            self.misses += 1
+
+        path = shortest_path(start_x, start_y, target_x, target_y, occupied_cells, occupied_cells.noOfRowsCols)
+
+        with self.lock:
+            if key[4] == self.version:  # the map didn't change while planning
+                self.paths[key] = tuple(path) if path is not None else None
+                if len(self.paths) > self.max_size:
+                    self.paths.popitem(last=False)  # evict the least recently used path
+        return path
+
+
+class DistanceTables:
+    """
+    Map compilation step - BFS distance fields from every cell a bot can be sent to (the free neighbours of the
+    depot, charger and delivery points, plus the starting cell), built once per map in a single NumPy batch.
+    Path lengths between those cells and the next step towards them become table reads instead of A* searches,
+    and next_steps() looks up the next move for many bots in one array operation. The fields are rebuilt if the
+    occupancy grid's static layers change.
+    """
+
+    # Fields are also kept as Python lists (faster to index one cell at a time) while they stay this small
+    list_field_limit = 2_000_000
+
+    def __init__(self, occupied_cells):
+        self.occupied_cells = occupied_cells
+        self.noOfRowsCols = occupied_cells.noOfRowsCols
+        self.fields = {}
+        self.goal_index = {}
+        self.field_stack = None
+        self.version = None
+        self.compile()
+
+    def points_of_interest(self):
+        """Depot cells, charger and delivery points"""
+        return [tuple(coord) for layer in range(3) for coord in self.occupied_cells.layer_cells(layer)]
+
+    def goal_cells(self):
+        n = self.noOfRowsCols
+        goals = [(n - 1, 0)]  # starting point
+        for poi_x, poi_y in self.points_of_interest():
+            for neighbour in finding_free_neighbours(poi_x, poi_y, n, self.occupied_cells):
+                if neighbour not in goals:
+                    goals.append(neighbour)
+        return goals
+
+    def compile(self):
+        goals = self.goal_cells()
+        self.field_stack = batched_distance_fields(goals, self.occupied_cells)
+        self.goal_index = {goal: i for i, goal in enumerate(goals)}
+        if self.field_stack.size <= self.list_field_limit:
+            self.fields = dict(zip(goals, self.field_stack.tolist()))
+        else:
+            self.fields = dict(zip(goals, self.field_stack))
+        self.version = self.occupied_cells.static_version
+
+    def has_field(self, target_x, target_y):
+        if self.version != self.occupied_cells.static_version:
+            self.compile()
+        return (target_x, target_y) in self.fields
+
+    def distance(self, start_x, start_y, target_x, target_y):
+        """Number of steps from start to target, or None if the target can't be reached"""
+        field = self.fields[(target_x, target_y)]
+        steps = int(field[start_y * self.noOfRowsCols + start_x])
+        return steps if steps >= 0 else None
+
+    def poi_distance(self, start_x, start_y, poi_x, poi_y):
+        """Number of steps from start to the nearest free neighbour of a depot, charger or delivery point"""
+        distances = [self.distance(start_x, start_y, x, y)
+                     for x, y in finding_free_neighbours(poi_x, poi_y, self.noOfRowsCols, self.occupied_cells)
+                     if (x, y) in self.fields]
+        distances = [steps for steps in distances if steps is not None]
+        return min(distances) if distances else None
+
+    def next_step(self, current_x, current_y, target_x, target_y):
+        """Neighbour one step closer to the target (same neighbour order as finding_free_neighbours)"""
+        n = self.noOfRowsCols
+        field = self.fields[(target_x, target_y)]
+        steps = field[current_y * n + current_x]
+        if steps <= 0:
+            return None
+        for neighbour_x, neighbour_y in finding_free_neighbours(current_x, current_y, n, self.occupied_cells):
+            if field[neighbour_y * n + neighbour_x] == steps - 1:
+                return neighbour_x, neighbour_y
+        return None
+
+    def path(self, start_x, start_y, target_x, target_y):
+        """Shortest path from start to target in the same format as a_star, read off the distance field"""
+        if self.distance(start_x, start_y, target_x, target_y) is None:
+            return None
+        path = [(start_x, start_y)]
+        while path[-1] != (target_x, target_y):
+            path.append(self.next_step(path[-1][0], path[-1][1], target_x, target_y))
+        return path
+
+    def next_steps(self, cells, targets):
+        """
+        Vectorised next_step for many bots at once - cells[i] steps towards targets[i]. Returns a list holding the
+        next (x, y) for each bot, or None where the bot is already at its target or can't reach it
+        """
+        n = self.noOfRowsCols
+        rows = np.fromiter((self.goal_index[target] for target in targets), dtype=np.intp, count=len(targets))
+        xs = np.fromiter((cell[0] for cell in cells), dtype=np.intp, count=len(cells))
+        ys = np.fromiter((cell[1] for cell in cells), dtype=np.intp, count=len(cells))
+        wanted = self.field_stack[rows, ys * n + xs] - 1
+
+        next_xs = np.full(len(cells), -1, dtype=np.intp)
+        next_ys = np.full(len(cells), -1, dtype=np.intp)
+        # Same neighbour order as finding_free_neighbours: the first one a step closer wins
+        for dx, dy in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+            neighbour_xs, neighbour_ys = xs + dx, ys + dy
+            on_grid = (neighbour_xs >= 0) & (neighbour_xs < n) & (neighbour_ys >= 0) & (neighbour_ys < n)
+            indices = np.where(on_grid, neighbour_ys * n + neighbour_xs, 0)
+            closer = on_grid & (self.field_stack[rows, indices] == wanted) & (wanted >= 0) & (next_xs == -1)
+            next_xs[closer] = neighbour_xs[closer]
+            next_ys[closer] = neighbour_ys[closer]
+
+        return [(x, y) if x >= 0 else None for x, y in zip(next_xs.tolist(), next_ys.tolist())]
+
+    def prefetch_next_steps(self, agents, min_batch=16):
+        """
+        Looks up the next move of every bot that is following a distance field and will pick its next cell this
+        tick in one next_steps() call. Small batches are left to the brains, where single lookups are cheaper
+        """
+        waiting_brains = []
+        cells = []
+        for ag in agents:
+            brain = ag.brain
+            if brain.field_target is not None and ag.target_reached and ag.has_launched and not ag.waiting \
+                    and not ag.stopMoving and not brain.target_changed:
+                waiting_brains.append(brain)
+                cells.append((ag.grid_x, ag.grid_y))
+
+        if len(waiting_brains) < min_batch:
+            return
+
+        targets = [brain.field_target for brain in waiting_brains]
+        for brain, cell, target, next_step in zip(waiting_brains, cells, targets, self.next_steps(cells, targets)):
+            brain.prefetched_step = (cell, target, next_step)
+
+
+class HierarchicalPlanner:
+    """
+    HPA* (Botea, Muller & Schaeffer, 2004) for city-scale maps. The grid is cut into cluster_size x cluster_size
+    clusters, and every maximal run of free cells along the border between two clusters becomes an entrance - one
+    pair of abstract nodes facing each other across the border in the middle of a short run, or a pair at each end
+    of a long one. The steps between the nodes inside every cluster come from one batched NumPy wavefront when the
+    map is built, and the abstract graph is rebuilt if the occupancy grid's static layers change.
+
+    A query only links its start and target to the nodes of their clusters and searches the abstract graph, so its
+    cost depends on the number of clusters crossed rather than the number of cells. refine() turns one leg between
+    consecutive waypoints into cells with a search inside a single cluster, and brains refine legs just before they
+    get to them. Paths are a few percent longer than the shortest.
+    """
+
+    def __init__(self, occupied_cells, cluster_size=32, long_entrance=6):
+        self.occupied_cells = occupied_cells
+        self.noOfRowsCols = occupied_cells.noOfRowsCols
+        self.cluster_size = cluster_size
+        self.long_entrance = long_entrance  # entrances at least this wide get a node pair at each end
+        self.edges = {}  # abstract node (x, y) -> {neighbouring node: steps}
+        self.cluster_nodes = {}  # (cluster x, cluster y) -> abstract nodes inside that cluster
+        self.free_blocks = None  # free cell mask of every cluster, indexed [cluster y, cluster x, y, x]
+        self.version = None
+        self.build()
+
+    def cluster_of(self, x, y):
+        return x // self.cluster_size, y // self.cluster_size
+
+    def add_node(self, cell):
+        if cell not in self.edges:
+            self.edges[cell] = {}
+            self.cluster_nodes.setdefault(self.cluster_of(cell[0], cell[1]), []).append(cell)
+
+    def connect(self, a, b, steps):
+        if steps < self.edges[a].get(b, math.inf):
+            self.edges[a][b] = steps
+            self.edges[b][a] = steps
+
+    def add_entrances(self, open_cells, border_cells):
+        """
+        Node pairs for the runs of open_cells (both cells free) along one cluster border - border_cells(i) gives
+        the two cells facing each other at position i
+        """
+        run_start = None
+        for i, is_open in enumerate(open_cells + [False]):
+            if is_open and run_start is None:
+                run_start = i
+            elif not is_open and run_start is not None:
+                width = i - run_start
+                if width < self.long_entrance:
+                    positions = [run_start + (width - 1) // 2]
+                else:
+                    positions = [run_start, i - 1]
+                for position in positions:
+                    a, b = border_cells(position)
+                    self.add_node(a)
+                    self.add_node(b)
+                    self.connect(a, b, 1)
+                run_start = None
+
+    def build(self, batch_size=2048):
+        n = self.noOfRowsCols
+        size = self.cluster_size
+        clusters = -(-n // size)
+        side = clusters * size
+        # Padding the grid out to whole clusters with blocked cells
+        free = np.zeros((side, side), dtype=bool)
+        free[:n, :n] = (np.frombuffer(bytes(self.occupied_cells.flags), dtype=np.uint8).reshape(n, n)
+                        & STATIC_FLAGS) == 0
+        self.free_blocks = free.reshape(clusters, size, clusters, size).transpose(0, 2, 1, 3)
+        self.edges = {}
+        self.cluster_nodes = {}
+
+        for border in range(1, clusters):
+            line = border * size  # first row / column of the clusters after the border
+            for cluster in range(clusters):
+                low, high = cluster * size, min((cluster + 1) * size, n)
+                self.add_entrances((free[low:high, line - 1] & free[low:high, line]).tolist(),
+                                   lambda i: ((line - 1, low + i), (line, low + i)))
+                self.add_entrances((free[line - 1, low:high] & free[line, low:high]).tolist(),
+                                   lambda i: ((low + i, line - 1), (low + i, line)))
+
+        # Steps between every pair of nodes in a cluster, through that cluster only - a wavefront from every node at
+        # once, each one over its own cluster's mask
+        sources = [(cluster, node) for cluster, nodes in self.cluster_nodes.items() for node in nodes]
+        for batch_start in range(0, len(sources), batch_size):
+            batch = sources[batch_start:batch_start + batch_size]
+            masks = self.free_blocks[[cluster[1] for cluster, _ in batch], [cluster[0] for cluster, _ in batch]]
+            fields = wavefront_distances(masks, [(node[0] % size, node[1] % size) for _, node in batch])
+            for (cluster, node), field in zip(batch, fields):
+                for other in self.cluster_nodes[cluster]:
+                    steps = int(field[other[1] % size, other[0] % size])
+                    if steps > 0:
+                        self.connect(node, other, steps)
+        self.version = self.occupied_cells.static_version
+
+    def cluster_distances(self, x, y):
+        """Steps from (x, y) to each abstract node of its cluster through that cluster, and the cluster's field"""
+        size = self.cluster_size
+        cluster_x, cluster_y = self.cluster_of(x, y)
+        field = wavefront_distances(self.free_blocks[cluster_y, cluster_x], [(x % size, y % size)])[0]
+        distances = {}
+        for node in self.cluster_nodes.get((cluster_x, cluster_y), []):
+            steps = int(field[node[1] % size, node[0] % size])
+            if steps >= 0 and node != (x, y):
+                distances[node] = steps
+        return distances, field
+
+    def abstract_path(self, start_x, start_y, target_x, target_y):
+        """
+        Waypoints from start to target - the start, the abstract nodes in between and the target - or None if the
+        target can't be reached
+        """
+        if self.version != self.occupied_cells.static_version:
+            self.build()
+        if not self.occupied_cells.is_free(target_x, target_y):
+            return None  # a_star never enters a taken cell either
+        start, target = (start_x, start_y), (target_x, target_y)
+        if start == target:
+            return [start]
+
+        start_edges, start_field = self.cluster_distances(start_x, start_y)
+        target_edges, _ = self.cluster_distances(target_x, target_y)
+        if self.cluster_of(start_x, start_y) == self.cluster_of(target_x, target_y):
+            size = self.cluster_size
+            steps = int(start_field[target_y % size, target_x % size])
+            if steps >= 0:
+                start_edges[target] = steps
+
+        g_score = {start: 0}
+        came_from = {start: None}
+        closed = set()
+        count = 0
+        # Ties on f go to the deepest node - the grid has lots of equally short routes, and expanding them breadth
+        # first would explore all of them
+        open_set = [(h_score(start_x, start_y, target_x, target_y), 0, 0, start)]
+        while open_set:
+            current = heapq.heappop(open_set)[3]
+            if current in closed:
+                continue
+            closed.add(current)
+
+            if current == target:
+                waypoints = []
+                while current is not None:
+                    waypoints.append(current)
+                    current = came_from[current]
+                return waypoints[::-1]
+
+            neighbours = list(self.edges.get(current, {}).items())
+            if current == start:
+                neighbours += start_edges.items()
+            if current in target_edges:
+                neighbours.append((target, target_edges[current]))
+            for neighbour, steps in neighbours:
+                temp_g_score = g_score[current] + steps
+                if neighbour not in closed and temp_g_score < g_score.get(neighbour, math.inf):
+                    g_score[neighbour] = temp_g_score
+                    came_from[neighbour] = current
+                    count += 1
+                    heapq.heappush(open_set, (temp_g_score + h_score(neighbour[0], neighbour[1], target_x, target_y),
+                                              -temp_g_score, count, neighbour))
+        return None
+
+    def refine(self, start, target):
+        """Cells from one waypoint to the next (both included) - A* inside the cluster they share"""
+        if h_score(start[0], start[1], target[0], target[1]) == 1:
+            return [start, target]  # a step across a cluster border, or next door
+        n = self.noOfRowsCols
+        size = self.cluster_size
+        cluster_x, cluster_y = self.cluster_of(target[0], target[1])
+        low_x, low_y = cluster_x * size, cluster_y * size
+        high_x, high_y = min(low_x + size, n), min(low_y + size, n)
+        flags = self.occupied_cells.flags
+
+        g_score = {start: 0}
+        came_from = {start: None}
+        count = 0
+        open_set = [(h_score(start[0], start[1], target[0], target[1]), 0, start)]
+        while open_set:
+            current = heapq.heappop(open_set)[2]
+            if current == target:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = came_from[current]
+                return path[::-1]
+            temp_g_score = g_score[current] + 1
+            x, y = current
+            # Same neighbour order as finding_free_neighbours: down, right, up, left
+            for neighbour in ((x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)):
+                neighbour_x, neighbour_y = neighbour
+                if not (low_x <= neighbour_x < high_x and low_y <= neighbour_y < high_y) or \
+                        flags[neighbour_y * n + neighbour_x] & STATIC_FLAGS:
+                    continue
+                if temp_g_score < g_score.get(neighbour, math.inf):
+                    g_score[neighbour] = temp_g_score
+                    came_from[neighbour] = current
+                    count += 1
+                    heapq.heappush(open_set, (temp_g_score + h_score(neighbour_x, neighbour_y, target[0], target[1]),
+                                              count, neighbour))
+        return None
+
+    def find_path(self, start_x, start_y, target_x, target_y):
+        """Whole path in the same format as a_star, with every leg refined"""
+        waypoints = self.abstract_path(start_x, start_y, target_x, target_y)
+        if waypoints is None:
+            return None
+        path = [waypoints[0]]
+        for waypoint in waypoints[1:]:
+            path.extend(self.refine(path[-1], waypoint)[1:])
+        return path
+
+
+class CellLayer(dict):
+    """
+    Layer of [x, y] cells kept as a dict keyed by (x, y), so adding, removing and finding a cell is O(1) instead of a
+    scan of a list. It reads like the list layers - append, remove, in, len and iterating over [x, y] lists, in the
+    order the cells were added - but can't be indexed. Each cell counts how many times it was added, so a cell two
+    bots hold (a bay with one bot charging and the next waiting on it) stays in the layer until both have removed it
+    """
+
+    def __init__(self, cells=()):
+        super().__init__()
+        for xycoord in cells:
+            self.append([int(xycoord[0]), int(xycoord[1])])
+
+    def __iter__(self):
+        return ([x, y] for x, y in super().__iter__())
+
+    def __contains__(self, xycoord):
+        return super().__contains__((xycoord[0], xycoord[1]))
+
+    def append(self, xycoord):
+        cell = (xycoord[0], xycoord[1])
+        self[cell] = self.get(cell, 0) + 1
+
+    def remove(self, xycoord):
+        cell = (xycoord[0], xycoord[1])
+        holders = self.get(cell)
+        if holders is None:
+            raise ValueError(f"{xycoord} is not in the layer")
+        if holders > 1:
+            self[cell] = holders - 1
+        else:
+            del self[cell]
+
+
+class OccupancyGrid(list):
+    """
+    occupied_cells backed by a bytearray with one byte of layer flags per cell (indexed by y * noOfRowsCols + x),
+    so "is this cell free" is answered in O(1) instead of scanning the layer lists. It is still a list of the five
+    occupied_cells layers, so existing code can keep reading occupied_cells[0] to occupied_cells[4]. The agent layer,
+    occupied_cells[4], changes every time a bot moves, so it is a CellLayer rather than a list. More than one bot can
+    hold an agent cell, and its flag stays set until the last of them clears it.
+    static_version goes up whenever a depot, charger, delivery point or obstacle cell changes, and static_changes
+    logs the changed cells, so static_changes[version:] is everything that changed since static_version was version.
+    """
+
+    def __init__(self, layers, noOfRowsCols):
+        super().__init__(layers)
+        self[4] = CellLayer(self[4])
+        self.noOfRowsCols = noOfRowsCols
+        self.flags = bytearray(noOfRowsCols * noOfRowsCols)
+        self.static_version = 0
+        self.static_changes = []
+        self.padded_free = None  # see padded_free_cells
+        self.padded_version = None
+        self.density = 0.0
+        self.jump_table_cache = None
+        self.arrival_cache = None  # see arrival_cells
+        self.arrival_version = None
+
+        for layer in range(len(LAYER_FLAGS)):
+            for coord in self.layer_cells(layer):
+                self.flags[self.index(coord[0], coord[1])] |= LAYER_FLAGS[layer]
+
+    def layer_cells(self, layer):
+        return self[layer]
+
+    def index(self, x, y):
+        return y * self.noOfRowsCols + x
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.noOfRowsCols and 0 <= y < self.noOfRowsCols
+
+    def is_free(self, x, y):
+        """True if the cell is on the grid and has no depot, charger, delivery point or obstacle"""
+        return self.in_bounds(x, y) and not self.flags[y * self.noOfRowsCols + x] & STATIC_FLAGS
+
+    def has_flag(self, x, y, flag):
+        return self.in_bounds(x, y) and bool(self.flags[y * self.noOfRowsCols + x] & flag)
+
+    def padded_free_cells(self):
+        """
+        1 for every cell with no depot, charger, delivery point or obstacle, on a grid with a blocked one-cell
+        border so searches need no bounds checks - indexed by (y + 1) * (noOfRowsCols + 2) + x + 1. Rebuilt when
+        the static layers change
+        """
+        if self.padded_version != self.static_version:
+            n = self.noOfRowsCols
+            width = n + 2
+            free_table = bytes(0 if flag & STATIC_FLAGS else 1 for flag in range(256))
+            padded = bytearray(width * width)
+            for y in range(n):
+                start = (y + 1) * width + 1
+                padded[start:start + n] = self.flags[y * n:(y + 1) * n].translate(free_table)
+            self.padded_free = padded
+            self.padded_version = self.static_version
+            self.density = 1 - sum(padded) / (n * n)
+            self.jump_table_cache = None
+        return self.padded_free
+
+    def jump_tables(self):
+        """build_jump_tables for the current static layers - built the first time Jump Point Search needs them"""
+        free = self.padded_free_cells()
+        if self.jump_table_cache is None:
+            self.jump_table_cache = build_jump_tables(free, self.noOfRowsCols)
+        return self.jump_table_cache
+
+    def arrival_cells(self):
+        """
+        Free cells next to the chargers where bots charge, and next to the depots where they pick up packages (the
+        bays SlotScheduler books), as (charging cells, depot cells) sets - worked out again only after the static
+        layers change
+        """
+        if self.arrival_version != self.static_version:
+            self.arrival_cache = tuple({neighbour for x, y in self[layer]
+                                        for neighbour in finding_free_neighbours(x, y, self.noOfRowsCols, self)}
+                                       for layer in (1, 0))
+            self.arrival_version = self.static_version
+        return self.arrival_cache
+
+    def static_density(self):
+        """Share of cells taken by depots, chargers, delivery points and obstacles"""
+        self.padded_free_cells()
+        return self.density
+
+    def add_cell(self, layer, xycoord):
+        """Marks the cell in a layer. Returns False if it was already marked - an agent cell then has one more holder"""
+        x, y = int(xycoord[0]), int(xycoord[1])
+        i = self.index(x, y)
+        if self.flags[i] & LAYER_FLAGS[layer]:
+            if LAYER_FLAGS[layer] == AGENT_FLAG:
+                self[layer].append([x, y])
+            return False
+        self.flags[i] |= LAYER_FLAGS[layer]
+        self[layer].append([x, y])
+        if LAYER_FLAGS[layer] & STATIC_FLAGS:
+            self.static_changes.append((x, y))
+            self.static_version += 1
+        return True
+
+    def remove_cell(self, layer, xycoord):
+        """Clears the cell from a layer. Returns False if it wasn't marked, and leaves an agent cell other bots hold"""
+        x, y = int(xycoord[0]), int(xycoord[1])
+        i = self.index(x, y)
+        if not self.flags[i] & LAYER_FLAGS[layer]:
             return False
+        self[layer].remove([x, y])
+        if [x, y] in self[layer]:
+            return True
+        self.flags[i] &= ~LAYER_FLAGS[layer]
+        if LAYER_FLAGS[layer] & STATIC_FLAGS:
+            self.static_changes.append((x, y))
+            self.static_version += 1
+        return True
 
 
 # ------------- Window,Environment and Agent creation ------------- #
@@ -677,10 +2437,8 @@ def initialise(window):
     return canvas
 
 
-def createEnvironment(canvas, grid_type):
-    # Adding random seed so that randomness can be more effective
-    random.seed(time.time())
-
+def grid_layout(grid_type):
+    """Width in cells, cell size, delivery points, obstacles and first depot x of a map type"""
     # Static variables
     delivery_points = 0
     obstacles = 0
@@ -704,33 +2462,38 @@ def createEnvironment(canvas, grid_type):
         cell_size = 46.67
         delivery_points = 3
         obstacles = 5
-
-    # Draw grid lines
-    for i in range(noOfRowsCols):
-        canvas.create_line(0, i * cell_size, noOfRowsCols * cell_size, i * cell_size, fill='grey')
-    for j in range(noOfRowsCols):
-        canvas.create_line(j * cell_size, 0, j * cell_size, noOfRowsCols * cell_size, fill='black')
+    elif grid_type.lower() == 'city':
+        noOfRowsCols = 500
+        cell_size = 8
+        delivery_points = 20
+        obstacles = 0.2  # share of the map covered by buildings
+    elif grid_type.lower() == 'metropolis':
+        noOfRowsCols = 1000
+        cell_size = 8
+        delivery_points = 20
+        obstacles = 0.2
 
     # Placing depot in cell (4,0) and (5, 0)
     if grid_type.lower() == 'urban':
         x_scale = 4
     elif grid_type.lower() == 'suburban':
         x_scale = 5
-    else:
+    elif grid_type.lower() == 'rural':
         x_scale = 7
+    else:
+        x_scale = noOfRowsCols // 2
+    return noOfRowsCols, cell_size, delivery_points, obstacles, x_scale
 
-    x1_depot = x_scale * cell_size
-    y1_depot = 0 * cell_size
 
-    x2_depot = x1_depot + (cell_size * 2)
-    y2_depot = y1_depot + cell_size
+def createEnvironment(grid_type, seed=None, rng=None, chargers=1, depots=1):
+    # Drawing from the trial's generator (or one seeded with the trial's seed) so the layout can be regenerated
+    rng = rng or random.Random(seed)
 
-    canvas.create_rectangle(x1_depot + 10, y1_depot + 10, x2_depot - 10, y2_depot - 10, fill='blue')
+    noOfRowsCols, cell_size, delivery_points, obstacles, x_scale = grid_layout(grid_type)
 
-    # Placing the charger in cell (0,0)
-    x_charger = 0
-    y_charger = 0
-    canvas.create_oval(x_charger + 10, y_charger + 10, cell_size - 10, cell_size - 10, fill='purple')
+    if noOfRowsCols >= hierarchical_min_size:
+        return cell_size, noOfRowsCols, city_environment(noOfRowsCols, x_scale, delivery_points, obstacles, rng,
+                                                         chargers, depots)
 
     # Stored co-ordinates to avoid overlap
     coord_list = []
@@ -739,189 +2502,563 @@ def createEnvironment(canvas, grid_type):
             coord_list.append([i, j])
 
     # ----------- List of occupied cells -------------- #
-    # occupied_cells[0] for depot locations
-    # occupied_cells[1] for the charger location
+    # occupied_cells[0] for depot locations - two cells per depot
+    # occupied_cells[1] for charger locations
     # occupied_cells[2] for delivery points
     # occupied_cells[3] for obstacles
     # occupied_cells[4] for agents occupying cells
 
-    occupied_cells = [[[x_scale, 0], [x_scale + 1, 0]], [0, 0], [], [], []]  # Already including the depot and charger
+    depot_cells, charger_cells = station_cells(noOfRowsCols, x_scale, chargers, depots)
+    layers = [depot_cells, charger_cells, [], [], []]  # Already including the depots and chargers
 
     # Placing delivery points
     for i in range(delivery_points):
-        chosen_coord_choice = random.choice(coord_list)
-
-        random_x = chosen_coord_choice[0] * cell_size
-        random_y = chosen_coord_choice[1] * cell_size
-
-        occupied_cells[2].append(chosen_coord_choice)
+        chosen_coord_choice = rng.choice(coord_list)
+        layers[2].append(chosen_coord_choice)
         coord_list.remove(chosen_coord_choice)
 
-        canvas.create_oval(random_x + 10, random_y + 10, random_x + cell_size - 10, random_y + cell_size - 10,
-                           fill='red')
-
     # Placing obstacles
     for i in range(obstacles):
-        chosen_coord_choice = random.choice(coord_list)
-
-        random_x = chosen_coord_choice[0] * cell_size
-        random_y = chosen_coord_choice[1] * cell_size
-
-        occupied_cells[3].append(chosen_coord_choice)
+        chosen_coord_choice = rng.choice(coord_list)
+        layers[3].append(chosen_coord_choice)
         coord_list.remove(chosen_coord_choice)
-        canvas.create_oval(random_x + 10, random_y + 10, random_x + cell_size - 10, random_y + cell_size - 10,
-                           fill='dark grey')
 
+    occupied_cells = OccupancyGrid(layers, noOfRowsCols)
 
     return cell_size, noOfRowsCols, occupied_cells
 
 
-def createAgents(canvas, noOfBots, cell_size, noOfRowsCols, occupied_cells, grid_choice, delivery_list,
-                 delivery_manager, cell_manager):
-    agents = []
-    for i in range(0, noOfBots):
-        bot_number = i
-        bot = Bot("Agent" + str(i), grid_choice, cell_size, noOfRowsCols, bot_number)
-        brain = Brain(bot, occupied_cells, delivery_list, delivery_manager, cell_manager)
-        bot.setBrain(brain)
-        agents.append(bot)
-        bot.draw(canvas, noOfRowsCols)
-
-    return agents
-
-
+def station_cells(noOfRowsCols, x_scale, chargers=1, depots=1):
+    """
+    Depot and charger cells on the top row. The first depot (two cells from x_scale) and charger (at (0, 0)) are
+    where they have always been, and any more are spread along the row clear of the starting point in the top right
+    corner - with a free cell either side where there's room (two stations can share the bay between them), and
+    otherwise right next to another station, which still leaves each station its bay in the free row below.
+    Raises ValueError if they don't fit on the row
+    """
+    if chargers < 1 or depots < 1:
+        raise ValueError("A map needs at least one charger and one depot")
+    depot_cells = [[x_scale, 0], [x_scale + 1, 0]]
+    charger_cells = [[0, 0]]
+    stations = {0, x_scale, x_scale + 1}  # x of every station cell
+
+    def place(width, ideal_x):
+        for gap in (1, 0):
+            for offset in range(noOfRowsCols):
+                x = (ideal_x + offset) % noOfRowsCols
+                if x + width <= noOfRowsCols - 2 and not stations.intersection(range(x - gap, x + width + gap)):
+                    stations.update(range(x, x + width))
+                    return x
+        raise ValueError(f"No room for {chargers} chargers and {depots} depots on the top row of a {noOfRowsCols} "
+                         f"cell wide map")
+
+    for depot in range(1, depots):
+        x = place(2, x_scale + depot * noOfRowsCols // depots)
+        depot_cells += [[x, 0], [x + 1, 0]]
+    for charger in range(1, chargers):
+        charger_cells.append([place(1, charger * noOfRowsCols // chargers), 0])
+    return depot_cells, charger_cells
+
+
+def check_stations(grid_types, chargers, depots):
+    """Raises ValueError naming the first of the map types whose top row can't take the chargers and depots"""
+    for grid_type in grid_types:
+        noOfRowsCols, _, _, _, x_scale = grid_layout(grid_type)
+        try:
+            station_cells(noOfRowsCols, x_scale, chargers, depots)
+        except ValueError as e:
+            raise ValueError(f"{grid_type} map: {e}") from None
 
 
+def city_environment(noOfRowsCols, x_scale, delivery_points, building_cover, rng, chargers=1, depots=1):
+    """
+    Layout for the city-scale maps - obstacles are rectangular buildings, 2 to 8 cells a side, dropped until they
+    cover building_cover of the map, and cells are picked by rejection sampling rather than from a list of every
+    free cell. Like the small maps, the first two rows are kept free and the depot and charger sit on the top row
+    """
+    taken = set()
+    while len(taken) < building_cover * noOfRowsCols * noOfRowsCols:
+        width, height = rng.randint(2, 8), rng.randint(2, 8)
+        left, top = rng.randrange(noOfRowsCols - width + 1), rng.randrange(2, noOfRowsCols - height + 1)
+        taken.update((x, y) for x in range(left, left + width) for y in range(top, top + height))
+    depot_cells, charger_cells = station_cells(noOfRowsCols, x_scale, chargers, depots)
+    layers = [depot_cells, charger_cells, [], [[x, y] for x, y in taken], []]
 
-# ------------ Core Simulation Function -------------- #
-def moveAgents(canvas, agents, noOfRowsCols, occupied_cells, noOfBots, delivery_list, trial, callback_function,
-               start_time, grid_type):
+    while len(layers[2]) < delivery_points:
+        cell = (rng.randrange(noOfRowsCols), rng.randrange(2, noOfRowsCols))
+        if cell not in taken:
+            taken.add(cell)
+            layers[2].append([cell[0], cell[1]])
 
-    currently_alive = 0
-    all_finished = False
-    failedDeliveryPoints = []
-    all_bots_home = True  # checks if all the bots are at the starting point
+    return OccupancyGrid(layers, noOfRowsCols)
 
-    for ag in agents:
-        ag.update(canvas, noOfRowsCols, occupied_cells)
 
-        # Add only unique blocked targets
-        for target in ag.brain.blocked_targets:
-            if target not in failedDeliveryPoints:
-                failedDeliveryPoints.append(target)
+def drawEnvironment(canvas, cell_size, noOfRowsCols, occupied_cells):
+    """Draws the grid, depot, charger, delivery points and obstacles of an environment made by createEnvironment"""
 
-        # Check if this agent is still operational
-        if ag.battery > 0 and not ag.batteryRunOut:
-            currently_alive += 1
+    # Draw grid lines
+    for i in range(noOfRowsCols):
+        canvas.create_line(0, i * cell_size, noOfRowsCols * cell_size, i * cell_size, fill='grey')
+    for j in range(noOfRowsCols):
+        canvas.create_line(j * cell_size, 0, j * cell_size, noOfRowsCols * cell_size, fill='black')
 
-            # Check if there are no more packages to deliver
-            if ag.finishedPackages:
-                all_finished = True
+    # Each depot spans two cells in occupied_cells[0]
+    for depot_cell in occupied_cells[0][::2]:
+        x1_depot = depot_cell[0] * cell_size
+        y1_depot = depot_cell[1] * cell_size
 
-    # Checking if all the bots are in the starting position
-    for ag in agents:
+        x2_depot = x1_depot + (cell_size * 2)
+        y2_depot = y1_depot + cell_size
 
-        # Skip dead bots
-        if ag.battery <= 0 or ag.batteryRunOut:
-            continue
+        canvas.create_rectangle(x1_depot + 10, y1_depot + 10, x2_depot - 10, y2_depot - 10, fill='blue')
 
-        # Get the starting position coordinates
-        start_x = noOfRowsCols - 1
-        start_y = 0
-        current_grid_x, current_grid_y = pixel_to_grid(ag.pixel_x, ag.pixel_y, ag.cell_size)
+    # Chargers
+    for charger_cell in occupied_cells[1]:
+        x_charger = charger_cell[0] * cell_size
+        y_charger = charger_cell[1] * cell_size
+        canvas.create_oval(x_charger + 10, y_charger + 10, x_charger + cell_size - 10, y_charger + cell_size - 10,
+                           fill='purple')
 
-        # Check if this bot is at the starting position
-        if not (current_grid_x == start_x and current_grid_y == start_y):
-            all_bots_home = False
-            break  # No need to check more bots, we know not all are home
+    # Delivery points
+    for coord in occupied_cells[2]:
+        x = coord[0] * cell_size
+        y = coord[1] * cell_size
+        canvas.create_oval(x + 10, y + 10, x + cell_size - 10, y + cell_size - 10, fill='red')
 
-    # Termination conditions
+    # Obstacles
+    for coord in occupied_cells[3]:
+        x = coord[0] * cell_size
+        y = coord[1] * cell_size
+        canvas.create_oval(x + 10, y + 10, x + cell_size - 10, y + cell_size - 10, fill='dark grey')
 
-    # Only end if all packages are delivered AND all bots are back home
-    if len(delivery_list) == 0 and all_finished and all_bots_home:
-        end_time = time.time()
-        time_taken = end_time - start_time
 
+def createAgents(noOfBots, cell_size, noOfRowsCols, occupied_cells, grid_choice, delivery_list,
+                 delivery_manager, cell_manager, path_cache=None, distance_tables=None, coordinator=None,
+                 incremental=False, hierarchy=None, fleet=None, seed=None, slot_scheduler=None):
+    agents = []
+    for i in range(0, noOfBots):
+        bot_number = i
+        if fleet is not None:  # the bots were made with the fleet's arrays
+            bot = fleet.bots[i]
+        else:
+            bot = Bot("Agent" + str(i), grid_choice, cell_size, noOfRowsCols, bot_number)
+        # String seeds are hashed with SHA-512, so each bot's generator is the same in every process
+        brain = Brain(bot, occupied_cells, delivery_list, delivery_manager, cell_manager, path_cache, distance_tables,
+                      coordinator, incremental, hierarchy, random.Random(f"{seed}:{bot.bot_name}"), slot_scheduler)
+        bot.setBrain(brain)
+        agents.append(bot)
 
-        # Creating results dictionary
-        results = {
-            "grid_type": grid_type,
-            "bot_count": noOfBots,
-            "trial": trial + 1,
-            "completion_time": time_taken,
-            "bots_failed": noOfBots - currently_alive,
-            "deliveries_completed": 20 - len(delivery_list) - len(failedDeliveryPoints),
-            "deliveries_remaining": len(delivery_list),
-            "failed_delivery_points": len(failedDeliveryPoints),
-            "all_deliveries_completed": len(failedDeliveryPoints) == 0 and len(delivery_list) == 0  # returns boolean
-        }
+    return agents
 
-        print("Simulation complete - all packages delivered!!")
-        print(f"{currently_alive}/{noOfBots} agents are still alive")
-        if len(failedDeliveryPoints) > 0:
-            print(
-                f"These delivery points were obstructed by obstacles and were taken off the delivery list: {failedDeliveryPoints}")
 
-        # Create a copy of results to pass to callback (to avoid reference issues)
-        results_copy = results.copy()
+def drawAgents(canvas, agents, noOfRowsCols):
+    """Redraws every agent at its current position"""
+    for ag in agents:
+        canvas.delete(ag.bot_name)
+        ag.draw(canvas, noOfRowsCols)
 
-        # Close the window first
-        root = canvas.master
-        print(f"Destroying window for {grid_type}, {noOfBots}, trial {trial}")
-        try:
-            root.quit()  # Stop the mainloop
-            root.destroy()  # Destroy the window
-            print("Window destroyed successfully")
-        except Exception as e:
-            print(f"Error destroying window: {e}")
 
-        callback_function(results_copy)
-        return
+# ------------ Core Simulation Function -------------- #
 
-    if currently_alive == 0:
-        end_time = time.time()
-        time_taken = end_time - start_time
+class Simulation:
+    """
+    Headless, tick-based simulation engine. Each call to step() advances every Bot and Brain by one tick with no
+    canvas or after() scheduling, so a trial runs as fast as the CPU allows. Renderers only read the engine state.
+    With vectorised=True the bots' state is kept in a Fleet's arrays and the whole fleet is updated at once.
+    With event_driven=True, run() uses advance() instead of step() and jumps straight over the ticks in which every
+    bot is just travelling, charging or waiting, with the same results as stepping every tick.
+    With lifelong=True the trial is an open stream of work: there is no delivery list at the start, delivery requests
+    arrive at random (a Poisson process, arrival_rate per 1000 ticks) and are allocated as the bots come back to the
+    depot, and the trial runs for max_ticks (lifelong_ticks by default). The results add the steady-state throughput
+    and delivery latency percentiles.
+    chargers and depots set how many of each the map has - the bots book their bays through a SlotScheduler.
+    charging and charging_curve pick the ChargingPolicy - how far the bots charge and how fast - and the results add
+    the charger utilisation and the time bots spent queueing for their bays.
+    concurrency="threaded" swaps in the lock-holding ThreadSafeCellManager and ThreadSafeDeliveryManager, for
+    brains planning on worker threads - the engine itself steps every bot on one thread and needs no locks.
+    """
 
-        # Creating results dictionary
-        results = {
-            "grid_type": grid_type,
-            "bot_count": noOfBots,
-            "trial": trial + 1,
-            "completion_time": time_taken,
-            "bots_failed": noOfBots,  # All bots failed
-            "deliveries_completed": 20 - len(delivery_list) - len(failedDeliveryPoints),
-            "deliveries_remaining": len(delivery_list),
+    # MultiAgentPlanner.modes, plus "incremental" - each bot plans on its own with D* Lite around the bots next to it
+    planners = ("independent", "cbs", "whca", "incremental")
+    concurrency_modes = ("single", "threaded")
+
+    def __init__(self, grid_type, bot_count, trial, seed=None, planner="independent", max_ticks=None,
+                 vectorised=False, event_driven=False, allocation="fifo", lifelong=False, arrival_rate=8, chargers=1,
+                 depots=1, charging="full", charging_curve="linear", concurrency="single"):
+        if planner not in self.planners:
+            raise ValueError(f"Unknown planner {planner!r} - expected one of {self.planners}")
+        if concurrency not in self.concurrency_modes:
+            raise ValueError(f"Unknown concurrency mode {concurrency!r} - expected one of {self.concurrency_modes}")
+
+        self.grid_type = grid_type
+        self.noOfBots = bot_count
+        self.trial = trial
+        if seed is None:  # trials always run from a known seed so they can be replayed from results.json
+            seed = time.time_ns() & 0xFFFFFFFF
+        self.seed = seed
+        self.planner = planner
+        self.max_ticks = max_ticks  # trials still running after this many ticks are stopped and marked timed out
+        if lifelong and max_ticks is None:
+            self.max_ticks = lifelong_ticks
+        self.vectorised = vectorised
+        self.event_driven = event_driven
+        self.allocation = allocation
+        self.lifelong = lifelong
+        self.arrival_rate = arrival_rate
+        self.chargers = chargers
+        self.depots = depots
+        self.charging = charging
+        self.charging_curve = charging_curve
+        self.concurrency = concurrency
+
+        rng = random.Random(seed)
+        self.cell_size, self.noOfRowsCols, self.occupied_cells = createEnvironment(grid_type, rng=rng,
+                                                                                   chargers=chargers, depots=depots)
+        self.delivery_list = [] if lifelong else populate_delivery_list(self.occupied_cells[2], rng)
+        self.arrivals = random.Random(f"{seed}:arrivals")  # lifelong - request times and delivery points
+        self.next_arrival = self.arrivals.expovariate(arrival_rate / 1000) if lifelong else None
+
+        # Create separate resource managers
+        threaded = concurrency == "threaded"
+        self.cell_manager = (ThreadSafeCellManager if threaded else CellManager)(self.occupied_cells)
+        self.path_cache = PathCache(self.occupied_cells)
+        self.distance_tables = None
+        self.hierarchy = None
+        if self.noOfRowsCols >= hierarchical_min_size:
+            self.hierarchy = HierarchicalPlanner(self.occupied_cells)
+        else:
+            self.distance_tables = DistanceTables(self.occupied_cells)
+        self.delivery_manager = (ThreadSafeDeliveryManager if threaded else DeliveryManager)(
+            self.delivery_list, allocation, self.distance_tables, self.occupied_cells, lifelong=lifelong)
+        self.charging_policy = ChargingPolicy(charging, charging_curve, self.occupied_cells, self.distance_tables)
+        self.slot_scheduler = SlotScheduler(self.occupied_cells, self.distance_tables, self.charging_policy)
+        self.coordinator = None
+        if planner in MultiAgentPlanner.modes and planner != "independent":
+            self.coordinator = MultiAgentPlanner(planner, self.occupied_cells, self.distance_tables,
+                                                 cell_manager=self.cell_manager)
+
+        # Create the agents
+        self.fleet = None
+        if vectorised:
+            self.fleet = Fleet(bot_count, grid_type, self.cell_size, self.noOfRowsCols)
+        self.agents = createAgents(noOfBots=bot_count, cell_size=self.cell_size, noOfRowsCols=self.noOfRowsCols,
+                                   occupied_cells=self.occupied_cells, grid_choice=grid_type,
+                                   delivery_list=self.delivery_list, delivery_manager=self.delivery_manager,
+                                   cell_manager=self.cell_manager, path_cache=self.path_cache,
+                                   distance_tables=self.distance_tables, coordinator=self.coordinator,
+                                   incremental=planner == "incremental", hierarchy=self.hierarchy,
+                                   fleet=self.fleet, seed=seed, slot_scheduler=self.slot_scheduler)
+        self.delivery_manager.agents = self.agents
+        if self.coordinator is not None:
+            self.coordinator.agents = self.agents
+
+        self.tick = 0
+        self.collision_ticks = 0
+        self.currently_alive = bot_count
+        self.failedDeliveryPoints = []
+        self.start_time = time.time()
+        self.results = None
+
+    def step(self):
+        """Advances the simulation by one tick. Returns True once the trial has finished"""
+        if self.results is not None:
+            return True
+
+        self.tick += 1
+        noOfRowsCols = self.noOfRowsCols
+        self.delivery_manager.tick = self.tick
+        self.slot_scheduler.tick = self.tick
+        if self.lifelong:
+            self.release_requests()
+
+        if self.fleet is not None:
+            return self.step_fleet()
+
+        # Next moves along the distance fields for the whole fleet in one array operation
+        if self.distance_tables is not None:
+            self.distance_tables.prefetch_next_steps(self.agents)
+        currently_alive = 0
+        all_finished = False
+        failedDeliveryPoints = []
+        all_bots_home = True  # checks if all the bots are at the starting point
+
+        for ag in self.agents:
+            ag.update(noOfRowsCols, self.occupied_cells)
+
+            # Add only unique blocked targets
+            for target in ag.brain.blocked_targets:
+                if target not in failedDeliveryPoints:
+                    failedDeliveryPoints.append(target)
+
+            # Check if this agent is still operational
+            if ag.battery > 0 and not ag.batteryRunOut:
+                currently_alive += 1
+
+                # Check if there are no more packages to deliver
+                if ag.finishedPackages:
+                    all_finished = True
+
+        # Checking if all the bots are in the starting position
+        for ag in self.agents:
+
+            # Skip dead bots
+            if ag.battery <= 0 or ag.batteryRunOut:
+                continue
+
+            # Get the starting position coordinates
+            start_x = noOfRowsCols - 1
+            start_y = 0
+            current_grid_x, current_grid_y = pixel_to_grid(ag.pixel_x, ag.pixel_y, ag.cell_size)
+
+            # Check if this bot is at the starting position
+            if not (current_grid_x == start_x and current_grid_y == start_y):
+                all_bots_home = False
+                break  # No need to check more bots, we know not all are home
+
+        self.count_collisions()
+        return self.finish_tick(currently_alive, all_finished, all_bots_home, failedDeliveryPoints)
+
+    def release_requests(self):
+        """
+        Lifelong mode - adds the delivery requests that have arrived by this tick. Each one is stamped with the tick
+        it arrived in, so requests held back by advance() over ticks where no bot decides are timed the same
+        """
+        while self.next_arrival <= self.tick:
+            self.delivery_manager.add_request(self.arrivals.choice(self.occupied_cells[2]),
+                                              math.ceil(self.next_arrival))
+            self.next_arrival += self.arrivals.expovariate(self.arrival_rate / 1000)
+
+    def step_fleet(self):
+        """step() for a vectorised fleet - the bots are updated, counted and checked as arrays"""
+        if self.distance_tables is not None:
+            self.distance_tables.prefetch_next_steps(self.fleet.deciding_bots())
+        self.fleet.update(self.noOfRowsCols, self.occupied_cells)
+        currently_alive, all_finished, all_bots_home, collision = self.fleet.status(self.noOfRowsCols)
+        if collision:
+            self.collision_ticks += 1
+        return self.finish_tick(currently_alive, all_finished, all_bots_home, list(self.fleet.blocked_targets))
+
+    def finish_tick(self, currently_alive, all_finished, all_bots_home, failedDeliveryPoints):
+        """Records the tick's fleet status and checks whether the trial has finished"""
+        self.currently_alive = currently_alive
+        self.failedDeliveryPoints = failedDeliveryPoints
+
+        # Termination conditions
+
+        # Only end if all packages are delivered AND all bots are back home
+        if len(self.delivery_list) == 0 and all_finished and all_bots_home:
+            log("Simulation complete - all packages delivered!!")
+            log(f"{currently_alive}/{self.noOfBots} agents are still alive")
+            self.results = self.collect_results(self.noOfBots - currently_alive, failedDeliveryPoints)
+            return True
+
+        if currently_alive == 0:
+            log("All bots died!")
+            log(f"{len(self.delivery_list)}/{20} packages were not delivered")
+            self.results = self.collect_results(self.noOfBots, failedDeliveryPoints)  # All bots failed
+            return True
+
+        return False
+
+    def count_collisions(self):
+        """Counts ticks where two flying bots are inside the same cell"""
+        if self.has_collision(ag.cell_over() for ag in self.agents if not ag.batteryRunOut):
+            self.collision_ticks += 1
+
+    def has_collision(self, cells):
+        """True if two of the cells are the same (bots can share the starting point)"""
+        home = (self.noOfRowsCols - 1, 0)
+        seen = set()
+        for cell in cells:
+            if cell == home:
+                continue
+            if cell in seen:
+                return True
+            seen.add(cell)
+        return False
+
+    def advance(self):
+        """
+        Event-driven step. Jumps over the coming ticks in which every bot is quiet (see Bot.quiet_ticks) - launch
+        delays, charging, waits and the moves between cell centres - and then steps the first tick in which one
+        isn't: a cell arrival, a decision, a full battery, a pickup, a delivery or the end of a wait. Returns True
+        once the trial has finished, like step()
+        """
+        if self.results is not None:
+            return True
+
+        quiet = [ag.quiet_ticks(self.noOfRowsCols, self.occupied_cells) for ag in self.agents]
+        quiet = [ticks for ticks in quiet if ticks is not None]
+        ticks = min(quiet) if quiet else 0
+        if self.max_ticks is not None:
+            if not quiet:  # nothing will happen again - go straight to the tick limit
+                ticks = self.max_ticks
+            ticks = min(ticks, self.max_ticks - self.tick - 1)
+        if ticks > 0:
+            self.skip_ticks(ticks)
+        return self.step()
+
+    def skip_ticks(self, ticks):
+        """
+        Passes quiet ticks without stepping them. Bots moving between cells cross into the next cell part way, which
+        can change the collision count or bring the last bot home, so the ticks are split where a bot crosses over -
+        and the jump stops short of a tick in which the trial would end
+        """
+        flying = [ag for ag in self.agents if not ag.batteryRunOut]
+        moving = {ag for ag in flying if ag.has_launched and not ag.stopMoving and not ag.waiting}
+
+        # Ticks into the jump at which a moving bot is over a new cell
+        crossings = {1}
+        for ag in moving:
+            first_cell = ag.cell_over(1)
+            if ag.cell_over(ticks) != first_cell:
+                low, high = 1, ticks
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if ag.cell_over(middle) == first_cell:
+                        low = middle
+                    else:
+                        high = middle
+                crossings.add(high)
+        crossings = sorted(crossings)
+
+        home = (self.noOfRowsCols - 1, 0)
+        alive = [ag for ag in flying if ag.battery > 0]
+        all_finished = any(ag.finishedPackages for ag in alive)
+        for start, end in zip(crossings, crossings[1:] + [ticks + 1]):
+            cells = {ag: ag.cell_over(start if ag in moving else 0) for ag in flying}
+            if len(self.delivery_list) == 0 and all_finished and all(cells[ag] == home for ag in alive):
+                ticks = start - 1  # every bot is home - step() ends the trial on that tick
+                break
+            if self.has_collision(cells.values()):
+                self.collision_ticks += end - start
+
+        for ag in self.agents:
+            ag.pass_quiet_ticks(ticks)
+        self.tick += ticks
+
+    def collect_results(self, bots_failed, failedDeliveryPoints, timed_out=False):
+        """Builds the results dictionary stored in results.json for this trial"""
+        if len(failedDeliveryPoints) > 0:
+            log(f"These delivery points were obstructed by obstacles and were taken off the delivery list: "
+                f"{failedDeliveryPoints}")
+
+        bot_metrics = [{
+            "bot_name": ag.bot_name,
+            "distance_travelled": ag.cells_travelled,  # grid cells
+            "energy_used": ag.energy_used,  # battery units
+            "idle_ticks": ag.idle_ticks,
+            "charging_ticks": ag.charging_ticks
+        } for ag in self.agents]
+
+        return {
+            "grid_type": self.grid_type,
+            "bot_count": self.noOfBots,
+            "trial": self.trial + 1,
+            "seed": self.seed,
+            "completion_time": self.tick * tick_duration_ms / 1000,  # simulated seconds - reproducible across machines
+            "makespan_ticks": self.tick,
+            "wall_time": time.time() - self.start_time,
+            "bots_failed": bots_failed,
+            "deliveries_completed": len(self.delivery_manager.deliveries) if self.lifelong else
+            20 - len(self.delivery_list) - len(failedDeliveryPoints),
+            "deliveries_remaining": len(self.delivery_list),
             "failed_delivery_points": len(failedDeliveryPoints),
-            "all_deliveries_completed": len(failedDeliveryPoints) == 0 and len(delivery_list) == 0  # returns boolean
+            "all_deliveries_completed": len(failedDeliveryPoints) == 0 and len(self.delivery_list) == 0,
+            "timed_out": timed_out,
+            "planner": self.planner,
+            "vectorised": self.vectorised,
+            "event_driven": self.event_driven,
+            "allocation": self.allocation,
+            "chargers": self.chargers,
+            "depots": self.depots,
+            "charging": self.charging,
+            "charging_curve": self.charging_curve,
+            "collision_ticks": self.collision_ticks,
+            "total_distance_travelled": sum(metrics["distance_travelled"] for metrics in bot_metrics),
+            "total_energy_used": sum(metrics["energy_used"] for metrics in bot_metrics),
+            "total_idle_ticks": sum(metrics["idle_ticks"] for metrics in bot_metrics),
+            "path_cache_hits": self.path_cache.hits,
+            "path_cache_misses": self.path_cache.misses,
+            "planner_stats": self.planner_stats(),
+            "lifelong_stats": self.lifelong_stats(),
+            "charging_stats": self.charging_stats(),
+            "bot_metrics": bot_metrics
         }
 
-        print("All bots died!")
-        print(f"{len(delivery_list)}/{20} packages were not delivered")
-        if len(failedDeliveryPoints) > 0:
-            print(
-                f"These delivery points were obstructed by obstacles and were taken off the delivery list: {failedDeliveryPoints}")
+    def lifelong_stats(self):
+        """
+        Steady-state throughput (deliveries per 1000 ticks) and delivery latency (ticks from a request arriving to
+        its package being dropped off) - deliveries made in the warm-up share of the trial are left out
+        """
+        if not self.lifelong:
+            return {}
+        warmup_ticks = int(self.max_ticks * lifelong_warmup)
+        latencies = [latency for tick, latency in self.delivery_manager.deliveries if tick > warmup_ticks]
+        return {
+            "arrival_rate": self.arrival_rate,
+            "warmup_ticks": warmup_ticks,
+            "requests_arrived": self.delivery_manager.requests,
+            "requests_open": len(self.delivery_list) + sum(len(ag.brain.route) for ag in self.agents),
+            "throughput_per_1000_ticks": 1000 * len(latencies) / max(1, self.tick - warmup_ticks),
+            "latency_p50_ticks": float(np.percentile(latencies, 50)) if latencies else None,
+            "latency_p99_ticks": float(np.percentile(latencies, 99)) if latencies else None
+        }
 
-        # Create a copy of results to pass to callback (to avoid reference issues)
-        results_copy = results.copy()
+    def charging_stats(self):
+        """
+        Charger utilisation (the share of charger bay ticks bots spent charging) and the ticks bots queued at their
+        booked bay for another bot to finish with it
+        """
+        slots = self.slot_scheduler
+        bays = len(slots.bays("charger"))
+        charging_ticks = sum(int(ag.charging_ticks) for ag in self.agents)
+        return {
+            "charger_bays": bays,
+            "charges": slots.charges,
+            "charger_utilisation": round(charging_ticks / (self.tick * bays), 4) if self.tick and bays else 0.0,
+            "charger_queue_ticks": slots.queue_ticks["charger"],
+            "depot_queue_ticks": slots.queue_ticks["depot"],
+            "mean_charger_wait": round(slots.queue_ticks["charger"] / slots.charges, 1) if slots.charges else 0.0
+        }
 
+    def planner_stats(self):
+        if self.coordinator is not None:
+            return self.coordinator.stats()
+        if self.planner == "incremental":
+            return {"searches": sum(ag.brain.searches for ag in self.agents),
+                    "repairs": sum(ag.brain.repairs for ag in self.agents)}
+        return {}
+
+    def run(self):
+        """Steps the simulation until the trial finishes (or reaches max_ticks) and returns its results"""
+        step = self.advance if self.event_driven else self.step
+        while not step():
+            if self.max_ticks is not None and self.tick >= self.max_ticks:
+                log(f"Trial stopped after {self.tick} ticks")
+                self.results = self.collect_results(self.noOfBots - self.currently_alive, self.failedDeliveryPoints,
+                                                    timed_out=not self.lifelong)
+        return self.results
+
+
+def moveAgents(canvas, simulation):
+    """Optional Tkinter renderer - steps the engine once per canvas.after() and redraws the agents"""
+    finished = simulation.step()
+    drawAgents(canvas, simulation.agents, simulation.noOfRowsCols)
+
+    if finished:
         # Close the window first
         root = canvas.master
-        print(f"Destroying window for {grid_type}, {noOfBots}, trial {trial}")
+        print(f"Destroying window for {simulation.grid_type}, {simulation.noOfBots}, trial {simulation.trial}")
         try:
             root.quit()  # Stop the mainloop
             root.destroy()  # Destroy the window
             print("Window destroyed successfully")
         except Exception as e:
             print(f"Error destroying window: {e}")
-
-        # Calling callback function
-        callback_function(results_copy)
         return
 
-    canvas.after(50, moveAgents, canvas, agents, noOfRowsCols, occupied_cells, noOfBots, delivery_list, trial,
-                 callback_function, start_time, grid_type)
-
-
+    canvas.after(tick_duration_ms, moveAgents, canvas, simulation)
 
 
 # ---------------- A* Algorithm ------------------ #
@@ -932,81 +3069,1046 @@ def h_score(x1, y1, x2, y2):
 
 
 def a_star(start_x, start_y, target_x, target_y, occupied_cells, noOfRowsCols):
-    count = 0  # to track when the f_score was added
-    # Priority queue for open set
-    open_set = PriorityQueue()
-    open_set.put((0, 0, (start_x, start_y)))  # (f_score, count, position) for starting position
-
-    # Tracking which nodes are in open set for faster lookup
-    open_set_hash = {(start_x, start_y)}
+    """
+    A* over the occupancy grid using a heapq open set and flat lists indexed by y * noOfRowsCols + x for the
+    g_scores and parents. Improved nodes are pushed again and stale heap entries are skipped when popped (lazy
+    deletion), so there is no open set lookup. Returns the path as a list of (x, y) tuples from start to target.
+    """
+    n = noOfRowsCols
+    flags = occupied_cells.flags
+    start = start_y * n + start_x
+    target = target_y * n + target_x
 
-    # Tracking route from start to end node
-    came_from = {}
+    inf = float("inf")
+    g_score = [inf] * (n * n)
+    came_from = [-1] * (n * n)
+    closed = bytearray(n * n)
 
-    # Initialises g_score and f_score dictionaries
-    g_score = {(start_x, start_y): 0}
-    f_score = {(start_x, start_y): h_score(start_x, start_y, target_x, target_y)}
+    g_score[start] = 0
+    count = 0  # to track when the f_score was added - ties are broken first in, first out
+    open_set = [(h_score(start_x, start_y, target_x, target_y), 0, start)]  # (f_score, count, cell index)
 
-    while not open_set.empty():
+    while open_set:
         # Get node with lowest f_score
-        current = open_set.get()[2]
-        open_set_hash.remove(current)
+        current = heapq.heappop(open_set)[2]
+        if closed[current]:
+            continue  # stale entry - this node was already expanded with a better g_score
+        closed[current] = 1
 
         # Goal reached - reconstruct the path
-        if current == (target_x, target_y):
+        if current == target:
             path = []
-            current_node = current
-            while current_node in came_from:
-                path.append(current_node)
-                current_node = came_from[current_node]
-            path.append((start_x, start_y))  # Adding the start node
+            while current != -1:
+                path.append((current % n, current // n))
+                current = came_from[current]
             return path[::-1]  # Returning the path in the right order
 
-        current_g_score = g_score[current]  # initialising with starting g_score
-
-        neighbours = finding_free_neighbours(current[0], current[1], noOfRowsCols, occupied_cells)
+        current_x, current_y = current % n, current // n
+        temp_g_score = g_score[current] + 1  # each step is 1 unit (battery depletes one at a time)
 
-        for neighbour in neighbours:
-            # Calculate tentative g_score
-            temp_g_score = current_g_score + 1  # each step is 1 unit (battery depletes one at a time)
+        # Same neighbour order as finding_free_neighbours: down, right, up, left
+        for neighbour, neighbour_x, neighbour_y in ((current + n, current_x, current_y + 1),
+                                                    (current + 1, current_x + 1, current_y),
+                                                    (current - n, current_x, current_y - 1),
+                                                    (current - 1, current_x - 1, current_y)):
+            if not (0 <= neighbour_x < n and 0 <= neighbour_y < n) or flags[neighbour] & STATIC_FLAGS:
+                continue
 
             # Checking for a better path to the neighbour
-            if temp_g_score < g_score.get(neighbour, float("inf")):
+            if temp_g_score < g_score[neighbour]:
                 came_from[neighbour] = current
                 g_score[neighbour] = temp_g_score
-                f_score[neighbour] = temp_g_score + h_score(neighbour[0], neighbour[1], target_x, target_y)
+                count += 1
+                heapq.heappush(open_set, (temp_g_score + abs(neighbour_x - target_x) + abs(neighbour_y - target_y),
+                                          count, neighbour))
+    # No path found
+    return None
 
-                # Add to open set if not already there
-                if neighbour not in open_set_hash:
-                    count += 1
-                    open_set.put((f_score[neighbour], count, neighbour))
-                    open_set_hash.add(neighbour)
+
+def build_jump_tables(free, noOfRowsCols):
+    """
+    Target-independent part of every jump in jump_point_search, for a padded_free_cells grid - the next jump point
+    along each horizontal and vertical run (-1 where the run hits an obstacle first), plus ids of the maximal free
+    horizontal and vertical runs so a search can tell in O(1) whether its target lies on the same run
+    """
+    width = noOfRowsCols + 2
+    size = width * width
+    row_run = array("i", [-1]) * size
+    column_run = array("i", [-1]) * size
+    jump_right = array("i", [-1]) * size
+    jump_left = array("i", [-1]) * size
+    jump_down = array("i", [-1]) * size
+    jump_up = array("i", [-1]) * size
+
+    def forced(cell, dx):
+        # Turning off a horizontal run into the cell above or below only pays off if an obstacle blocked that cell
+        # from the cell before
+        return free[cell + width] and not free[cell - dx + width] or free[cell - width] and not free[cell - dx - width]
+
+    for y in range(1, width - 1):
+        row = y * width
+        run = -1
+        for cell in range(row + 1, row + width - 1):
+            if free[cell]:
+                if not free[cell - 1]:
+                    run = cell
+                row_run[cell] = run
+        for cell in range(row + width - 3, row, -1):
+            after = cell + 1
+            if free[after]:
+                jump_right[cell] = after if forced(after, 1) else jump_right[after]
+        for cell in range(row + 2, row + width - 1):
+            before = cell - 1
+            if free[before]:
+                jump_left[cell] = before if forced(before, -1) else jump_left[before]
+
+    for x in range(1, width - 1):
+        run = -1
+        for cell in range(width + x, size - width, width):
+            if free[cell]:
+                if not free[cell - width]:
+                    run = cell
+                column_run[cell] = run
+        for cell in range(size - 3 * width + x, 0, -width):
+            below = cell + width
+            if free[below]:
+                turns = jump_right[below] != -1 or jump_left[below] != -1
+                jump_down[cell] = below if turns else jump_down[below]
+        for cell in range(2 * width + x, size - width, width):
+            above = cell - width
+            if free[above]:
+                turns = jump_right[above] != -1 or jump_left[above] != -1
+                jump_up[cell] = above if turns else jump_up[above]
+
+    return row_run, column_run, {1: jump_right, -1: jump_left, width: jump_down, -width: jump_up}
+
+
+def jump_point_search(start_x, start_y, target_x, target_y, occupied_cells, noOfRowsCols):
+    """
+    Jump Point Search for the 4-connected grid - same arguments and path format as a_star, and the path has the
+    same length. Shortest paths are searched in a canonical form that moves vertically first and only turns from a
+    horizontal run into a vertical one where an obstacle forces it, so A* only expands the jump points where a
+    canonical path can turn. The jumps themselves come from the map's precomputed jump tables (see
+    build_jump_tables), so straight runs cost O(1) instead of a scan. Works best on open maps - shortest_path
+    picks it when obstacle density is low.
+    """
+    n = noOfRowsCols
+    width = n + 2
+    free = occupied_cells.padded_free_cells()
+    row_run, column_run, jumps = occupied_cells.jump_tables()
+    start = (start_y + 1) * width + start_x + 1
+    target = (target_y + 1) * width + target_x + 1
+    if start == target:
+        return [(start_x, start_y)]
+    if not free[target]:
+        return None  # a_star never enters a taken cell either
+    target_row_run = row_run[target]
+
+    def jump(cell, step):
+        """Next jump point from cell in the step direction, or -1 if the run hits an obstacle first"""
+        jump_point = jumps[step][cell]
+        # Runs are looked up from the first cell of the jump, as the start may be a taken cell (a bot on a depot)
+        if step in (1, -1):
+            # The target ends a horizontal run it lies on
+            if row_run[cell + step] == target_row_run and (target - cell) * step > 0 and \
+                    (jump_point == -1 or (jump_point - target) * step > 0):
+                return target
+        else:
+            # A vertical run also stops in the target's row if a horizontal run from there reaches the target
+            turn = cell + (target_y + 1 - cell // width) * width
+            if (turn - cell) * step > 0 and column_run[turn] == column_run[cell + step] != -1 and \
+                    row_run[turn] == target_row_run and (jump_point == -1 or (jump_point - turn) * step > 0):
+                return turn
+        return jump_point
+
+    inf = float("inf")
+    g_score = {start: 0}
+    came_from = {start: -1}
+    arrived_by = {start: 0}  # step (+-1 horizontal, +-width vertical) the jump point was reached with
+    closed = set()
+    count = 0
+    open_set = [(abs(start_x - target_x) + abs(start_y - target_y), 0, start)]
+
+    while open_set:
+        current = heapq.heappop(open_set)[2]
+        if current in closed:
+            continue  # stale entry
+        closed.add(current)
+
+        if current == target:
+            # Filling in the straight runs between jump points
+            jump_points = []
+            while current != -1:
+                jump_points.append(current)
+                current = came_from[current]
+            jump_points.reverse()
+            path = [(start_x, start_y)]
+            for previous, cell in zip(jump_points, jump_points[1:]):
+                step = arrived_by[cell]
+                while previous != cell:
+                    previous += step
+                    path.append((previous % width - 1, previous // width - 1))
+            return path
+
+        direction = arrived_by[current]
+        if direction == 0:  # start - same order as finding_free_neighbours: down, right, up, left
+            directions = (width, 1, -width, -1)
+        elif direction in (1, -1):
+            directions = [direction]
+            if free[current + width] and not free[current - direction + width]:
+                directions.append(width)
+            if free[current - width] and not free[current - direction - width]:
+                directions.append(-width)
+        else:
+            directions = (direction, 1, -1)
+
+        for step in directions:
+            jump_point = jump(current, step)
+            if jump_point == -1 or jump_point in closed:
+                continue
+
+            distance = abs(jump_point - current)
+            temp_g_score = g_score[current] + (distance if step in (1, -1) else distance // width)
+            if temp_g_score < g_score.get(jump_point, inf):
+                g_score[jump_point] = temp_g_score
+                came_from[jump_point] = current
+                arrived_by[jump_point] = step
+                count += 1
+                jump_x, jump_y = jump_point % width - 1, jump_point // width - 1
+                heapq.heappush(open_set, (temp_g_score + abs(jump_x - target_x) + abs(jump_y - target_y), count,
+                                          jump_point))
     # No path found
     return None
 
 
+def shortest_path(start_x, start_y, target_x, target_y, occupied_cells, noOfRowsCols):
+    """Shortest path as a_star returns it - found with Jump Point Search when the map is open enough"""
+    if occupied_cells.static_density() <= jps_max_density:
+        return jump_point_search(start_x, start_y, target_x, target_y, occupied_cells, noOfRowsCols)
+    return a_star(start_x, start_y, target_x, target_y, occupied_cells, noOfRowsCols)
+
+
+class DStarLite:
+    """
+    D* Lite (Koenig & Likhachev, 2002) towards one target - an incremental A* that searches backwards from the
+    target, so it keeps its search tree while the bot moves and, when cells become blocked or free again, repairs
+    only the part of the tree those cells affect instead of searching from scratch. A cell is blocked if the
+    static layers of the occupancy grid take it (changes are read from its static_changes log) or it was passed to
+    plan in sensed_cells. g and rhs are sparse dicts indexed like padded_free_cells.
+    """
+
+    def __init__(self, occupied_cells, target_x, target_y):
+        self.occupied_cells = occupied_cells
+        self.width = occupied_cells.noOfRowsCols + 2
+        self.free = occupied_cells.padded_free_cells()
+        self.version = occupied_cells.static_version
+        self.target = (target_x, target_y)
+        self.goal = (target_y + 1) * self.width + target_x + 1
+        self.start = None
+        self.last_start = None  # start when the edge costs last changed
+        self.km = 0  # key modifier - how far the heuristic's start point has moved since the search began
+        self.sensed = set()
+        self.g = {}
+        self.rhs = {self.goal: 0}
+        self.open_keys = {}  # cell -> key of its live heap entry
+        self.open_set = []  # (key, cell index) with stale entries skipped when popped
+        self.expansions = 0
+
+    def h(self, a, b):
+        width = self.width
+        return abs(a % width - b % width) + abs(a // width - b // width)
+
+    def blocked(self, cell):
+        return not self.free[cell] or cell in self.sensed
+
+    def key(self, cell):
+        best = min(self.g.get(cell, math.inf), self.rhs.get(cell, math.inf))
+        return best + self.h(self.start, cell) + self.km, best
+
+    def update_vertex(self, cell):
+        g, rhs, free, sensed = self.g, self.rhs, self.free, self.sensed
+        if cell != self.goal:
+            best = math.inf
+            if free[cell] and cell not in sensed:  # moving into or out of a blocked cell costs inf
+                width = self.width
+                for neighbour in (cell + width, cell + 1, cell - width, cell - 1):
+                    if free[neighbour] and neighbour not in sensed:
+                        cost = g.get(neighbour, math.inf) + 1
+                        if cost < best:
+                            best = cost
+            if best == math.inf:
+                rhs.pop(cell, None)
+            else:
+                rhs[cell] = best
+        if g.get(cell, math.inf) != rhs.get(cell, math.inf):
+            key = self.key(cell)
+            if self.open_keys.get(cell) != key:
+                self.open_keys[cell] = key
+                heapq.heappush(self.open_set, (key, cell))
+        else:
+            self.open_keys.pop(cell, None)
+
+    def compute_shortest_path(self):
+        g, rhs, open_keys, open_set = self.g, self.rhs, self.open_keys, self.open_set
+        width = self.width
+        start = self.start
+        while open_set:
+            key, cell = open_set[0]
+            if open_keys.get(cell) != key:
+                heapq.heappop(open_set)  # stale entry
+                continue
+            if key >= self.key(start) and rhs.get(start, math.inf) == g.get(start, math.inf):
+                break
+            heapq.heappop(open_set)
+            new_key = self.key(cell)
+            if key < new_key:  # the start moved since this cell was queued
+                open_keys[cell] = new_key
+                heapq.heappush(open_set, (new_key, cell))
+                continue
+            self.expansions += 1
+            del open_keys[cell]
+            neighbours = (cell + width, cell + 1, cell - width, cell - 1)
+            if g.get(cell, math.inf) > rhs.get(cell, math.inf):  # overconsistent - settle its g like A* would
+                g[cell] = rhs[cell]
+            else:  # underconsistent - a cell on its path got blocked, so it has to be re-derived
+                g.pop(cell, None)
+                self.update_vertex(cell)
+            for neighbour in neighbours:
+                self.update_vertex(neighbour)
+
+    def needs_repair(self, sensed_cells):
+        """True if the map or the sensed cells changed since the last plan"""
+        if self.version != self.occupied_cells.static_version:
+            return True
+        width = self.width
+        sensed = {(y + 1) * width + x + 1 for x, y in sensed_cells}
+        sensed.discard(self.goal)
+        return sensed != self.sensed
+
+    def plan(self, start_x, start_y, sensed_cells=()):
+        """
+        Shortest path from (start_x, start_y) to the target as a list of (x, y) cells like a_star returns, or None.
+        Cells that changed since the last call are repaired first
+        """
+        width = self.width
+        start = (start_y + 1) * width + start_x + 1
+        if self.start is None:
+            self.start = self.last_start = start
+            self.open_keys[self.goal] = self.key(self.goal)
+            heapq.heappush(self.open_set, (self.open_keys[self.goal], self.goal))
+        self.start = start
+
+        changed = set()
+        occupied_cells = self.occupied_cells
+        if self.version != occupied_cells.static_version:
+            for x, y in occupied_cells.static_changes[self.version:]:
+                changed.add((y + 1) * width + x + 1)
+            self.free = occupied_cells.padded_free_cells()
+            self.version = occupied_cells.static_version
+        sensed = {(y + 1) * width + x + 1 for x, y in sensed_cells}
+        sensed.discard(self.goal)  # a bot on the target can't be routed around
+        changed |= sensed ^ self.sensed
+        self.sensed = sensed
+        if changed:
+            self.km += self.h(self.last_start, start)
+            self.last_start = start
+            for cell in changed:
+                self.update_vertex(cell)
+                for neighbour in (cell + width, cell + 1, cell - width, cell - 1):
+                    self.update_vertex(neighbour)
+        self.compute_shortest_path()
+
+        # Following the cheapest successor from the start traces a shortest path once the search is done
+        g = self.g
+        if start != self.goal and (self.blocked(start) or g.get(start, math.inf) == math.inf):
+            return None
+        path = [(start_x, start_y)]
+        cell = start
+        while cell != self.goal:
+            best, best_g = None, math.inf
+            for neighbour in (cell + width, cell + 1, cell - width, cell - 1):
+                if g.get(neighbour, math.inf) < best_g and not self.blocked(neighbour):
+                    best, best_g = neighbour, g[neighbour]
+            if best is None or best_g >= g.get(cell, math.inf):
+                return None
+            cell = best
+            path.append((cell % width - 1, cell // width - 1))
+        return path
+
+
+def batched_distance_fields(targets, occupied_cells):
+    """
+    Breadth-first search outwards from every target at once as a vectorised wavefront - each step grows all the
+    frontiers by one cell with whole-grid NumPy operations. Returns an int32 array with one row per target, indexed
+    by y * noOfRowsCols + x, holding the number of steps from each cell to that target (-1 where it can't be reached)
+    """
+    n = occupied_cells.noOfRowsCols
+    free = (np.frombuffer(bytes(occupied_cells.flags), dtype=np.uint8).reshape(n, n) & STATIC_FLAGS) == 0
+    return wavefront_distances(free, targets).reshape(len(targets), n * n)
+
+
+def wavefront_distances(free, sources):
+    """
+    The wavefront behind batched_distance_fields. free is an (h, w) mask of free cells shared by every source, or a
+    (len(sources), h, w) stack with one mask per source, and sources are (x, y) cells. Returns an int32 array of
+    shape (len(sources), h, w) holding the steps from each cell to its source (-1 where it can't be reached)
+    """
+    shape = (len(sources),) + free.shape[-2:]
+    free = np.broadcast_to(free, shape)
+
+    frontier = np.zeros(shape, dtype=bool)
+    frontier[np.arange(len(sources)), [source[1] for source in sources], [source[0] for source in sources]] = True
+    unvisited = free & ~frontier
+
+    # A cell reached on step d has been unvisited for d steps, so adding the unvisited mask every step builds
+    # the distances without any masked writes
+    fields = np.zeros(shape, dtype=np.int32)
+    grown = np.empty(shape, dtype=bool)
+    while frontier.any():
+        fields += unvisited
+        grown[:] = False
+        grown[:, 1:, :] |= frontier[:, :-1, :]
+        grown[:, :-1, :] |= frontier[:, 1:, :]
+        grown[:, :, 1:] |= frontier[:, :, :-1]
+        grown[:, :, :-1] |= frontier[:, :, 1:]
+        np.logical_and(grown, unvisited, out=frontier)
+        unvisited &= ~frontier
+
+    # Cells that were never reached (or are occupied) get -1
+    fields[unvisited | ~free] = -1
+    return fields
+
+
+# ---------------- Multi-agent planning ------------------ #
+
+# Time in the multi-agent planners is counted in steps - one move to a neighbouring cell, or one wait, per step
+
+class ReservationTable:
+    """
+    Space-time reservation table - which agent holds cell (x, y) at time step t and which agent moves from one cell
+    to another arriving at t. An agent keeps holding its final cell for dwell steps after its path ends (bots pick
+    up, deliver or start charging there before they plan again). Cells in exempt_cells (the starting point, where
+    every bot launches and parks) can be shared.
+    """
+
+    def __init__(self, exempt_cells=(), dwell=2):
+        self.vertex = {}  # (x, y, t) -> agent
+        self.edge = {}  # (from_x, from_y, to_x, to_y, t) -> agent
+        self.last_time = {}  # (x, y) -> {agent: last step it holds the cell}
+        self.keys = {}  # agent -> reservation keys, so an agent's reservations can be released
+        self.exempt = set(exempt_cells)
+        self.dwell = dwell
+
+    def reserve_path(self, agent, path, start_time=0):
+        """Reserves every cell and move along a path that starts at start_time, plus the dwell on its last cell"""
+        vertex_keys, edge_keys = self.keys.setdefault(agent, ([], []))
+        for step, (x, y) in enumerate(path + path[-1:] * self.dwell):
+            t = start_time + step
+            if (x, y) not in self.exempt:
+                self.vertex[(x, y, t)] = agent
+                vertex_keys.append((x, y, t))
+                times = self.last_time.setdefault((x, y), {})
+                times[agent] = max(times.get(agent, t), t)
+            if 0 < step < len(path) and path[step - 1] != (x, y):
+                key = (path[step - 1][0], path[step - 1][1], x, y, t)
+                self.edge[key] = agent
+                edge_keys.append(key)
+
+    def release(self, agent):
+        """Removes every reservation held by an agent"""
+        vertex_keys, edge_keys = self.keys.pop(agent, ([], []))
+        for key in vertex_keys:
+            if self.vertex.get(key) == agent:
+                del self.vertex[key]
+            self.last_time.get((key[0], key[1]), {}).pop(agent, None)
+        for key in edge_keys:
+            if self.edge.get(key) == agent:
+                del self.edge[key]
+
+    def is_free(self, x, y, t, agent=None):
+        if (x, y) in self.exempt:
+            return True
+        return self.vertex.get((x, y, t), agent) == agent
+
+    def is_move_free(self, from_x, from_y, to_x, to_y, t, agent=None):
+        """False if another agent moves the opposite way at the same time (the two would swap cells)"""
+        owner = self.edge.get((to_x, to_y, from_x, from_y, t), agent)
+        return owner == agent
+
+    def free_from(self, x, y, agent=None):
+        """First step from which no other agent needs the cell any more"""
+        if (x, y) in self.exempt:
+            return 0
+        times = [t for owner, t in self.last_time.get((x, y), {}).items() if owner != agent]
+        return max(times) + 1 if times else 0
+
+
+def space_time_a_star(start, goal, occupied_cells, reservations, agent=None, start_time=0, heuristic=None,
+                      blocked_cells=(), max_time=None, avoid=None, window=None):
+    """
+    A* over (cell, time) states - each step either moves to a free neighbour or waits in place. It never enters a
+    cell that reservations says another agent holds at that step or the step before - bots don't reach cell
+    centres in lockstep, so following right behind another bot (or swapping with it) isn't safe. The goal only
+    counts as reached if no other agent needs the cell during the dwell that follows. Ties between equally short
+    paths go to the one with fewer clashes with the soft reservations in avoid. With a window, the search stops
+    window steps ahead and returns the partial path whose end is closest to the goal (windowed cooperative A*).
+    Returns a list of (x, y) cells with one entry per step (repeated cells are waits), or None.
+    """
+    n = occupied_cells.noOfRowsCols
+    flags = occupied_cells.flags
+    goal_x, goal_y = goal
+    if heuristic is None:
+        heuristic = lambda x, y: abs(x - goal_x) + abs(y - goal_y)
+
+    start_h = heuristic(start[0], start[1])
+    if start_h is None:
+        return None
+    if max_time is None:
+        goal_free = reservations.free_from(goal_x, goal_y, agent)
+        max_time = max(start_time, goal_free) + start_h + 2 * n
+
+    count = 0
+    open_set = [(start_time + start_h, 0, start_h, 0, start[0], start[1], start_time)]
+    came_from = {(start[0], start[1], start_time): None}
+
+    while open_set:
+        f, clashes, h, _, x, y, t = heapq.heappop(open_set)
+
+        if (x, y) == goal and all(reservations.is_free(goal_x, goal_y, t + k, agent)
+                                  for k in range(1, reservations.dwell + 1)) or \
+                window is not None and t - start_time >= window:
+            path = []
+            state = (x, y, t)
+            while state is not None:
+                path.append((state[0], state[1]))
+                state = came_from[state]
+            return path[::-1]
+
+        if t >= max_time:
+            continue
+
+        for next_x, next_y in ((x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y), (x, y)):
+            if (next_x, next_y) != (x, y):
+                if not (0 <= next_x < n and 0 <= next_y < n) or flags[next_y * n + next_x] & STATIC_FLAGS or \
+                        (next_x, next_y) in blocked_cells:
+                    continue
+                if not reservations.is_move_free(x, y, next_x, next_y, t + 1, agent) or \
+                        not reservations.is_free(next_x, next_y, t, agent):
+                    continue
+            if (next_x, next_y, t + 1) in came_from or not reservations.is_free(next_x, next_y, t + 1, agent):
+                continue
+
+            next_h = heuristic(next_x, next_y)
+            if next_h is None:
+                continue
+            next_clashes = clashes
+            if avoid is not None and (not avoid.is_free(next_x, next_y, t + 1, agent) or
+                                      (next_x, next_y) != (x, y) and not avoid.is_free(next_x, next_y, t, agent)):
+                next_clashes += 1
+            came_from[(next_x, next_y, t + 1)] = (x, y, t)
+            count += 1
+            heapq.heappush(open_set, (t + 1 + next_h, next_clashes, next_h, count, next_x, next_y, t + 1))
+
+    return None
+
+
+def find_conflicts(paths, exempt_cells=(), dwell=2):
+    """
+    Collisions between paths that all start at step 0 (agents stay on their last cell for dwell steps once their
+    path ends), earliest first. Yields ("vertex", i, j, (x, y), t), ("edge", i, j, (from, to), t) and
+    ("follow", i, j, (x, y), t) when j moves into a cell i held at t - 1
+    """
+    previous_positions = {}
+    horizon = max((len(path) for path in paths), default=0) + dwell
+    for t in range(horizon):
+        positions = {}
+        moves = {}
+        for i, path in enumerate(paths):
+            if t >= len(path) + dwell:
+                continue
+            cell = path[min(t, len(path) - 1)]
+            if cell not in exempt_cells:
+                if cell in positions:
+                    yield "vertex", positions[cell], i, cell, t
+                else:
+                    positions[cell] = i
+            if 0 < t < len(path) and path[t - 1] != cell:
+                previous = path[t - 1]
+                if (cell, previous) in moves:
+                    yield "edge", moves[(cell, previous)], i, (previous, cell), t
+                moves[(previous, cell)] = i
+        for cell, i in positions.items():
+            leader = previous_positions.get(cell, i)
+            if leader != i:
+                yield "follow", leader, i, cell, t
+        previous_positions = positions
+
+
+def first_conflict(paths, exempt_cells=(), dwell=2):
+    """Earliest collision between the paths (see find_conflicts), or None"""
+    return next(find_conflicts(paths, exempt_cells, dwell), None)
+
+
+def conflict_count(paths, exempt_cells=()):
+    return sum(1 for _ in find_conflicts(paths, exempt_cells))
+
+
+def prioritised_planning(starts, goals, occupied_cells, heuristics=None, exempt_cells=(), blocked_cells=(),
+                         window=None):
+    """
+    Plans the agents one at a time in order, each around the paths of the agents before it in a reservation table
+    (cooperative A*, or windowed cooperative A* with a window). Much cheaper than CBS but incomplete - returns one
+    path per agent, with None for agents that couldn't be planned
+    """
+    if heuristics is None:
+        heuristics = [None] * len(starts)
+    reservations = ReservationTable(exempt_cells)
+    for i, start in enumerate(starts):  # so earlier agents don't plan through where later ones are waiting
+        reservations.reserve_path(i, [start])
+    paths = []
+    for i, (start, goal) in enumerate(zip(starts, goals)):
+        reservations.release(i)
+        path = space_time_a_star(start, goal, occupied_cells, reservations, agent=i, heuristic=heuristics[i],
+                                 blocked_cells=blocked_cells, window=window)
+        if path is not None:
+            reservations.reserve_path(i, path)
+        paths.append(path)
+    return paths
+
+
+def conflict_based_search(starts, goals, occupied_cells, heuristics=None, exempt_cells=(), blocked_cells=(),
+                          max_expansions=200):
+    """
+    Conflict-Based Search. Every agent is planned on its own with space-time A*, then the first collision between
+    two paths is resolved by branching - one child forbids the first agent from that cell (or move) at that time,
+    the other forbids the second - until the paths are collision-free. Constraint tree nodes with the fewest
+    conflicts are expanded first (greedy CBS), which finds a solution in far fewer expansions than always taking
+    the cheapest node, at the cost of the paths not always being the shortest possible. Returns one path per
+    agent, or None if no solution is found within max_expansions nodes.
+    """
+    agent_count = len(starts)
+    if heuristics is None:
+        heuristics = [None] * agent_count
+
+    def plan(i, constraints, avoid):
+        table = ReservationTable(exempt_cells)
+        for constraint in constraints:
+            if constraint[0] == "vertex":
+                table.vertex[constraint[1]] = "constraint"
+                times = table.last_time.setdefault(constraint[1][:2], {})
+                times["constraint"] = max(times.get("constraint", 0), constraint[1][2])
+            else:
+                # Forbidding a move is stored as the opposite move, which is what is_move_free checks for
+                (from_cell, to_cell), t = constraint[1]
+                table.edge[(to_cell[0], to_cell[1], from_cell[0], from_cell[1], t)] = "constraint"
+        return space_time_a_star(starts[i], goals[i], occupied_cells, table, agent=i, heuristic=heuristics[i],
+                                 blocked_cells=blocked_cells, avoid=avoid)
+
+    # The other agents' paths are soft reservations, so low-level ties go to paths that cause fewer conflicts
+    avoid = ReservationTable(exempt_cells)
+    constraints = [() for _ in range(agent_count)]
+    paths = []
+    for i in range(agent_count):
+        paths.append(plan(i, (), avoid))
+        if paths[i] is None:
+            return None
+        avoid.reserve_path(i, paths[i])
+
+    count = 0
+    open_set = [(conflict_count(paths, exempt_cells), sum(len(path) for path in paths), count, constraints, paths)]
+    expansions = 0
+    while open_set and expansions < max_expansions:
+        conflicts, cost, _, constraints, paths = heapq.heappop(open_set)
+        conflict = first_conflict(paths, exempt_cells)
+        if conflict is None:
+            return paths
+        expansions += 1
+
+        kind, first_agent, second_agent, place, t = conflict
+        if kind == "vertex":
+            branches = ((first_agent, ("vertex", place + (t,))), (second_agent, ("vertex", place + (t,))))
+        elif kind == "follow":
+            branches = ((first_agent, ("vertex", place + (t - 1,))), (second_agent, ("vertex", place + (t,))))
+        else:
+            from_cell, to_cell = place  # the second agent's move - the first agent moves the opposite way
+            branches = ((first_agent, ("edge", ((to_cell, from_cell), t))),
+                        (second_agent, ("edge", ((from_cell, to_cell), t))))
+
+        avoid = ReservationTable(exempt_cells)
+        for i, path in enumerate(paths):
+            avoid.reserve_path(i, path)
+
+        for agent, constraint in branches:
+            child_constraints = list(constraints)
+            child_constraints[agent] = constraints[agent] + (constraint,)
+            path = plan(agent, child_constraints[agent], avoid)
+            if path is None or path == paths[agent]:  # no path, or the constraint can't be met (e.g. at step 0)
+                continue
+            child_paths = list(paths)
+            child_paths[agent] = path
+            count += 1
+            heapq.heappush(open_set, (conflict_count(child_paths, exempt_cells), sum(len(p) for p in child_paths),
+                                      count, child_constraints, child_paths))
+
+    return None
+
+
+class MultiAgentPlanner:
+    """
+    Fleet-wide collision-free planning shared by every Brain in a trial. In "cbs" mode, whenever a bot needs a
+    path, it is planned together with every other bot that is currently following a path using Conflict-Based
+    Search, and the others get their new paths too. Bots that aren't moving (charging, waiting) are treated as
+    obstacles, powered down bots have landed and are ignored, and bots sent to the same cell take turns at it. If
+    CBS runs out of its expansion budget, or more than max_cbs_agents bots would be planned together, the
+    requesting bot is planned on its own against the other bots' current paths in a reservation table
+    (prioritised planning).
+
+    In "whca" mode (windowed hierarchical cooperative A*) each bot plans on its own, only window steps ahead,
+    against the space-time reservations of the other bots' paths that the CellManager keeps, and reserves its own
+    path in turn. The exact distance fields guide the search past the window, and the bot plans its next window
+    when it reaches the end of the current one. Each plan only looks at window steps of every other bot, so the
+    cost grows linearly with the fleet. Windowed planning can't resolve head-on meetings in narrow corridors, so a
+    bot whose last max_stuck_plans windows didn't move it is planned together with the other bots as in "cbs" mode.
+    """
+
+    modes = ("independent", "cbs", "whca")
+
+    def __init__(self, mode, occupied_cells, distance_tables=None, max_expansions=64, max_cbs_agents=16,
+                 cell_manager=None, window=16, max_stuck_plans=2):
+        self.mode = mode
+        self.occupied_cells = occupied_cells
+        self.distance_tables = distance_tables
+        self.max_expansions = max_expansions
+        self.max_cbs_agents = max_cbs_agents  # bigger groups go straight to prioritised planning (see benchmark)
+        self.cell_manager = cell_manager
+        self.window = window
+        self.max_stuck_plans = max_stuck_plans
+        self.stuck_plans = {}  # brain -> windowed plans in a row that didn't move it
+        self.home = (occupied_cells.noOfRowsCols - 1, 0)  # starting point - every bot can share it
+        self.agents = []
+
+        self.plans = 0
+        self.cbs_solved = 0
+        self.fallbacks = 0
+        self.escalations = 0
+        self.planning_time = 0.0
+
+    def heuristic(self, goal):
+        """Exact distance from the distance tables when the goal has a field, otherwise Manhattan distance"""
+        tables = self.distance_tables
+        if tables is not None and tables.has_field(goal[0], goal[1]):
+            return lambda x, y: tables.distance(x, y, goal[0], goal[1])
+        return None
+
+    def is_held_by_other_bot(self, x, y):
+        # A bot only ever holds its own current cell when it decides its next one
+        return (x, y) != self.home and self.occupied_cells.has_flag(x, y, AGENT_FLAG)
+
+    def fleet_state(self, requester):
+        """Bots to plan together with the requester, and the cells of the bots that aren't moving"""
+        movable = []
+        blocked_cells = set()
+        for ag in self.agents:
+            brain = ag.brain
+            if brain is requester or not ag.has_launched:
+                continue
+            if ag.batteryRunOut:  # landed - not in the way
+                continue
+            if brain.current_path and not ag.stopMoving:
+                movable.append(brain)
+            else:
+                blocked_cells.add(pixel_to_grid(ag.pixel_x, ag.pixel_y, ag.cell_size))
+        blocked_cells.discard(self.home)
+        return movable, blocked_cells
+
+    def plan(self, requester, start_x, start_y, target_x, target_y):
+        """Collision-free path for the requesting brain, from its current cell to the target"""
+        if self.mode == "whca":
+            if self.stuck_plans.get(requester, 0) < self.max_stuck_plans:
+                return self.plan_windowed(requester, start_x, start_y, target_x, target_y)
+            self.stuck_plans[requester] = 0
+            self.escalations += 1
+
+        plan_start = time.perf_counter()
+        self.plans += 1
+        movable, blocked_cells = self.fleet_state(requester)
+
+        # Bots in transit have already popped the cell they left, so current_path[0] is where they are heading
+        starts = [(start_x, start_y)] + [brain.current_path[0] for brain in movable]
+        goals = [(target_x, target_y)] + [brain.path_target for brain in movable]
+        blocked_cells -= set(goals)
+
+        # Two bots can't start on the same cell, so CBS can't solve that
+        shared_starts = [start for start in starts if start != self.home]
+        path = None
+        if len(set(shared_starts)) == len(shared_starts) and len(starts) <= self.max_cbs_agents:
+            path = conflict_based_search(starts, goals, self.occupied_cells,
+                                         heuristics=[self.heuristic(goal) for goal in goals],
+                                         exempt_cells={self.home}, blocked_cells=blocked_cells,
+                                         max_expansions=self.max_expansions)
+        if path is not None:
+            self.cbs_solved += 1
+            for brain, new_path in zip(movable, path[1:]):
+                brain.current_path = deque(new_path)
+            path = path[0]
+        else:
+            self.fallbacks += 1
+            path = self.plan_prioritised(starts[0], goals[0], movable, blocked_cells)
+        if self.mode == "whca":
+            self.cell_manager.reserve_path(requester)
+
+        self.planning_time += time.perf_counter() - plan_start
+        return path
+
+    def plan_windowed(self, requester, start_x, start_y, target_x, target_y):
+        """The requesting brain's path for the next window steps, around the other bots' reserved paths"""
+        plan_start = time.perf_counter()
+        self.plans += 1
+        goal = (target_x, target_y)
+        _, blocked_cells = self.fleet_state(requester)
+        blocked_cells.discard(goal)
+
+        reservations = self.cell_manager.space_time_reservations(requester, self.window, {self.home})
+        path = space_time_a_star((start_x, start_y), goal, self.occupied_cells, reservations,
+                                 agent=requester, heuristic=self.heuristic(goal), blocked_cells=blocked_cells,
+                                 window=self.window)
+        if path is None:
+            self.cell_manager.release_path(requester)
+        else:
+            self.cell_manager.reserve_path(requester)
+        if path is None or all(cell == (start_x, start_y) for cell in path):
+            self.stuck_plans[requester] = self.stuck_plans.get(requester, 0) + 1
+        else:
+            self.stuck_plans[requester] = 0
+
+        self.planning_time += time.perf_counter() - plan_start
+        return path
+
+    def plan_prioritised(self, start, goal, movable, blocked_cells):
+        """Plans only the requester, around the other bots' current paths"""
+        reservations = ReservationTable({self.home})
+        for brain in movable:
+            reservations.reserve_path(brain, list(brain.current_path))
+        path = space_time_a_star(start, goal, self.occupied_cells, reservations, heuristic=self.heuristic(goal),
+                                 blocked_cells=blocked_cells)
+        if path is None:
+            # Nothing collision-free right now - take the shortest path and rely on waiting for held cells
+            path = shortest_path(start[0], start[1], goal[0], goal[1], self.occupied_cells,
+                                 self.occupied_cells.noOfRowsCols)
+        return path
+
+    def stats(self):
+        return {
+            "plans": self.plans,
+            "cbs_solved": self.cbs_solved,
+            "fallbacks": self.fallbacks,
+            "escalations": self.escalations,
+            "planning_time": self.planning_time
+        }
+
+
+def benchmark_planners(agent_counts=(8, 16, 32, 50), noOfRowsCols=32, obstacle_density=0.1, queries=20, seed=0,
+                       max_expansions=64, window=16):
+    """
+    Times planning a whole fleet at once on a random map, for each fleet size - one a_star call per bot (today's
+    independent planning), one conflict_based_search call, prioritised_planning (what MultiAgentPlanner falls
+    back to when CBS runs out of expansions) and windowed prioritised planning ("whca" mode). Prints the mean and
+    worst time per fleet plan, how many CBS plans fit in one tick and the success rates, and returns the rows.
+    """
+    rng = random.Random(seed)
+    cells = [[x, y] for x in range(noOfRowsCols) for y in range(noOfRowsCols)]
+    obstacles = rng.sample(cells, int(len(cells) * obstacle_density))
+    occupied_cells = OccupancyGrid([[], [], [], obstacles, []], noOfRowsCols)
+    free_cells = [(x, y) for x, y in map(tuple, cells) if occupied_cells.is_free(x, y)]
+
+    rows = []
+    for agent_count in agent_counts:
+        independent_times = []
+        cbs_times = []
+        prioritised_times = []
+        windowed_times = []
+        solved = 0
+        prioritised_solved = 0
+        for _ in range(queries):
+            starts = rng.sample(free_cells, agent_count)
+            goals = rng.sample(free_cells, agent_count)
+
+            plan_start = time.perf_counter()
+            for start, goal in zip(starts, goals):
+                a_star(start[0], start[1], goal[0], goal[1], occupied_cells, noOfRowsCols)
+            independent_times.append(time.perf_counter() - plan_start)
+
+            plan_start = time.perf_counter()
+            paths = conflict_based_search(starts, goals, occupied_cells, max_expansions=max_expansions)
+            cbs_times.append(time.perf_counter() - plan_start)
+            solved += paths is not None
+
+            plan_start = time.perf_counter()
+            paths = prioritised_planning(starts, goals, occupied_cells)
+            prioritised_times.append(time.perf_counter() - plan_start)
+            prioritised_solved += None not in paths
+
+            plan_start = time.perf_counter()
+            prioritised_planning(starts, goals, occupied_cells, window=window)
+            windowed_times.append(time.perf_counter() - plan_start)
+
+        row = {
+            "agents": agent_count,
+            "independent_ms": 1000 * sum(independent_times) / queries,
+            "cbs_ms": 1000 * sum(cbs_times) / queries,
+            "cbs_worst_ms": 1000 * max(cbs_times),
+            "cbs_within_tick": sum(t * 1000 <= tick_duration_ms for t in cbs_times) / queries,
+            "cbs_solved": solved / queries,
+            "prioritised_ms": 1000 * sum(prioritised_times) / queries,
+            "prioritised_solved": prioritised_solved / queries,
+            "windowed_ms": 1000 * sum(windowed_times) / queries
+        }
+        rows.append(row)
+        print(f"{agent_count:>3} agents on {noOfRowsCols}x{noOfRowsCols}: "
+              f"independent A* {row['independent_ms']:.2f}ms, "
+              f"CBS {row['cbs_ms']:.2f}ms (worst {row['cbs_worst_ms']:.2f}ms), "
+              f"{row['cbs_within_tick']:.0%} within a {tick_duration_ms}ms tick, {row['cbs_solved']:.0%} solved; "
+              f"prioritised {row['prioritised_ms']:.2f}ms, {row['prioritised_solved']:.0%} solved; "
+              f"windowed ({window} steps) {row['windowed_ms']:.2f}ms")
+    return rows
+
+
+def benchmark_hierarchy(grid_types=("city", "metropolis"), queries=20, seed=0):
+    """
+    Times cross-map queries (start and target more than 80% of the map width apart) on the city-scale maps -
+    shortest_path (A* or Jump Point Search) against HierarchicalPlanner, both for the abstract path plus the first
+    leg a bot needs to start moving and for the whole refined path. Prints the build time, the mean time per query
+    and how much longer the HPA* paths are, and returns the rows.
+    """
+    rows = []
+    for grid_type in grid_types:
+        rng = random.Random(seed)
+        _, noOfRowsCols, occupied_cells = createEnvironment(grid_type, seed)
+        build_start = time.perf_counter()
+        hierarchy = HierarchicalPlanner(occupied_cells)
+        build_time = time.perf_counter() - build_start
+
+        pairs = []
+        while len(pairs) < queries:
+            start = (rng.randrange(noOfRowsCols), rng.randrange(noOfRowsCols))
+            target = (rng.randrange(noOfRowsCols), rng.randrange(noOfRowsCols))
+            if occupied_cells.is_free(*start) and occupied_cells.is_free(*target) and \
+                    h_score(start[0], start[1], target[0], target[1]) > 0.8 * noOfRowsCols:
+                pairs.append((start, target))
+
+        flat_times = []
+        first_leg_times = []
+        full_times = []
+        length_ratios = []
+        for start, target in pairs:
+            plan_start = time.perf_counter()
+            path = shortest_path(start[0], start[1], target[0], target[1], occupied_cells, noOfRowsCols)
+            flat_times.append(time.perf_counter() - plan_start)
+
+            plan_start = time.perf_counter()
+            waypoints = hierarchy.abstract_path(start[0], start[1], target[0], target[1])
+            if waypoints is not None:
+                hierarchy.refine(waypoints[0], waypoints[1])
+            first_leg_times.append(time.perf_counter() - plan_start)
+
+            plan_start = time.perf_counter()
+            hierarchical_path = hierarchy.find_path(start[0], start[1], target[0], target[1])
+            full_times.append(time.perf_counter() - plan_start)
+            if path is not None and hierarchical_path is not None:
+                length_ratios.append((len(hierarchical_path) - 1) / (len(path) - 1))
+
+        row = {
+            "grid_type": grid_type,
+            "cells": noOfRowsCols * noOfRowsCols,
+            "build_s": build_time,
+            "abstract_nodes": len(hierarchy.edges),
+            "shortest_path_ms": 1000 * sum(flat_times) / queries,
+            "hpa_first_leg_ms": 1000 * sum(first_leg_times) / queries,
+            "hpa_full_ms": 1000 * sum(full_times) / queries,
+            "hpa_length_ratio": sum(length_ratios) / len(length_ratios) if length_ratios else None
+        }
+        rows.append(row)
+        print(f"{grid_type} {noOfRowsCols}x{noOfRowsCols}: built in {row['build_s']:.2f}s "
+              f"({row['abstract_nodes']} abstract nodes); shortest_path {row['shortest_path_ms']:.1f}ms, "
+              f"HPA* first leg {row['hpa_first_leg_ms']:.1f}ms, whole path {row['hpa_full_ms']:.1f}ms, "
+              f"{row['hpa_length_ratio']:.3f}x the shortest length")
+    return rows
+
+
+def benchmark_fleet(bot_counts=(8, 100, 1000, 5000), grid_type="city", ticks=200, warmup=50, seed=0):
+    """
+    Times Simulation.step with Bot objects against a vectorised Fleet for growing fleets. Every bot is launched
+    straight away so the whole fleet is flying, and after warmup untimed ticks (where most of the first paths are
+    planned) each run is stepped for the given number of ticks or until the trial ends. The mean ticks per second
+    of both modes are printed and returned.
+    """
+    rows = []
+    for bot_count in bot_counts:
+        row = {"bot_count": bot_count}
+        for vectorised in (False, True):
+            simulation = Simulation(grid_type, bot_count, 0, seed=seed, vectorised=vectorised)
+            for ag in simulation.agents:
+                ag.launch_countdown = 0
+            while simulation.tick < warmup and not simulation.step():
+                pass
+            run_start = time.perf_counter()
+            while simulation.tick < warmup + ticks and not simulation.step():
+                pass
+            row["arrays" if vectorised else "objects"] = (simulation.tick - warmup) / (time.perf_counter() - run_start)
+        rows.append(row)
+        print(f"{bot_count} bots on {grid_type}: {row['objects']:.1f} ticks/s with Bot objects, "
+              f"{row['arrays']:.1f} ticks/s with a Fleet ({row['arrays'] / row['objects']:.1f}x)")
+    return rows
+
+
+def lifelong_experiment(grid_type="rural", bot_count=8, arrival_rates=(2, 4, 8, 16), seed=0, planner="independent",
+                        allocation="fifo", event_driven=False, chargers=1, depots=1, charging="full",
+                        charging_curve="linear"):
+    """
+    Runs a lifelong trial (see Simulation) at each arrival rate and prints the steady-state throughput, the p50 and
+    p99 delivery latency and the requests still open at the end - past the rate the fleet can keep up with, the
+    open requests and the latency grow with the length of the trial. Returns the trials' lifelong_stats.
+    """
+    rows = []
+    for arrival_rate in arrival_rates:
+        results = Simulation(grid_type, bot_count, 0, seed, planner, event_driven=event_driven, allocation=allocation,
+                             lifelong=True, arrival_rate=arrival_rate, chargers=chargers, depots=depots,
+                             charging=charging, charging_curve=charging_curve).run()
+        stats = results["lifelong_stats"]
+        rows.append(stats)
+        print(f"{arrival_rate} requests per 1000 ticks on {grid_type} with {bot_count} bots ({planner}, {allocation}): "
+              f"{stats['throughput_per_1000_ticks']:.2f} deliveries per 1000 ticks, latency p50 "
+              f"{stats['latency_p50_ticks'] or 0:.0f} / p99 {stats['latency_p99_ticks'] or 0:.0f} ticks, "
+              f"{stats['requests_open']} requests open")
+    return rows
+
+
 # ------------- Helper Functions -------------- #
 
+def log(message):
+    """Prints simulation status messages when verbose logging is switched on"""
+    if verbose_logging:
+        print(message)
+
+
 def finding_free_neighbours(x_coord, y_coord, noOfRowsCols, occupied_cells):
-    # Checking neighbours
+    # Checking neighbours against the occupancy grid flags - O(1) per neighbour
+    flags = occupied_cells.flags
     neighbours = []
     for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:  # possible directions
         neighbour_x, neighbour_y = x_coord + dx, y_coord + dy
 
         # Check against edge cases
         if 0 <= neighbour_x < noOfRowsCols and 0 <= neighbour_y < noOfRowsCols:
-            if [neighbour_x, neighbour_y] not in occupied_cells[0] and \
-                    [neighbour_x, neighbour_y] not in occupied_cells[1] and \
-                    [neighbour_x, neighbour_y] not in occupied_cells[2] and \
-                    [neighbour_x, neighbour_y] not in occupied_cells[3]:
+            if not flags[neighbour_y * noOfRowsCols + neighbour_x] & STATIC_FLAGS:
                 neighbours.append((neighbour_x, neighbour_y))
     return neighbours
 
 
-def populate_delivery_list(occupied_delivery_cells):
+def populate_delivery_list(occupied_delivery_cells, rng):
     delivery_list = []
     for i in range(20):
-        coord_choice = random.choice(occupied_delivery_cells)
+        coord_choice = rng.choice(occupied_delivery_cells)
         delivery_list.append([coord_choice[0], coord_choice[1]])
     return delivery_list
 
@@ -1020,96 +4122,353 @@ def pixel_to_grid(pixel_x, pixel_y, cell_size):
     return int(pixel_x / cell_size), int(pixel_y / cell_size)
 
 
+def reserved_cells(current_reserve, next_reserve):
+    """The cells a bot holds - a bot staying put reserved its cell once, so it's only released once"""
+    if next_reserve is None or next_reserve == current_reserve:
+        return [current_reserve] if current_reserve else []
+    return [current_reserve, next_reserve] if current_reserve else [next_reserve]
+
+
+def cell_size_steps(cell_size, speed):
+    """Moves of speed pixels from one cell centre until the next is less than speed + 2 pixels away"""
+    return int((cell_size - speed - 2) // speed) + 1
+
+
 # ---------------- Running the experiments ---------------- #
 
-def launch_experiment():
+def launch_experiment(workers=None, base_seed=None, render=False, resume=False, max_retries=2, planner="independent",
+                      event_driven=False, allocation="fifo", chargers=1, depots=1, charging="full",
+                      charging_curve="linear"):
+    if base_seed is None:
+        base_seed = int(time.time())
+    print(f"Base seed for this sweep: {base_seed}")
+
     experiment_queue = []
 
     # Generating all experiment combinations
-    for grid_type in ["urban", "suburban", "rural"]:
+    for grid_type in sweep_grid_types:
         for bot_count in [1, 3, 5, 8]:
             for trial in range(10):
-                experiment_queue.append((grid_type, bot_count, trial))
+                experiment_queue.append((grid_type, bot_count, trial, trial_seed(base_seed, grid_type, bot_count, trial)))
 
-    # Start first experiment
-    run_next_experiment(experiment_queue, {})
+    scheduler = ExperimentScheduler(experiment_queue, workers=workers, render=render, resume=resume,
+                                    max_retries=max_retries, planner=planner, event_driven=event_driven,
+                                    allocation=allocation, chargers=chargers, depots=depots, charging=charging,
+                                    charging_curve=charging_curve)
+    scheduler.run()
 
+    print("All experiments completed, analyzing results...")
+    analyse_results(scheduler.results_path)
 
-def run_next_experiment(queue, all_results):
-    if len(queue) == 0:  # All experiments are complete
-        print("All experiments are finished!")
-        return
 
-    # Get the experiment
-    grid_type, bot_count, trial = queue.pop(0)
+def trial_seed(base_seed, grid_type, bot_count, trial):
+    """Derives a per-trial seed from the sweep's base seed - stable across processes, unlike hash()"""
+    return random.Random(f"{base_seed}:{grid_type}:{bot_count}:{trial}").getrandbits(32)
 
-    # Show progress
-    print(f"Running - {grid_type}, {bot_count} bot(s), trial: {trial + 1}/10")
+
+def run_trial(experiment, planner="independent", event_driven=False, allocation="fifo", chargers=1, depots=1,
+              charging="full", charging_curve="linear"):
+    """Runs one headless trial - the unit of work handed to each process pool worker"""
+    grid_type, bot_count, trial, seed = experiment
+    try:
+        return Simulation(grid_type, bot_count, trial, seed, planner, event_driven=event_driven,
+                          allocation=allocation, chargers=chargers, depots=depots, charging=charging,
+                          charging_curve=charging_curve).run()
+    except Exception as e:
+        return {"grid_type": grid_type, "bot_count": bot_count, "trial": trial + 1, "seed": seed, "error": str(e)}
 
 
+def run_rendered_trial(experiment, planner="independent", allocation="fifo", chargers=1, depots=1, charging="full",
+                       charging_curve="linear"):
+    """Runs one trial in a Tkinter window on the main thread and returns its results"""
+    grid_type, bot_count, trial, seed = experiment
     try:
-        # After main is finished, the callback will run
-        main(grid_type, bot_count, trial, lambda single_result: experiment_completed(single_result, queue, all_results))
+        results = main(grid_type, bot_count, trial, render=True, seed=seed, planner=planner, allocation=allocation,
+                       chargers=chargers, depots=depots, charging=charging, charging_curve=charging_curve)
+        if results is None:
+            raise RuntimeError("window was closed before the trial finished")
+        return results
     except Exception as e:
-        print(f"Error running experiment {grid_type}, {bot_count}, trial {trial}: {e}")
-        # Still try to run the next experiment
-        experiment_completed({"grid_type": grid_type, "bot_count": bot_count,
-                              "trial": trial, "error": str(e)}, queue, all_results)
-
-
-# Storing the results
-def experiment_completed(single_result, queue, all_results):
-    grid_type = single_result["grid_type"]
-    bot_count = single_result["bot_count"]
-    if grid_type not in all_results:
-        all_results[grid_type] = {}
-    if bot_count not in all_results[grid_type]:
-        all_results[grid_type][bot_count] = []
-
-    all_results[grid_type][bot_count].append(single_result)
-
-    # Save results to JSON file after each experiment
-    with open("results.json", "w") as f:
-        json.dump(all_results, f, indent=4)
-
-    # Force garbage collection to clear out any lingering references
-    gc.collect()
-
-    # Check if this was the last experiment
-    if len(queue) == 0:
-        print("All experiments completed, analyzing results...")
-        analyse_results()  # Call analyze directly if queue is empty
-    else:
-        # Start next experiment
-        print("Starting next experiment...")
-        # Create a small delay to ensure previous resources are released
-        time.sleep(0.5)
-        # Start the next experiment
-        run_next_experiment(queue, all_results)
+        return {"grid_type": grid_type, "bot_count": bot_count, "trial": trial + 1, "seed": seed, "error": str(e)}
 
 
-def main(grid_type, bot_count, trial, callback_function):
-    window = tk.Tk()
-    canvas = initialise(window)
-    cell_size, noOfRowsCols, occupied_cells = createEnvironment(canvas, grid_type)
-    delivery_list = populate_delivery_list(occupied_cells[2])
+def replay_trial(grid_type, bot_count, trial, results_path="results.json", render=False, event_driven=False):
+    """
+    Re-runs a trial recorded in results.json (trial numbered from 1, as stored there) from its seed and with its
+    planner, allocation strategy, number of chargers and depots and charging policy. The environment, delivery list
+    and every bot's target choices are drawn from generators seeded by that seed, so the replay takes the same number
+    of ticks - for profiling a slow trial or comparing two builds on it.
+    """
+    with open(results_path, 'r') as f:
+        trials = json.load(f).get(grid_type, {}).get(str(bot_count), [])
+    recorded = next((entry for entry in trials if entry["trial"] == trial), None)
+    if recorded is None or recorded.get("seed") is None:
+        raise ValueError(f"No seeded entry for {grid_type}, {bot_count} bot(s), trial {trial} in {results_path}")
+
+    planner = recorded.get("planner", "independent")
+    allocation = recorded.get("allocation", "fifo")
+    chargers, depots = recorded.get("chargers", 1), recorded.get("depots", 1)
+    charging, charging_curve = recorded.get("charging", "full"), recorded.get("charging_curve", "linear")
+    print(f"Replaying {grid_type}, {bot_count} bot(s), trial {trial} - seed {recorded['seed']}, planner {planner}, "
+          f"allocation {allocation}, {chargers} charger(s), {depots} depot(s), charging {charging} ({charging_curve})")
+    if render:
+        return main(grid_type, bot_count, trial - 1, render=True, seed=recorded["seed"], planner=planner,
+                    allocation=allocation, chargers=chargers, depots=depots, charging=charging,
+                    charging_curve=charging_curve)
+
+    results = Simulation(grid_type, bot_count, trial - 1, recorded["seed"], planner,
+                         vectorised=recorded.get("vectorised", False), event_driven=event_driven,
+                         allocation=allocation, chargers=chargers, depots=depots, charging=charging,
+                         charging_curve=charging_curve).run()
+    print(f"Makespan {results['makespan_ticks']} ticks (recorded {recorded.get('makespan_ticks')}), "
+          f"wall time {results['wall_time']:.2f}s (recorded {recorded.get('wall_time', float('nan')):.2f}s)")
+    return results
+
+
+class ExperimentScheduler:
+    """
+    Iterative job scheduler for experiment sweeps. Trials are taken off a queue in a loop (no recursion), errored
+    trials are retried up to max_retries times, at most max_in_flight trials are submitted to the process pool at
+    once, and progress is checkpointed to results.json so a resumed sweep skips trials that already have results
+    from the same planner, allocation strategy, number of chargers and depots and charging policy.
+    """
 
-    # Create separate resource managers
-    delivery_manager = DeliveryManager(delivery_list)
-    cell_manager = CellManager(occupied_cells)
+    def __init__(self, experiments, workers=None, render=False, resume=False, max_retries=2, max_in_flight=None,
+                 results_path="results.json", checkpoint_interval=1.0, planner="independent",
+                 event_driven=False, allocation="fifo", chargers=1, depots=1, charging="full",
+                 charging_curve="linear"):
+        self.workers = workers or os.cpu_count() or 1
+        self.render = render
+        self.planner = planner
+        self.event_driven = event_driven  # ignored for rendered trials, which tick with the window
+        self.allocation = allocation
+        self.chargers = chargers
+        self.depots = depots
+        self.charging = charging
+        self.charging_curve = charging_curve
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.results_path = results_path
+        self.checkpoint_interval = checkpoint_interval  # minimum seconds between results.json writes
+
+        # Results are keyed by grid type then bot count (as a string, matching what json.load gives back)
+        self.all_results = {}
+        if resume and os.path.exists(results_path):
+            with open(results_path, 'r') as f:
+                self.all_results = json.load(f)
+
+        completed = {(grid_type, int(bot_count), trial["trial"])
+                     for grid_type, counts in self.all_results.items()
+                     for bot_count, trials in counts.items()
+                     for trial in trials
+                     if "error" not in trial and trial.get("planner", "independent") == planner and
+                     trial.get("allocation", "fifo") == allocation and trial.get("chargers", 1) == chargers and
+                     trial.get("depots", 1) == depots and trial.get("charging", "full") == charging and
+                     trial.get("charging_curve", "linear") == charging_curve}
+
+        self.queue = deque(experiment for experiment in experiments
+                           if (experiment[0], experiment[1], experiment[2] + 1) not in completed)
+        self.skipped = len(experiments) - len(self.queue)
+        self.total = len(self.queue)
+        self.attempts = {}
+        self.finished = 0
+        self.last_checkpoint = 0.0
+
+    def run(self):
+        """Runs every queued trial and returns the aggregated results"""
+        if self.skipped:
+            print(f"Resuming - skipping {self.skipped} trial(s) already in {self.results_path}")
+        start_time = time.time()
+
+        if self.render or self.workers == 1:
+            self.run_in_process()
+        else:
+            self.run_in_pool()
+
+        self.save_results()
+        print(f"Ran {self.finished} trial(s) in {time.time() - start_time:.2f}s")
+        return self.all_results
+
+    def run_in_process(self):
+        while self.queue:
+            experiment = self.queue.popleft()
+            if self.render:
+                results = run_rendered_trial(experiment, self.planner, self.allocation, self.chargers, self.depots,
+                                             self.charging, self.charging_curve)
+            else:
+                results = run_trial(experiment, self.planner, self.event_driven, self.allocation, self.chargers,
+                                    self.depots, self.charging, self.charging_curve)
+            self.completed(experiment, results)
 
-    # Create the agents
-    agents = createAgents(canvas, noOfBots=bot_count, cell_size=cell_size, noOfRowsCols=noOfRowsCols,
-                          occupied_cells=occupied_cells, grid_choice=grid_type, delivery_list=delivery_list,
-                          delivery_manager=delivery_manager, cell_manager=cell_manager)
+    def run_in_pool(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        in_flight = {}
+        try:
+            while self.queue or in_flight:
+                # Keeping a bounded number of trials submitted so memory doesn't grow with the sweep size
+                while self.queue and len(in_flight) < self.max_in_flight:
+                    experiment = self.queue.popleft()
+                    in_flight[executor.submit(run_trial, experiment, self.planner, self.event_driven,
+                                                   self.allocation, self.chargers, self.depots, self.charging,
+                                                   self.charging_curve)] = experiment
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    experiment = in_flight.pop(future)
+                    broken |= not future.cancelled() and isinstance(future.exception(), BrokenProcessPool)
+                    self.completed(experiment, self.future_result(experiment, future))
+
+                if broken:
+                    # A worker died and took the pool down with it, so start a fresh one. Every trial still in flight
+                    # ends with its own future's result or error, and an error counts as an attempt - a trial that
+                    # keeps killing its worker runs out of retries instead of being requeued forever
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=self.workers)
+                    for future, experiment in in_flight.items():
+                        self.completed(experiment, self.future_result(experiment, future))
+                    in_flight = {}
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def future_result(self, experiment, future):
+        """Results of a finished pool future, or an error entry for the trial if it raised or was cancelled"""
+        try:
+            return future.result()
+        except Exception as e:
+            return self.error_result(experiment, e)
+
+    @staticmethod
+    def error_result(experiment, error):
+        grid_type, bot_count, trial, seed = experiment
+        return {"grid_type": grid_type, "bot_count": bot_count, "trial": trial + 1, "seed": seed,
+                "error": str(error) or type(error).__name__}
+
+    def completed(self, experiment, single_result):
+        """Stores a finished trial, or puts it back on the queue if it errored and has retries left"""
+        grid_type, bot_count, trial, seed = experiment
+
+        if "error" in single_result:
+            attempts = self.attempts.get(experiment, 0) + 1
+            self.attempts[experiment] = attempts
+            print(f"Error running experiment {grid_type}, {bot_count}, trial {trial + 1} "
+                  f"(attempt {attempts}): {single_result['error']}")
+            if attempts <= self.max_retries:
+                self.queue.append(experiment)
+                return
+
+        # Replacing any earlier entry for this trial (e.g. an error from a previous run) and keeping trial order
+        trials = self.all_results.setdefault(grid_type, {}).setdefault(str(bot_count), [])
+        trials[:] = [existing for existing in trials if existing["trial"] != single_result["trial"]]
+        trials.append(single_result)
+        trials.sort(key=lambda existing: existing["trial"])
+
+        self.finished += 1
+        print(f"Finished - {grid_type}, {bot_count} bot(s), trial: {trial + 1}/10 ({self.finished}/{self.total})")
 
-    # start the timer
-    start_time = time.time()
+        if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.save_results()
 
-    moveAgents(canvas, agents, noOfRowsCols, occupied_cells, bot_count, delivery_list, trial, callback_function,
-               start_time, grid_type)
-    window.mainloop()
+    def save_results(self):
+        """Checkpoints results.json - written to a temporary file first so an interrupted save can't corrupt it"""
+        temp_path = self.results_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.all_results, f, indent=4)
+        os.replace(temp_path, self.results_path)
+        self.last_checkpoint = time.time()
+
+
+def main(grid_type, bot_count, trial, callback_function=None, render=False, seed=None, planner="independent",
+         allocation="fifo", chargers=1, depots=1, charging="full", charging_curve="linear"):
+    """Runs a single trial and returns its results (None if the window was closed before the trial finished)"""
+    simulation = Simulation(grid_type, bot_count, trial, seed, planner, allocation=allocation, chargers=chargers,
+                            depots=depots, charging=charging, charging_curve=charging_curve)
+
+    if not render:
+        results = simulation.run()
+    else:
+        window = tk.Tk()
+        canvas = initialise(window)
+        drawEnvironment(canvas, simulation.cell_size, simulation.noOfRowsCols, simulation.occupied_cells)
+        drawAgents(canvas, simulation.agents, simulation.noOfRowsCols)
+
+        # mainloop() returns once moveAgents has destroyed the window at the end of the trial
+        moveAgents(canvas, simulation)
+        window.mainloop()
+        results = simulation.results
+
+    if results is not None and callback_function is not None:
+        # Pass a copy to the callback (to avoid reference issues)
+        callback_function(results.copy())
+    return results
 
 
 # Start the experiment
-launch_experiment()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-agent delivery experiments")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--seed", type=int, default=None, help="base seed the per-trial seeds are derived from")
+    parser.add_argument("--render", action="store_true", help="draw each trial with Tkinter (runs sequentially)")
+    parser.add_argument("--verbose", action="store_true", help="print per-tick bot status messages")
+    parser.add_argument("--resume", action="store_true", help="skip trials that already have results in results.json")
+    parser.add_argument("--retries", type=int, default=2, help="times an errored trial is retried")
+    parser.add_argument("--planner", choices=Simulation.planners, default="independent",
+                        help="independent A* per bot, D* Lite per bot replanning around neighbouring bots "
+                             "(incremental), or collision-free planning - Conflict-Based Search for the fleet (cbs) or "
+                             "windowed cooperative A* (whca)")
+    parser.add_argument("--allocation", choices=DeliveryManager.strategies, default="fifo",
+                        help="how deliveries are handed to the bots - in list order (fifo), nearest first, auctioned "
+                             "to the fleet to even out the bots' loads, or batched up to 3 packages per depot visit")
+    parser.add_argument("--chargers", type=int, default=1,
+                        help="chargers on each map - bots book the bays next to them and queue for a busy one")
+    parser.add_argument("--depots", type=int, default=1,
+                        help="depots on each map - bots book the bays next to them and queue for a busy one")
+    parser.add_argument("--charging", choices=ChargingPolicy.policies, default="full",
+                        help="how far bots charge - the full battery, charge_threshold of it, or what their next "
+                             "round of deliveries needs")
+    parser.add_argument("--charging-curve", choices=ChargingPolicy.curves, default="linear",
+                        help="charging rate - constant, or constant current then constant voltage, slowing as the "
+                             "battery fills (cccv)")
+    parser.add_argument("--event-driven", action="store_true",
+                        help="skip the ticks in which no bot makes a decision or crosses a cell (headless trials only)")
+    parser.add_argument("--lifelong", nargs=2, metavar=("GRID_TYPE", "BOT_COUNT"),
+                        help="run lifelong trials with delivery requests arriving at 2, 4, 8 and 16 per 1000 ticks and "
+                             "report throughput and delivery latency instead of running the sweep")
+    parser.add_argument("--replay", nargs=3, metavar=("GRID_TYPE", "BOT_COUNT", "TRIAL"),
+                        help="re-run one trial from results.json with its recorded seed and planner instead of running "
+                             "the sweep")
+    parser.add_argument("--benchmark-planners", action="store_true",
+                        help="time independent A* against CBS and cooperative A* for 8-50 agents instead of running "
+                             "the sweep")
+    parser.add_argument("--benchmark-hierarchy", action="store_true",
+                        help="time cross-map queries on the 500x500 and 1000x1000 maps with HPA* against A* instead "
+                             "of running the sweep")
+    parser.add_argument("--benchmark-fleet", action="store_true",
+                        help="time ticks per second for 8 to 5000 bots with Bot objects and with a vectorised Fleet "
+                             "instead of running the sweep")
+    args = parser.parse_args()
+    if not args.replay:  # replays use the counts recorded with the trial
+        try:
+            check_stations([args.lifelong[0]] if args.lifelong else sweep_grid_types, args.chargers, args.depots)
+        except ValueError as e:
+            parser.error(str(e))
+
+    verbose_logging = args.verbose
+    if args.lifelong:
+        lifelong_experiment(args.lifelong[0], int(args.lifelong[1]), seed=args.seed or 0, planner=args.planner,
+                            allocation=args.allocation, event_driven=args.event_driven, chargers=args.chargers,
+                            depots=args.depots, charging=args.charging, charging_curve=args.charging_curve)
+    elif args.replay:
+        replay_trial(args.replay[0], int(args.replay[1]), int(args.replay[2]), render=args.render,
+                     event_driven=args.event_driven)
+    elif args.benchmark_planners:
+        benchmark_planners(seed=args.seed or 0)
+    elif args.benchmark_hierarchy:
+        benchmark_hierarchy(seed=args.seed or 0)
+    elif args.benchmark_fleet:
+        benchmark_fleet(seed=args.seed or 0)
+    else:
+        launch_experiment(workers=args.workers, base_seed=args.seed, render=args.render, resume=args.resume,
+                          max_retries=args.retries, planner=args.planner,
+                          event_driven=args.event_driven, allocation=args.allocation, chargers=args.chargers,
+                          depots=args.depots, charging=args.charging, charging_curve=args.charging_curve)
@@ -0,0 +1,90 @@
+import subprocess
+import sys
+from collections import Counter, deque
+
+import pytest
+
+import main
+
+MAIN = main.__file__
+
+
+def reachable(occupied_cells, start):
+    """Free cells reachable from start"""
+    n = occupied_cells.noOfRowsCols
+    seen = {start}
+    frontier = deque([start])
+    while frontier:
+        x, y = frontier.popleft()
+        for cell in main.finding_free_neighbours(x, y, n, occupied_cells):
+            if cell not in seen:
+                seen.add(cell)
+                frontier.append(cell)
+    return seen
+
+
+def accepted_counts(grid_type):
+    """Every charger and depot count the CLI lets through for the map type"""
+    counts = []
+    for chargers in range(1, 16):
+        for depots in range(1, 8):
+            try:
+                main.check_stations([grid_type], chargers, depots)
+            except ValueError:
+                continue
+            counts.append((chargers, depots))
+    return counts
+
+
+@pytest.mark.parametrize("grid_type", main.sweep_grid_types)
+def test_every_accepted_station_count_builds(grid_type):
+    counts = accepted_counts(grid_type)
+    assert (2, 2) in counts  # the README example
+    for chargers, depots in counts:
+        for seed in range(3):
+            _, n, occupied_cells = main.createEnvironment(grid_type, seed=seed, chargers=chargers, depots=depots)
+            assert len(occupied_cells[0]) == 2 * depots and len(occupied_cells[1]) == chargers
+            stations = [tuple(cell) for layer in (0, 1) for cell in occupied_cells[layer]]
+            assert len(set(stations)) == len(stations)
+            assert all(y == 0 and x <= n - 3 for x, y in stations)  # clear of the starting point
+            # Every station keeps a bay the bots can reach from the starting point
+            free = reachable(occupied_cells, (n - 1, 0))
+            for x, y in stations:
+                assert free.intersection(main.finding_free_neighbours(x, y, n, occupied_cells))
+
+
+@pytest.mark.parametrize("grid_type", ["city", "metropolis"])
+def test_city_maps_take_many_stations(grid_type):
+    n, _, _, _, x_scale = main.grid_layout(grid_type)
+    depot_cells, charger_cells = main.station_cells(n, x_scale, chargers=20, depots=20)
+    stations = [tuple(cell) for cell in depot_cells + charger_cells]
+    assert len(set(stations)) == len(stations) == 60
+
+
+def test_cli_rejects_stations_that_do_not_fit():
+    result = subprocess.run([sys.executable, MAIN, "--depots", "4"], capture_output=True, text=True, timeout=120)
+    assert result.returncode == 2
+    assert "urban map: No room for 1 chargers and 4 depots" in result.stderr
+
+
+def test_cell_stays_reserved_until_every_holder_has_left():
+    _, _, occupied_cells = main.createEnvironment("urban", seed=0)
+    cell_manager = main.CellManager(occupied_cells)
+    bay = (3, 1)
+    cell_manager.reserve_cell(bay)  # the charging bot
+    cell_manager.reserve_cell(bay)  # the next one in its queue, waiting on the bay
+    cell_manager.release_cell(bay)
+    assert occupied_cells.has_flag(*bay, main.AGENT_FLAG) and list(bay) in occupied_cells[4]
+    cell_manager.release_cell(bay)
+    assert not occupied_cells.has_flag(*bay, main.AGENT_FLAG) and list(bay) not in occupied_cells[4]
+
+
+@pytest.mark.parametrize("vectorised", [False, True])
+@pytest.mark.parametrize("planner", ["independent", "whca"])
+def test_agent_layer_counts_the_cells_the_bots_hold(planner, vectorised):
+    simulation = main.Simulation("suburban", 5, 0, 3, planner, vectorised=vectorised, chargers=2)
+    while not simulation.step():
+        if simulation.tick % 50 == 0:
+            held = Counter(cell for ag in simulation.agents
+                           for cell in main.reserved_cells(ag.current_reserve, ag.next_reserve))
+            assert dict(simulation.occupied_cells[4]) == held
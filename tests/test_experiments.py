@@ -0,0 +1,48 @@
+import json
+import os
+
+import main
+
+
+def fake_trial(experiment, *args):
+    """Stand-in for run_trial in the pool workers - urban trial 1 kills its worker every time it runs"""
+    grid_type, bot_count, trial, seed = experiment
+    if grid_type == "urban" and trial == 0:
+        os._exit(1)
+    return {"grid_type": grid_type, "bot_count": bot_count, "trial": trial + 1, "seed": seed, "completion_time": 1.0}
+
+
+def test_worker_crash_uses_up_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "run_trial", fake_trial)  # the pool forks, so the workers see the stand-in
+    experiments = [("urban", 1, trial, 100 + trial) for trial in range(3)]
+    scheduler = main.ExperimentScheduler(experiments, workers=2, max_retries=2,
+                                         results_path=str(tmp_path / "results.json"))
+    scheduler.run()
+
+    trials = {entry["trial"]: entry for entry in scheduler.all_results["urban"]["1"]}
+    assert set(trials) == {1, 2, 3}
+    assert "error" in trials[1] and trials[1]["seed"] == 100  # errored entries can still be replayed
+    assert scheduler.attempts[experiments[0]] == 3  # the first run and both retries, then no more
+    assert "error" not in trials[2] and "error" not in trials[3]
+
+
+def test_error_result_keeps_the_seed():
+    entry = main.ExperimentScheduler.error_result(("rural", 3, 4, 1234), RuntimeError("boom"))
+    assert entry == {"grid_type": "rural", "bot_count": 3, "trial": 5, "seed": 1234, "error": "boom"}
+
+
+def test_analyse_results_leaves_out_errored_trials(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)  # the graph and the metrics table are written to the working directory
+    done = {"completion_time": 12.5, "bots_failed": 0, "failed_delivery_points": 0, "all_deliveries_completed": True,
+            "deliveries_completed": 20}
+    results = {"urban": {"1": [dict(done, trial=1), {"trial": 2, "seed": 7, "error": "boom"}],
+                         "3": [{"trial": 1, "seed": 8, "error": "boom"}]},
+               "rural": {"1": [dict(done, trial=1)]}}
+    with open("results.json", "w") as f:
+        json.dump(results, f)
+
+    main.analyse_results("results.json")
+
+    assert "Leaving out 2 errored trial(s)" in capsys.readouterr().out
+    assert (tmp_path / "complete_time_agent_graph.png").exists()
+    assert (tmp_path / "experiment_metrics.html").exists()
@@ -0,0 +1,13 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("planner", ["cbs", "whca"])
+@pytest.mark.parametrize("seed, chargers", [(11, 2), (main.trial_seed(1, "urban", 8, 2), 1)])
+def test_coordinated_planners_get_out_of_jams(planner, seed, chargers):
+    # Urban trials where bots queued in a corridor for a cell held by a bot that had to come out past them, and the
+    # planners couldn't untangle them before the tick cap
+    results = main.Simulation("urban", 8, 0, seed, planner, chargers=chargers, max_ticks=30000).run()
+    assert not results["timed_out"]
+    assert results["all_deliveries_completed"]